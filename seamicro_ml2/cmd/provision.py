@@ -0,0 +1,412 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Bulk provisioning of networks and ports from a manifest.
+
+    seamicro-ml2-provision --config-file /etc/neutron/neutron.conf \\
+        --config-file /etc/neutron/plugins/ml2/ml2_conf_seamicro.ini \\
+        manifest.json
+
+The manifest is a JSON document of the form
+
+    {"networks": [{"id": "<network id>", "vlan": 100,
+                   "tenant_id": "<tenant id>", "segment_id": "<id>"}],
+     "ports": [{"id": "<port id>", "network_id": "<network id>",
+                "tenant_id": "<tenant id>", "host": "compute1"}]}
+
+where a port gives either the host it is bound to, or its "switch_ip",
+"server_id" and optional "nics" directly.
+
+The rows are written to the database first, in batches, skipping the ones
+which exist already. Then the segments, uplinks and server nics of every
+chassis are compared with the database and the missing vlans are pushed,
+all chassis concurrently, batch_size requests at a time within the rate
+limits of the chassis. Running the command again with the same manifest
+resumes where it stopped, the chassis completed are recorded in the
+progress file. A changed manifest is pushed to every chassis again.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import eventlet
+from oslo_config import cfg
+
+from neutron.common import config as common_config
+from neutron import context as neutron_context
+from neutron.i18n import _LE, _LI, _LW
+from neutron.openstack.common import log
+
+from seamicro_ml2.common import config  # noqa
+from seamicro_ml2.common import inventory
+from seamicro_ml2.db import models as seamicro_db
+from seamicro_ml2.ml2 import mech_driver
+
+LOG = log.getLogger(__name__)
+
+SWITCH_SECTION = 'ml2_mech_seamicro'
+
+cli_opts = [
+    cfg.StrOpt('manifest', positional=True,
+               help=_("JSON manifest of the networks and ports.")),
+    cfg.IntOpt('workers', default=16,
+               help=_("Number of chassis provisioned concurrently.")),
+    cfg.IntOpt('batch_size', default=100,
+               help=_("Number of rows written per transaction, and of "
+                      "requests in flight to a single chassis.")),
+    cfg.StrOpt('progress_file',
+               help=_("File recording the chassis already provisioned "
+                      "with the manifest, defaults to the manifest path "
+                      "with a .progress suffix.")),
+]
+
+
+def read_switches(config_files):
+    """Read the [ml2_mech_seamicro:<ip>] sections of config_files."""
+    parser = cfg.MultiConfigParser()
+    parser.read(config_files)
+    switches = {}
+    for parsed in parser.parsed:
+        for section, values in parsed.items():
+            name, sep, switch_ip = section.partition(':')
+            if name.strip().lower() != SWITCH_SECTION or not sep:
+                continue
+            params = switches.setdefault(switch_ip.strip(), {})
+            for key, value in values.items():
+                params[key] = value[0]
+    return switches
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Summary(object):
+
+    """Counts and timings of a provisioning run."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.networks = 0
+        self.networks_skipped = 0
+        self.ports = 0
+        self.ports_skipped = 0
+        self.ports_unplaced = 0
+        self.requests = 0
+        self.failures = []
+        self.chassis_done = 0
+        self.chassis_skipped = 0
+
+    def report(self):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        lines = [
+            _("networks: %(new)d created, %(skipped)d already present") %
+            {'new': self.networks, 'skipped': self.networks_skipped},
+            _("ports: %(new)d created, %(skipped)d already present, "
+              "%(unplaced)d without a known host or network") %
+            {'new': self.ports, 'skipped': self.ports_skipped,
+             'unplaced': self.ports_unplaced},
+            _("chassis: %(done)d provisioned, %(skipped)d already done, "
+              "%(failed)d failed") %
+            {'done': self.chassis_done, 'skipped': self.chassis_skipped,
+             'failed': len(set(f[0] for f in self.failures))},
+            _("%(requests)d chassis requests, %(failures)d failed, in "
+              "%(seconds).1fs (%(rate).1f requests/s, %(rows).1f rows/s)") %
+            {'requests': self.requests, 'failures': len(self.failures),
+             'seconds': elapsed, 'rate': self.requests / elapsed,
+             'rows': (self.networks + self.ports) / elapsed}]
+        lines.extend('  %s: %s: %s' % failure for failure in self.failures)
+        return '\n'.join(lines)
+
+
+def manifest_key(manifest):
+    """Return a digest of the content of a manifest."""
+    return hashlib.sha1(json.dumps(manifest, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+
+
+class Progress(object):
+
+    """Chassis already provisioned, kept in a JSON file.
+
+    The chassis recorded are only taken as done when the file was written
+    for the same key, see manifest_key().
+    """
+
+    def __init__(self, path, key=None):
+        self._path = path
+        self._key = key
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                progress = json.load(f)
+            if progress.get('manifest') == key:
+                self.done = set(progress.get('chassis', []))
+
+    def mark_done(self, switch_ip):
+        self.done.add(switch_ip)
+        if not self._path:
+            return
+        tmp_path = '%s.%d.tmp' % (self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'manifest': self._key, 'chassis': sorted(self.done)},
+                      f)
+        os.rename(tmp_path, self._path)
+
+
+class Provisioner(object):
+
+    """Write the rows of a manifest and push them to the chassis.
+
+    :param clients: mapping of chassis ip to GreenSeaMicroClient.
+    :param locate: function returning the (switch_ip, server_id, nics) of
+                   a host, all None for an unknown host.
+    """
+
+    def __init__(self, context, clients, locate, batch_size=100,
+                 workers=16, lazy_segments=False, progress=None):
+        self._context = context
+        self._clients = clients
+        self._locate = locate
+        self._batch_size = batch_size
+        self._workers = workers
+        self._lazy_segments = lazy_segments
+        self._progress = progress or Progress(None)
+        self.summary = Summary()
+
+    def run(self, manifest):
+        self.load_networks(manifest.get('networks', []))
+        self.load_ports(manifest.get('ports', []))
+        self.push()
+        return self.summary
+
+    def load_networks(self, networks):
+        session = self._context.session
+        for batch in _batches(networks, self._batch_size):
+            with session.begin(subtransactions=True):
+                existing = set(row.id for row in session.query(
+                    seamicro_db.ML2_SeaMicroNetwork.id).filter(
+                        seamicro_db.ML2_SeaMicroNetwork.id.in_(
+                            [net['id'] for net in batch])))
+                for net in batch:
+                    if net['id'] in existing:
+                        self.summary.networks_skipped += 1
+                        continue
+                    existing.add(net['id'])
+                    session.add(seamicro_db.ML2_SeaMicroNetwork(
+                        id=net['id'], vlan=int(net['vlan']),
+                        segment_id=net.get('segment_id'),
+                        network_type='vlan',
+                        tenant_id=net.get('tenant_id')))
+                    self.summary.networks += 1
+
+    def _placement(self, port):
+        if port.get('switch_ip'):
+            return (port['switch_ip'], port['server_id'],
+                    list(port.get('nics', ())))
+        return self._locate(port.get('host'))
+
+    def load_ports(self, ports):
+        session = self._context.session
+        vlans = {}
+        for batch in _batches(ports, self._batch_size):
+            with session.begin(subtransactions=True):
+                existing = set(row.id for row in session.query(
+                    seamicro_db.ML2_SeaMicroPort.id).filter(
+                        seamicro_db.ML2_SeaMicroPort.id.in_(
+                            [port['id'] for port in batch])))
+                for port in batch:
+                    if port['id'] in existing:
+                        self.summary.ports_skipped += 1
+                        continue
+                    existing.add(port['id'])
+                    network_id = port['network_id']
+                    if network_id not in vlans:
+                        network = seamicro_db.get_network(self._context,
+                                                          network_id)
+                        vlans[network_id] = network and network.vlan
+                    vlan_id = vlans[network_id]
+                    switch_ip, server_id, nics = self._placement(port)
+                    session.add(seamicro_db.ML2_SeaMicroPort(
+                        id=port['id'], network_id=network_id,
+                        vlan_id=vlan_id, tenant_id=port.get('tenant_id'),
+                        switch_ip=switch_ip, server_id=server_id,
+                        nics=','.join(nics or ())))
+                    self.summary.ports += 1
+                    if switch_ip is None or vlan_id is None:
+                        self.summary.ports_unplaced += 1
+                        continue
+                    seamicro_db.add_server_vlan(self._context, switch_ip,
+                                                server_id, nics, vlan_id)
+
+    def push(self):
+        network_vlans = seamicro_db.get_network_vlans(self._context)
+        pool = eventlet.GreenPool(self._workers)
+        for switch_ip in sorted(self._clients):
+            if switch_ip in self._progress.done:
+                self.summary.chassis_skipped += 1
+                continue
+            pool.spawn_n(self._push_chassis, switch_ip, network_vlans)
+        pool.waitall()
+
+    def _run(self, switch_ip, calls):
+        """Run the (description, call) pairs batch_size at a time.
+
+        :returns: False if any of them failed.
+        """
+        ok = True
+        for batch in _batches(calls, self._batch_size):
+            futures = [(what, call()) for what, call in batch]
+            for what, future in futures:
+                self.summary.requests += 1
+                try:
+                    future.wait()
+                except Exception as ex:
+                    ok = False
+                    self.summary.failures.append((switch_ip, what, ex))
+        return ok
+
+    def _push_chassis(self, switch_ip, network_vlans):
+        try:
+            ok = self._sync_chassis(switch_ip, network_vlans)
+        except Exception as ex:
+            LOG.exception(_LE("SeaMicro provisioning: failed on chassis %s"),
+                          switch_ip)
+            self.summary.failures.append((switch_ip, 'read', ex))
+            return
+        if ok:
+            self._progress.mark_done(switch_ip)
+            self.summary.chassis_done += 1
+            LOG.info(_LI("SeaMicro provisioning: chassis %s done"),
+                     switch_ip)
+        else:
+            LOG.warning(_LW("SeaMicro provisioning: chassis %s incomplete, "
+                            "run again to retry"), switch_ip)
+
+    def _sync_chassis(self, switch_ip, network_vlans):
+        client = self._clients[switch_ip]
+        in_use = seamicro_db.get_chassis_vlans(self._context, switch_ip)
+        wanted = in_use if self._lazy_segments else network_vlans | in_use
+
+        missing = wanted - client.get_segments().wait()
+        ok = self._run(switch_ip, [
+            ('segment %d' % vlan, lambda vlan=vlan: client.add_segment(vlan))
+            for vlan in missing])
+
+        uplinks = client.get_interface_vlans().wait().values()
+        missing = in_use - (self._common(uplinks) if uplinks else in_use)
+        ok = self._run(switch_ip, [
+            ('uplinks %d' % vlan,
+             lambda vlan=vlan: client.tag_interfaces(vlan))
+            for vlan in missing]) and ok
+
+        servers = {}
+        for (server_id, nic), bitmap in seamicro_db.get_server_vlan_bitmaps(
+                self._context, switch_ip).items():
+            servers.setdefault(server_id, {})[nic] = bitmap
+        calls = []
+        for batch in _batches(sorted(servers), self._batch_size):
+            reads = [(server_id, client.get_server_vlans(server_id))
+                     for server_id in batch]
+            for server_id, read in reads:
+                self.summary.requests += 1
+                try:
+                    nics = read.wait()
+                except Exception as ex:
+                    ok = False
+                    self.summary.failures.append(
+                        (switch_ip, 'server %s' % server_id, ex))
+                    continue
+                calls.extend(self._server_calls(client, server_id, nics,
+                                                servers[server_id]))
+        return self._run(switch_ip, calls) and ok
+
+    @staticmethod
+    def _common(bitmaps):
+        bitmaps = list(bitmaps)
+        common = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            common = common & bitmap
+        return common
+
+    def _server_calls(self, client, server_id, nics, wanted):
+        """Return the tagging calls of the vlans a server is missing.
+
+        :param nics: the tagged vlans of the server, by nic.
+        :param wanted: the vlans it should have, by nic, '' standing for
+                       all nics.
+        """
+        calls = []
+        for nic, bitmap in sorted(wanted.items()):
+            if nic:
+                have = nics.get(nic)
+                nic_list = [nic]
+            else:
+                have = self._common(nics.values()) if nics else None
+                nic_list = None
+            missing = bitmap - have if have is not None else bitmap
+            for vlan in missing:
+                calls.append(('server %s vlan %d' % (server_id, vlan),
+                              lambda vlan=vlan, nic_list=nic_list:
+                              client.tag_server(server_id, vlan, nic_list)))
+        return calls
+
+
+def main():
+    eventlet.monkey_patch()
+    cfg.CONF.register_cli_opts(cli_opts)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    conf = cfg.CONF
+    if not conf.manifest:
+        sys.exit(_("A manifest is required"))
+
+    with open(conf.manifest) as f:
+        manifest = json.load(f)
+    switches = read_switches(conf.config_file)
+    hosts = inventory.index_switches(switches, mech_driver.SWITCH_PARAMS)
+    host_inventory = None
+    if conf.ml2_mech_seamicro.host_inventory_file:
+        host_inventory = inventory.HostInventory(
+            conf.ml2_mech_seamicro.host_inventory_file, switches)
+
+    def locate(host):
+        return mech_driver._get_switch_info(hosts, host, host_inventory)
+
+    clients = {}
+    failures = []
+    for switch_ip, params in sorted(switches.items()):
+        try:
+            clients[switch_ip] = mech_driver.build_client(switch_ip, params)
+        except Exception as ex:
+            LOG.exception(_LE("SeaMicro provisioning: failed to connect to "
+                              "chassis %s"), switch_ip)
+            failures.append((switch_ip, 'connect', ex))
+
+    progress = Progress(conf.progress_file or conf.manifest + '.progress',
+                        manifest_key(manifest))
+    provisioner = Provisioner(
+        neutron_context.get_admin_context(), clients, locate,
+        batch_size=conf.batch_size, workers=conf.workers,
+        lazy_segments=conf.ml2_mech_seamicro.lazy_segments,
+        progress=progress)
+    provisioner.summary.failures.extend(failures)
+    summary = provisioner.run(manifest)
+    print(summary.report())
+    return 1 if summary.failures else 0
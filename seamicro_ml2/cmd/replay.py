@@ -0,0 +1,223 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Replay captured chassis requests offline.
+
+    seamicro-ml2-replay [--speed 10] [--target driver] \\
+        [--config-file ml2_conf_seamicro.ini] [--output stats.json] \\
+        [--compare other_build.json] capture.1234 capture.1234.1 ...
+
+Each request is sent at its captured time, divided by --speed, to a fake
+chassis which answers after the captured latency, also divided by --speed,
+with the captured outcome. With --target fake the requests go straight to
+the fake chassis, which checks the replay itself. With --target driver
+they go through the GreenSeaMicroClient of this build, with the chassis
+limits of --config-file, so the latency includes the time spent waiting
+for the rate and concurrency limits.
+
+The latencies and throughput of the replay are reported next to the ones
+captured, and to the ones of another build saved with --output and given
+with --compare. They are reported in captured time whatever the speed.
+"""
+
+import argparse
+import json
+import time
+
+import eventlet
+from oslo_config import cfg
+
+from seamicro_ml2.common import capture
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import config  # noqa
+
+TOTAL = 'total'
+
+
+class ReplayedError(Exception):
+
+    """The error a captured request failed with."""
+
+    def __init__(self, name):
+        self.message = name
+        super(ReplayedError, self).__init__(name)
+
+
+class FakeChassis(object):
+
+    """Answers a captured request as it was answered when captured."""
+
+    def __init__(self, speed=1.0):
+        self._speed = speed
+
+    def answer(self, record):
+        eventlet.sleep(record['l'] / self._speed)
+        if record.get('e'):
+            raise ReplayedError(record['e'])
+
+
+def _percentile(values, fraction):
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(samples, duration):
+    """Compute the latency and throughput figures of samples.
+
+    :param samples: list of (method, latency, failed) tuples.
+    :param duration: seconds taken to send and answer all of them.
+    :returns: a dict of figures by method, and for all under TOTAL.
+    """
+    by_method = {TOTAL: []}
+    for method, latency, failed in samples:
+        by_method.setdefault(method, []).append((latency, failed))
+        by_method[TOTAL].append((latency, failed))
+    stats = {}
+    for method, values in by_method.items():
+        latencies = sorted(latency for latency, failed in values)
+        if not latencies:
+            continue
+        stats[method] = {
+            'count': len(values),
+            'errors': sum(1 for latency, failed in values if failed),
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'max': latencies[-1],
+            'rate': len(values) / duration if duration > 0 else 0.0}
+    return stats
+
+
+def captured_stats(records):
+    """Return the figures of the requests as they were captured."""
+    if not records:
+        return {}
+    end = max(record['t'] + record['l'] for record in records)
+    duration = end - records[0]['t']
+    return summarize([(record['m'], record['l'], bool(record.get('e')))
+                      for record in records], duration)
+
+
+def _build_clients(records):
+    conf = cfg.CONF.ml2_mech_seamicro
+    return dict((switch_ip, seamicro_client.GreenSeaMicroClient(
+        None, max_requests=conf.chassis_max_requests,
+        min_requests=conf.chassis_min_requests,
+        rate=conf.chassis_rate_limit, burst=conf.chassis_rate_burst,
+        latency_target=conf.chassis_latency_target,
+        max_wait=conf.chassis_background_max_wait))
+        for switch_ip in set(record['c'] for record in records))
+
+
+def replay(records, speed=1.0, target='fake'):
+    """Replay records, returning the figures of the replay."""
+    if not records:
+        return {}
+    fake = FakeChassis(speed)
+    clients = _build_clients(records) if target == 'driver' else {}
+    samples = []
+
+    def landed(future, record, sent):
+        latency = (time.time() - sent) * speed
+        try:
+            future.wait()
+            failed = False
+        except ReplayedError:
+            failed = True
+        samples.append((record['m'], latency, failed))
+
+    first = records[0]['t']
+    start = time.time()
+    futures = []
+    for record in records:
+        delay = start + (record['t'] - first) / speed - time.time()
+        if delay > 0:
+            eventlet.sleep(delay)
+        if target == 'driver':
+            future = clients[record['c']].spawn(fake.answer, record)
+        else:
+            future = eventlet.spawn(fake.answer, record)
+        future.link(landed, record, time.time())
+        futures.append(future)
+    for future in futures:
+        try:
+            future.wait()
+        except ReplayedError:
+            pass
+    return summarize(samples, (time.time() - start) * speed)
+
+
+def _format(stats, method):
+    figures = stats.get(method)
+    if figures is None:
+        return '%38s' % '-'
+    return '%6d %5d %7.3f %7.3f %8.1f' % (
+        figures['count'], figures['errors'], figures['p50'], figures['p95'],
+        figures['rate'])
+
+
+def _change(new, old, key):
+    if not new or not old or not old[key]:
+        return '%7s' % '-'
+    return '%+6.0f%%' % ((new[key] - old[key]) * 100.0 / old[key])
+
+
+def report(replayed, baseline, baseline_name):
+    """Format the replay figures next to the baseline ones."""
+    header = '%6s %5s %7s %7s %8s' % ('count', 'errs', 'p50', 'p95', 'req/s')
+    lines = ['%-30s %-38s | %-38s | %s' % ('', baseline_name, 'replay',
+                                           'change'),
+             '%-30s %s | %s | %7s %7s' % ('method', header, header, 'p95',
+                                          'req/s')]
+    methods = sorted((set(replayed) | set(baseline)) - set([TOTAL]))
+    for method in methods + [TOTAL]:
+        lines.append('%-30s %s | %s | %s %s' % (
+            method, _format(baseline, method), _format(replayed, method),
+            _change(replayed.get(method), baseline.get(method), 'p95'),
+            _change(replayed.get(method), baseline.get(method), 'rate')))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('captures', nargs='+',
+                        help='capture files, including the rotated ones')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 10 replays 10 times faster')
+    parser.add_argument('--target', choices=('fake', 'driver'),
+                        default='driver')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='configuration with the chassis limits')
+    parser.add_argument('--output', help='save the replay figures as JSON')
+    parser.add_argument('--compare',
+                        help='replay figures of another build, as saved by '
+                             '--output, to compare with')
+    args = parser.parse_args(argv)
+    config_args = []
+    for config_file in args.config_file:
+        config_args.extend(['--config-file', config_file])
+    cfg.CONF(config_args, project='neutron')
+
+    records = capture.read_capture(args.captures)
+    replayed = replay(records, args.speed, args.target)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline, name = json.load(f), 'compared'
+    else:
+        baseline, name = captured_stats(records), 'captured'
+    print(report(replayed, baseline, name))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(replayed, f, indent=1, sort_keys=True)
+    return 0
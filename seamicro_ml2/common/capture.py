@@ -0,0 +1,111 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Capture of the requests sent to the chassis, for offline replay.
+
+Every request is a JSON line of the capture file with the keys
+    t  time the request was sent, in seconds since the epoch
+    c  chassis ip
+    m  <manager>.<method>, e.g. servers.set_tagged_vlan
+    o  id of the resource the method was called on, if any
+    a  positional arguments
+    k  keyword arguments
+    l  latency in seconds
+    e  class name of the error raised, if any
+"""
+
+import json
+import logging
+from logging import handlers
+import os
+import time
+
+from seamicro_ml2.common import instrumentation
+
+_captures = {}
+
+
+class CaptureFile(object):
+
+    """Rotating file of captured requests.
+
+    Each process writes its own file, path suffixed with its pid, which is
+    rotated to .1, .2 and so on once it reaches max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self._handler = handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        self._handler.handle(logging.makeLogRecord({'msg': line}))
+
+    def close(self):
+        self._handler.close()
+
+
+def get_capture(path, max_bytes=64 * 1024 * 1024, backup_count=5):
+    """Return the CaptureFile of the calling process for path."""
+    path = '%s.%d' % (path, os.getpid())
+    capture = _captures.get(path)
+    if capture is None:
+        capture = _captures[path] = CaptureFile(path, max_bytes,
+                                                backup_count)
+    return capture
+
+
+def read_capture(paths):
+    """Read the requests of capture files, ordered by the time sent.
+
+    Lines which cannot be parsed, such as a line cut short by a crash,
+    are skipped.
+    """
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    records.sort(key=lambda record: record['t'])
+    return records
+
+
+class CapturingClient(instrumentation.ClientProxy):
+
+    """Proxy over a seamicroclient writing every request to a capture."""
+
+    def __init__(self, target, capture, switch_ip):
+        super(CapturingClient, self).__init__(target)
+        self._capture = capture
+        self._switch_ip = switch_ip
+
+    def _call(self, method, func, args, kwargs):
+        start = time.time()
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except Exception as ex:
+            error = ex.__class__.__name__
+            raise
+        finally:
+            self._capture.write({
+                't': round(start, 6), 'c': self._switch_ip, 'm': method,
+                'o': self._object_id, 'a': args, 'k': kwargs,
+                'l': round(time.time() - start, 6), 'e': error})
@@ -0,0 +1,142 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Background bootstrap of the per chassis SeaMicro clients."""
+
+import time
+
+import eventlet
+from eventlet import event
+
+from neutron.i18n import _LE, _LI
+from neutron.openstack.common import log
+
+LOG = log.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ChassisNotReady(Exception):
+
+    """The client of a chassis has not been built in time."""
+
+    def __init__(self, switch_ip):
+        self.message = _("SeaMicro chassis %s is not ready") % switch_ip
+        super(ChassisNotReady, self).__init__(self.message)
+
+
+class ChassisClients(object):
+
+    """Chassis ip to SeaMicro client mapping built in the background.
+
+    Every client is built concurrently, so a chassis that is slow or down
+    delays neither neutron-server startup nor the other chassis. Looking a
+    chassis up waits until its client is ready, up to ready_timeout
+    seconds, and raises ChassisNotReady after that. A chassis whose client
+    cannot be built is retried every retry_interval seconds.
+    """
+
+    def __init__(self, switch_ips, build, ready_timeout=60, workers=16,
+                 retry_interval=10):
+        self._build = build
+        self._ready_timeout = ready_timeout
+        self._retry_interval = retry_interval
+        self._pool = eventlet.GreenPool(workers)
+        self._clients = {}
+        self._ready = dict((ip, event.Event()) for ip in switch_ips)
+        self._state = dict((ip, PENDING) for ip in switch_ips)
+        self._started_at = None
+        self.startup_time = None
+
+    def start(self):
+        self._started_at = time.time()
+        for switch_ip in self._ready:
+            self._pool.spawn_n(self._bootstrap, switch_ip)
+        if not self._ready:
+            self._report()
+
+    def _bootstrap(self, switch_ip):
+        while True:
+            try:
+                client = self._build(switch_ip)
+                break
+            except Exception:
+                LOG.exception(_LE("SeaMicro driver: failed to connect to "
+                                  "chassis %(switch_ip)s, retrying in "
+                                  "%(interval)s seconds"),
+                              {'switch_ip': switch_ip,
+                               'interval': self._retry_interval})
+                self._state[switch_ip] = FAILED
+                eventlet.sleep(self._retry_interval)
+
+        self._clients[switch_ip] = client
+        self._state[switch_ip] = READY
+        self._ready[switch_ip].send(client)
+        LOG.info(_LI("SeaMicro driver: chassis %(switch_ip)s ready after "
+                     "%(seconds).2fs"),
+                 {'switch_ip': switch_ip,
+                  'seconds': time.time() - self._started_at})
+        if all(state == READY for state in self._state.values()):
+            self._report()
+
+    def _report(self):
+        self.startup_time = time.time() - (self._started_at or time.time())
+        LOG.info(_LI("SeaMicro driver: %(count)d chassis ready in "
+                     "%(seconds).2fs"),
+                 {'count': len(self._clients),
+                  'seconds': self.startup_time})
+
+    def wait(self, switch_ip, timeout=None):
+        """Return the client of switch_ip, waiting for it if needed."""
+        client = self._clients.get(switch_ip)
+        if client is not None:
+            return client
+        ready = self._ready[switch_ip]
+        if timeout is None:
+            timeout = self._ready_timeout
+        with eventlet.Timeout(timeout, False):
+            return ready.wait()
+        raise ChassisNotReady(switch_ip)
+
+    def __getitem__(self, switch_ip):
+        return self.wait(switch_ip)
+
+    def __contains__(self, switch_ip):
+        return switch_ip in self._ready
+
+    def __iter__(self):
+        return iter(self._ready)
+
+    def __len__(self):
+        return len(self._ready)
+
+    def is_ready(self, switch_ip):
+        return self._state.get(switch_ip) == READY
+
+    def status(self):
+        """Return the readiness state of every chassis."""
+        return dict(self._state)
+
+    def stats(self):
+        """Return the state and the client stats of every chassis."""
+        stats = {}
+        for switch_ip, state in self._state.items():
+            stats[switch_ip] = {'state': state}
+            client = self._clients.get(switch_ip)
+            if client is not None and hasattr(client, 'stats'):
+                stats[switch_ip].update(client.stats())
+        return stats
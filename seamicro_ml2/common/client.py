@@ -13,8 +13,25 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
+import fnmatch
+import sys
+import time
+
+from eventlet import event
+import six
+
+from neutron.i18n import _LW
 from neutron.openstack.common import log
 from oslo_utils import importutils
+
+from seamicro_ml2.common import hotlog
+from seamicro_ml2.common import instrumentation
+from seamicro_ml2.common import ratelimit
+from seamicro_ml2.common import state as chassis_state
+from seamicro_ml2.common import vlans
+
 seamicroclient = importutils.try_import('seamicroclient')
 if seamicroclient:
     from seamicroclient import client as seamicro_client
@@ -37,11 +54,468 @@ class SeaMicroRestClient(object):
         cl_kwargs = {'username': kwargs['username'],
                      'password': kwargs['password'],
                      'auth_url': kwargs['api_endpoint']}
-        LOG.debug("****  %s", cl_kwargs)
+        LOG.debug("SeaMicro driver: creating client %s",
+                  hotlog.Redacted(cl_kwargs))
         try:
             c = seamicro_client.Client(kwargs['api_version'], **cl_kwargs)
-            LOG.debug("------- c %s ", c)
+            LOG.debug("SeaMicro driver: created client %s",
+                      hotlog.Redacted(c))
             return c
         except seamicro_client_exception.UnsupportedVersion as e:
             raise Exception(_(
                 "Invalid 'seamicro_api_version' parameter. Reason: %s.") % e)
+
+
+def wait_all(futures):
+    """Wait for every future and re-raise the first error, if any."""
+    error = None
+    results = []
+    for future in futures:
+        try:
+            results.append(future.wait())
+        except Exception:
+            if error is None:
+                error = sys.exc_info()
+            results.append(None)
+    if error is not None:
+        six.reraise(*error)
+    return results
+
+
+# attributes of the seamicroclient resources reporting the vlans
+# configured on the chassis
+SEGMENTS_ATTR = 'segments'
+INTERFACE_VLANS_ATTR = 'taggedVlans'
+SERVER_NICS_ATTR = 'nic'
+NIC_VLANS_KEY = 'taggedVlan'
+NIC_MAC_KEY = 'macAddr'
+# attributes of a server which may hold the name of the host it runs
+SERVER_NAME_ATTRS = ('hostname', 'name')
+
+
+def parse_vlans(value):
+    """Turn the vlans reported by a chassis into a VlanBitmap.
+
+    Accepts None, a single vlan, a list of vlans or a string such as
+    '100,200-210'.
+    """
+    return vlans.VlanBitmap.parse(value)
+
+
+def parse_uplinks(value):
+    """Parse a comma separated list of uplink interface ids or patterns.
+
+    :returns: the list of patterns, None when value is empty, meaning that
+              every interface of the chassis is an uplink.
+    """
+    if not value:
+        return None
+    patterns = [pattern.strip() for pattern in value.split(',')]
+    return [pattern for pattern in patterns if pattern] or None
+
+
+def is_uplink(interface_id, patterns):
+    """Whether interface_id matches one of the uplink patterns."""
+    if patterns is None:
+        return True
+    return any(fnmatch.fnmatchcase(str(interface_id), pattern)
+               for pattern in patterns)
+
+
+# whether each chassis method tags or untags the vlan it is given
+_TAGGING = {'add_segment': True, 'remove_segment': False,
+            'add_tagged_vlan': True, 'remove_tagged_vlan': False,
+            'set_tagged_vlan': True, 'unset_tagged_vlan': False}
+
+
+def _is_overload(error):
+    """Whether error tells that the chassis is overloaded."""
+    return getattr(error, 'code', 500) >= 500
+
+
+def _run_with_priority(priority_class, func, *args, **kwargs):
+    with ratelimit.priority(priority_class):
+        return func(*args, **kwargs)
+
+
+class GreenSeaMicroClient(object):
+
+    """Non-blocking facade over the SeaMicro client of one chassis.
+
+    Every operation is started on a green thread and returns it as a
+    future, calling wait() on it returns the result or raises the client
+    exception. Any number of operations can be in flight, the requests
+    they send to the chassis are paced by a token bucket of rate requests
+    per second and by a concurrency limit between min_requests and
+    max_requests, adapted to the latency and errors the chassis shows.
+
+    An operation issued while the same operation on the same object and
+    vlan is still in flight does not send another request, it shares the
+    future of the one in flight. Only the latest operation on an object
+    and vlan is shared, so tagging a vlan again after untagging it never
+    joins the earlier tag.
+
+    When given a ChassisState, the client records in it the vlans it
+    reads from the chassis and the changes it makes.
+
+    When given uplink patterns, only the interfaces whose id matches one
+    of them are tagged and read, and their handles are looked up once by
+    resolve_uplinks(). Otherwise every interface is, and the interfaces
+    are listed on every call.
+
+    Every request carries the priority class of the green thread which
+    issued the operation, see ratelimit.priority(). Interactive requests
+    get a slot before background ones, unless a background request has
+    waited for max_wait seconds, and an interactive operation never joins
+    a background one in flight, which may still be queued.
+
+    Server handles are kept for server_ttl seconds, so that tagging a
+    server does not fetch it again each time. A handle is dropped as soon
+    as a request on it fails, a server_ttl of 0 disables the cache.
+    """
+
+    def __init__(self, client, max_requests=8, min_requests=1, rate=0,
+                 burst=1, latency_target=2.0, state=None, uplinks=None,
+                 server_ttl=0, max_wait=5.0):
+        self.client = client
+        self.state = state
+        self.uplink_patterns = uplinks
+        self._uplinks = None
+        self._server_ttl = server_ttl
+        # server_id -> (handle, time it was fetched)
+        self._servers = {}
+        # (object, vlan) -> (operation, future, priority class) of the
+        # latest operation
+        self._in_flight = {}
+        self.dedup_hits = collections.Counter()
+        self._bucket = ratelimit.TokenBucket(rate, burst)
+        self._limiter = ratelimit.AdaptiveLimiter(
+            minimum=min_requests, maximum=max_requests,
+            latency_target=latency_target, max_wait=max_wait)
+
+    def _request(self, priority_class, func, *args, **kwargs):
+        # take the slot first, so that the tokens go in priority order
+        self._limiter.acquire(priority_class)
+        start = None
+        overloaded = False
+        try:
+            self._bucket.acquire()
+            start = time.time()
+            return func(*args, **kwargs)
+        except Exception as ex:
+            overloaded = _is_overload(ex)
+            raise
+        finally:
+            if start is None:
+                # killed or timed out waiting for a token
+                self._limiter.give_back()
+            else:
+                self._limiter.release(time.time() - start, overloaded)
+
+    def spawn(self, func, *args, **kwargs):
+        """Run a single chassis request under the chassis limits."""
+        return instrumentation.spawn(self._request,
+                                     ratelimit.current_priority(), func,
+                                     *args, **kwargs)
+
+    def _spawn_many(self, func, *args, **kwargs):
+        # runs outside the limits so that it never holds a slot while
+        # waiting for the requests it started
+        return instrumentation.spawn(_run_with_priority,
+                                     ratelimit.current_priority(), func,
+                                     *args, **kwargs)
+
+    def _single_flight(self, key, operation, spawn, *args, **kwargs):
+        priority_class = ratelimit.current_priority()
+        current = self._in_flight.get(key)
+        if current is not None and current[0] == operation and (
+                current[2] == priority_class or
+                priority_class == ratelimit.BACKGROUND):
+            self.dedup_hits[operation] += 1
+            return current[1]
+        future = spawn(*args, **kwargs)
+        self._in_flight[key] = (operation, future, priority_class)
+        future.link(self._landed, key, future)
+        return future
+
+    def _landed(self, future, key, started):
+        current = self._in_flight.get(key)
+        if current is not None and current[1] is started:
+            del self._in_flight[key]
+
+    def stats(self):
+        """Return the current limits and queue depths of the chassis."""
+        stats = self._limiter.stats()
+        stats.update({'rate': self._bucket.rate,
+                      'tokens': self._bucket.tokens,
+                      'rate_queued': self._bucket.waiting,
+                      'dedup_hits': sum(self.dedup_hits.values()),
+                      'servers_cached': len(self._servers),
+                      'priorities': self._limiter.wait_stats()})
+        return stats
+
+    def _state_keys(self, kind, prefix=()):
+        if self.state is None:
+            return []
+        return self.state.keys_of(kind, prefix)
+
+    @contextlib.contextmanager
+    def _recording(self, method, vlan_id, keys):
+        """Record the change made to the parts of keys by the block.
+
+        The parts are left for the next read to fix when the block fails,
+        as the change may have been partly made.
+        """
+        try:
+            yield
+        except Exception:
+            if self.state is not None:
+                self.state.invalidate(keys)
+            raise
+        if self.state is not None:
+            self.state.update(keys, vlan_id, _TAGGING[method])
+
+    def _system_call(self, method, vlan_id):
+        with self._recording(method, vlan_id, [chassis_state.SEGMENTS_KEY]):
+            return getattr(self.client.system.list()[0], method)(vlan_id)
+
+    def add_segment(self, vlan_id):
+        return self._single_flight(('system', int(vlan_id)), 'add_segment',
+                                   self.spawn, self._system_call,
+                                   'add_segment', vlan_id)
+
+    def remove_segment(self, vlan_id):
+        return self._single_flight(('system', int(vlan_id)),
+                                   'remove_segment', self.spawn,
+                                   self._system_call, 'remove_segment',
+                                   vlan_id)
+
+    def list_interfaces(self):
+        return self._single_flight(('interfaces', None), 'list', self.spawn,
+                                   self.client.interfaces.list)
+
+    def resolve_uplinks(self):
+        """Look the uplink interfaces up and keep their handles.
+
+        :returns: the uplink handles, None without uplink patterns.
+        """
+        if self.uplink_patterns is None:
+            return None
+        uplinks = [interface for interface in
+                   self._request(ratelimit.current_priority(),
+                                 self.client.interfaces.list)
+                   if is_uplink(interface.id, self.uplink_patterns)]
+        if not uplinks:
+            LOG.warning(_LW("SeaMicro driver: no interface matches the "
+                            "uplinks %s"), ','.join(self.uplink_patterns))
+        self._uplinks = uplinks
+        return uplinks
+
+    def _get_uplinks(self):
+        if self.uplink_patterns is None:
+            return self.list_interfaces().wait()
+        if self._uplinks is None:
+            self.resolve_uplinks()
+        return self._uplinks
+
+    def _uplink(self, interface_id):
+        for interface in self._uplinks or ():
+            if interface.id == interface_id:
+                return interface
+        return self.client.interfaces.get(interface_id)
+
+    def _interface_call(self, interface, method, vlan_id):
+        return self._single_flight(('interface', interface.id, int(vlan_id)),
+                                   method, self.spawn,
+                                   getattr(interface, method), vlan_id)
+
+    def _interfaces_call(self, method, vlan_id):
+        interfaces = self._get_uplinks()
+        keys = [chassis_state.interface_key(interface.id)
+                for interface in interfaces]
+        with self._recording(method, vlan_id, keys):
+            return wait_all([self._interface_call(interface, method, vlan_id)
+                             for interface in interfaces])
+
+    def tag_interfaces(self, vlan_id):
+        """Add vlan_id as tagged vlan on every uplink of the chassis."""
+        return self._single_flight(('interfaces', int(vlan_id)),
+                                   'add_tagged_vlan', self._spawn_many,
+                                   self._interfaces_call, 'add_tagged_vlan',
+                                   vlan_id)
+
+    def untag_interfaces(self, vlan_id):
+        """Remove vlan_id from the tagged vlans of every uplink."""
+        return self._single_flight(('interfaces', int(vlan_id)),
+                                   'remove_tagged_vlan', self._spawn_many,
+                                   self._interfaces_call,
+                                   'remove_tagged_vlan', vlan_id)
+
+    def _cached(self, parts):
+        done = event.Event()
+        done.send(parts)
+        return done
+
+    def _get_segments(self):
+        system = self.client.system.list()[0]
+        segments = parse_vlans(getattr(system, SEGMENTS_ATTR, None))
+        if self.state is not None:
+            self.state.set(chassis_state.SEGMENTS_KEY, segments)
+        return segments
+
+    def get_segments(self, max_age=0):
+        """Get the set of vlan segments configured on the chassis.
+
+        The segments last known to the state are returned instead if they
+        were read at most max_age seconds ago.
+        """
+        if (max_age and self.state is not None and
+                self.state.is_fresh(chassis_state.SEGMENTS_KEY, max_age)):
+            return self._cached(self.state.get(chassis_state.SEGMENTS_KEY))
+        return self._single_flight(('system', None), 'get_segments',
+                                   self.spawn, self._get_segments)
+
+    def _get_interface_vlans(self):
+        interfaces = dict((interface.id,
+                           parse_vlans(getattr(interface,
+                                               INTERFACE_VLANS_ATTR, None)))
+                          for interface in self.client.interfaces.list()
+                          if is_uplink(interface.id, self.uplink_patterns))
+        if self.state is not None:
+            self.state.replace(chassis_state.INTERFACE, interfaces)
+        return interfaces
+
+    def get_interface_vlans(self, max_age=0):
+        """Get the tagged vlans of every uplink, by interface id.
+
+        The vlans last known to the state are returned instead if they
+        were read at most max_age seconds ago.
+        """
+        if max_age and self.state is not None:
+            interfaces = self.state.fresh(chassis_state.INTERFACE,
+                                          max_age=max_age)
+            if interfaces is not None:
+                return self._cached(interfaces)
+        return self._single_flight(('interfaces', None),
+                                   'get_interface_vlans', self.spawn,
+                                   self._get_interface_vlans)
+
+    def _untag_interface(self, interface_id, vlan_id):
+        keys = [chassis_state.interface_key(interface_id)]
+        with self._recording('remove_tagged_vlan', vlan_id, keys):
+            interface = self._uplink(interface_id)
+            return interface.remove_tagged_vlan(vlan_id)
+
+    def untag_interface(self, interface_id, vlan_id):
+        """Remove vlan_id from the tagged vlans of a single interface."""
+        return self._single_flight(('interface', interface_id, int(vlan_id)),
+                                   'remove_tagged_vlan', self.spawn,
+                                   self._untag_interface, interface_id,
+                                   vlan_id)
+
+    def _fetch_server(self, server_id):
+        server = self.client.servers.get(server_id)
+        if self._server_ttl > 0:
+            self._servers[server_id] = (server, time.time())
+        return server
+
+    def forget_server(self, server_id):
+        """Drop the cached handle of a server."""
+        self._servers.pop(server_id, None)
+
+    def get_server(self, server_id):
+        """Get the handle of a server, from the cache if it is fresh."""
+        cached = self._servers.get(server_id)
+        if cached is not None:
+            if time.time() - cached[1] < self._server_ttl:
+                done = event.Event()
+                done.send(cached[0])
+                return done
+            self.forget_server(server_id)
+        return self._single_flight(('server', server_id, None), 'get',
+                                   self.spawn, self._fetch_server,
+                                   server_id)
+
+    def warm_servers(self, server_ids):
+        """Fetch the handles of servers into the cache concurrently.
+
+        The requests are background ones.
+
+        :returns: the number of servers fetched.
+        """
+        if self._server_ttl <= 0:
+            return 0
+        with ratelimit.priority(ratelimit.BACKGROUND):
+            futures = [(server_id, self.get_server(server_id))
+                       for server_id in server_ids]
+        warmed = 0
+        for server_id, future in futures:
+            try:
+                future.wait()
+                warmed += 1
+            except Exception as ex:
+                LOG.debug("SeaMicro driver: failed to fetch server "
+                          "%(server_id)s: %(error)s",
+                          {'server_id': server_id, 'error': ex})
+        return warmed
+
+    def list_servers(self):
+        """List the servers of the chassis with a single request."""
+        return self._single_flight(('servers', None), 'list', self.spawn,
+                                   self.client.servers.list)
+
+    def _get_server_vlans(self, server_id):
+        server = self._fetch_server(server_id)
+        nics = getattr(server, SERVER_NICS_ATTR, None) or {}
+        nics = dict((str(nic), parse_vlans(info.get(NIC_VLANS_KEY)))
+                    for nic, info in nics.items())
+        if self.state is not None:
+            self.state.replace(chassis_state.NIC, nics, (str(server_id),))
+        return nics
+
+    def get_server_vlans(self, server_id, max_age=0):
+        """Get the tagged vlans of every nic of a server, by nic id.
+
+        The vlans last known to the state are returned instead if they
+        were read at most max_age seconds ago.
+        """
+        if max_age and self.state is not None:
+            nics = self.state.fresh(chassis_state.NIC, (str(server_id),),
+                                    max_age)
+            if nics is not None:
+                return self._cached(nics)
+        return self._single_flight(('server', server_id, None),
+                                   'get_server_vlans', self.spawn,
+                                   self._get_server_vlans, server_id)
+
+    def _server_call(self, method, server_id, vlan_id, nics):
+        if nics:
+            keys = [chassis_state.nic_key(server_id, nic) for nic in nics]
+        else:
+            keys = self._state_keys(chassis_state.NIC, (str(server_id),))
+        with self._recording(method, vlan_id, keys):
+            server = self.get_server(server_id).wait()
+            kwargs = {'nics': nics} if nics else {}
+            try:
+                return self.spawn(getattr(server, method), vlan_id,
+                                  **kwargs).wait()
+            except Exception:
+                # the handle may be stale, fetch it again next time
+                self.forget_server(server_id)
+                raise
+
+    def _server_vlan_call(self, method, server_id, vlan_id, nics):
+        key = ('server', server_id, int(vlan_id), tuple(nics or ()))
+        return self._single_flight(key, method, self._spawn_many,
+                                   self._server_call, method, server_id,
+                                   vlan_id, nics)
+
+    def tag_server(self, server_id, vlan_id, nics=None):
+        """Set vlan_id as tagged vlan on nics, all nics by default."""
+        return self._server_vlan_call('set_tagged_vlan', server_id, vlan_id,
+                                      nics)
+
+    def untag_server(self, server_id, vlan_id, nics=None):
+        """Unset vlan_id as tagged vlan on nics, all nics by default."""
+        return self._server_vlan_call('unset_tagged_vlan', server_id,
+                                      vlan_id, nics)
@@ -0,0 +1,158 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_config import cfg
+
+
+seamicro_opts = [
+    cfg.StrOpt('host_inventory_file',
+               help=_("JSON or CSV file mapping hosts to the chassis and "
+                      "server they run on. Entries found there take "
+                      "precedence over the <hostname>=<server id> keys of "
+                      "the [ml2_mech_seamicro:<ip>] sections.")),
+    cfg.IntOpt('host_inventory_reload_interval', default=30,
+               help=_("Seconds between checks of the host inventory file "
+                      "modification time, the file is reloaded in the "
+                      "background when it changed. 0 disables the "
+                      "periodic check.")),
+    cfg.IntOpt('host_discovery_interval', default=0,
+               help=_("Seconds between listings of the servers of every "
+                      "chassis, to match hosts to servers by name and "
+                      "bare metal ports to servers by mac. Hosts found in "
+                      "the inventory file or the [ml2_mech_seamicro:<ip>] "
+                      "sections take precedence. 0 disables discovery.")),
+    cfg.IntOpt('log_rate_limit_interval', default=60,
+               help=_("Seconds over which at most log_rate_limit_burst "
+                      "records of each message of the port and network "
+                      "operations are logged, 0 disables the limit.")),
+    cfg.IntOpt('log_rate_limit_burst', default=10,
+               help=_("Number of records of a message logged every "
+                      "log_rate_limit_interval seconds.")),
+    cfg.IntOpt('log_summary_interval', default=60,
+               help=_("Seconds between two summaries of the port and "
+                      "network operations of each chassis, with their "
+                      "count and latency. The record of each operation "
+                      "is then logged at debug level. 0 disables the "
+                      "summaries.")),
+    cfg.IntOpt('chassis_ready_timeout', default=60,
+               help=_("Seconds an operation waits for the client of a "
+                      "chassis which is still being set up before it "
+                      "fails.")),
+    cfg.IntOpt('chassis_bootstrap_workers', default=16,
+               help=_("Number of chassis clients set up concurrently.")),
+    cfg.IntOpt('chassis_bootstrap_retry_interval', default=10,
+               help=_("Seconds between attempts to set up the client of "
+                      "an unreachable chassis.")),
+    cfg.IntOpt('chassis_max_requests', default=8,
+               help=_("Maximum number of requests in flight to a single "
+                      "chassis, further requests wait for a free slot. The "
+                      "actual limit adapts between chassis_min_requests "
+                      "and this value to the latency and errors of the "
+                      "chassis.")),
+    cfg.IntOpt('chassis_min_requests', default=1,
+               help=_("Lowest concurrency limit the adaptive limit of a "
+                      "chassis can drop to.")),
+    cfg.FloatOpt('chassis_latency_target', default=2.0,
+                 help=_("Seconds above which a chassis request is taken "
+                        "as a sign of overload and the concurrency limit "
+                        "of the chassis is reduced.")),
+    cfg.FloatOpt('chassis_background_max_wait', default=5.0,
+                 help=_("Seconds a background chassis request, such as "
+                        "the vlan garbage collection, waits at most "
+                        "behind interactive ones before it is served.")),
+    cfg.FloatOpt('chassis_rate_limit', default=0,
+                 help=_("Maximum number of requests per second sent to a "
+                        "single chassis, 0 means no limit.")),
+    cfg.IntOpt('chassis_rate_burst', default=10,
+               help=_("Number of requests which may be sent to a chassis "
+                      "at once above chassis_rate_limit.")),
+    cfg.IntOpt('server_cache_ttl', default=300,
+               help=_("Seconds the handle of a chassis server is reused "
+                      "before it is fetched again, 0 disables the cache. "
+                      "The handles of the servers of known hosts are "
+                      "fetched when neutron-server starts.")),
+    cfg.StrOpt('capture_file',
+               help=_("Capture every request sent to the chassis, with its "
+                      "arguments, latency and outcome, to this file for "
+                      "seamicro-ml2-replay. Each process writes to the path "
+                      "suffixed with its pid.")),
+    cfg.IntOpt('capture_max_bytes', default=64 * 1024 * 1024,
+               help=_("Size at which a capture file is rotated.")),
+    cfg.IntOpt('capture_backup_count', default=5,
+               help=_("Number of rotated capture files kept.")),
+    cfg.BoolOpt('lazy_segments', default=False,
+                help=_("Add the segment of a network to a chassis only "
+                       "when the first port of the network is bound to one "
+                       "of its servers, and remove it with the last such "
+                       "port, instead of adding it to every chassis when "
+                       "the network is created. The segments of existing "
+                       "networks are removed from every chassis when the "
+                       "network is deleted.")),
+    cfg.IntOpt('gc_interval', default=0,
+               help=_("Seconds between two runs of the garbage collector "
+                      "removing vlans left over on the chassis, 0 disables "
+                      "it. Each run only handles a small slice of one "
+                      "chassis.")),
+    cfg.IntOpt('gc_batch_size', default=16,
+               help=_("Number of servers, and of orphaned vlans, handled "
+                      "by one run of the garbage collector.")),
+    cfg.ListOpt('gc_vlan_ranges', default=[],
+                help=_("List of <vlan_min>:<vlan_max> ranges of vlans "
+                       "managed by neutron. The garbage collector never "
+                       "removes vlans outside of them.")),
+    cfg.IntOpt('gc_grace_period', default=60,
+               help=_("Seconds a vlan must have been found orphaned, by "
+                      "an earlier run of the garbage collector, before it "
+                      "is removed.")),
+    cfg.IntOpt('audit_interval', default=0,
+               help=_("Seconds between two runs of the audit checking "
+                      "that the chassis have the vlans the SeaMicro db "
+                      "expects, 0 disables it. Each run only handles a "
+                      "small slice of every chassis.")),
+    cfg.IntOpt('audit_vlans_per_run', default=256,
+               help=_("Number of vlans of the segments and uplinks of a "
+                      "chassis checked by one run of the audit.")),
+    cfg.IntOpt('audit_servers_per_run', default=16,
+               help=_("Number of servers of a chassis checked, and of "
+                      "missing vlans repaired, by one run of the audit.")),
+    cfg.BoolOpt('audit_repair', default=False,
+                help=_("Tag the vlans the audit finds missing again, "
+                       "instead of only counting them.")),
+    cfg.IntOpt('chassis_lease_duration', default=30,
+               help=_("Seconds a neutron-server process holds the lease "
+                      "of a chassis without renewing it. Only the owner "
+                      "of a chassis runs background work on it, 0 "
+                      "disables the leases.")),
+    cfg.StrOpt('state_snapshot_file',
+               help=_("Local file the last known vlans of the chassis are "
+                      "saved to, one file per chassis suffixed with its "
+                      "ip, and loaded from when neutron-server starts. "
+                      "Only the owner of a chassis saves its state. The "
+                      "state loaded is verified against the chassis in "
+                      "the background.")),
+    cfg.IntOpt('state_snapshot_interval', default=60,
+               help=_("Seconds between two saves of the chassis state "
+                      "snapshot, each also verifies a batch of "
+                      "gc_batch_size servers of every chassis.")),
+    cfg.IntOpt('state_max_age', default=60,
+               help=_("Seconds the last known vlans of a chassis are used "
+                      "by the vlan garbage collector instead of reading "
+                      "the chassis again, 0 always reads the chassis. The "
+                      "audit always reads the chassis, since the writes of "
+                      "the driver keep the known vlans fresh even when the "
+                      "chassis drifted.")),
+]
+
+cfg.CONF.register_opts(seamicro_opts, "ml2_mech_seamicro")
@@ -0,0 +1,94 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Ordered execution of chassis operations by key."""
+
+import collections
+
+from eventlet import event
+
+from seamicro_ml2.common import instrumentation
+
+
+def port_keys(switch_ip, server_id, vlan_id):
+    """Keys of an operation on a server of a chassis for a vlan."""
+    return [server_key(switch_ip, server_id), vlan_key(switch_ip, vlan_id)]
+
+
+def server_key(switch_ip, server_id):
+    return ('server', switch_ip, server_id)
+
+
+def vlan_key(switch_ip, vlan_id):
+    return ('vlan', switch_ip, int(vlan_id))
+
+
+class OrderedDispatcher(object):
+
+    """Runs operations in submission order per key.
+
+    An operation holds one or more keys, such as a (chassis, server) and
+    a (chassis, vlan) key. It starts once every operation submitted before
+    it on any of its keys is done, operations without a key in common run
+    concurrently. An operation takes its place on all of its keys at once
+    when it is submitted, so operations on several keys cannot deadlock.
+    """
+
+    def __init__(self):
+        # key -> deque of the completion events of queued operations
+        self._queues = {}
+
+    def _enqueue(self, keys):
+        done = event.Event()
+        previous = []
+        for key in set(keys):
+            queue = self._queues.setdefault(key, collections.deque())
+            if queue:
+                previous.append(queue[-1])
+            queue.append(done)
+        return done, previous
+
+    def _dequeue(self, keys, done):
+        for key in set(keys):
+            queue = self._queues[key]
+            queue.remove(done)
+            if not queue:
+                del self._queues[key]
+        done.send()
+
+    def _run(self, keys, done, previous, func, args, kwargs):
+        try:
+            for other in previous:
+                other.wait()
+            return func(*args, **kwargs)
+        finally:
+            self._dequeue(keys, done)
+
+    def run(self, keys, func, *args, **kwargs):
+        """Run func in the calling green thread once its turn comes."""
+        done, previous = self._enqueue(keys)
+        return self._run(keys, done, previous, func, args, kwargs)
+
+    def submit(self, keys, func, *args, **kwargs):
+        """Queue func and return a future for its result."""
+        done, previous = self._enqueue(keys)
+        return instrumentation.spawn(self._run, keys, done, previous, func,
+                                     args, kwargs)
+
+    def depth(self, key=None):
+        """Number of queued operations on key, or on all keys."""
+        if key is not None:
+            return len(self._queues.get(key, ()))
+        return sum(len(queue) for queue in self._queues.values())
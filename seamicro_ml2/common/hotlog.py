@@ -0,0 +1,203 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Logging of the hot paths of the driver.
+
+A HotLog emits at most burst records of each message every interval
+seconds, and only formats those it emits. A Summary replaces one record
+per operation with one record per operation and chassis every interval
+seconds, with the count and latency of the operations, e.g.
+
+    SeaMicro driver: created 412 ports on chassis 1.1.1.1 in the last 60s,
+    0 failed, p50 0.35s p99 1.20s
+
+Secrets are masked by redact() and Redacted.
+"""
+
+import collections
+import logging
+import random
+import re
+import time
+
+import six
+
+from neutron.i18n import _LI
+from neutron.openstack.common import loopingcall
+
+MASK = '***'
+SECRET_KEYS = frozenset(['password', 'passwd', 'secret', 'token',
+                         'auth_token', 'api_key'])
+_SECRET_RE = re.compile(r"""((?:password|passwd|secret|token|api_key)"""
+                        r"""['"]?\s*[:=]\s*u?['"]?)[^'"\s,}&]+""",
+                        re.IGNORECASE)
+
+
+def redact(value):
+    """Return value with the secrets it holds masked.
+
+    The values of secret keys of dicts are masked, and so are the
+    key=value and 'key': 'value' secrets of strings.
+    """
+    if isinstance(value, dict):
+        return dict((key, MASK if str(key).lower() in SECRET_KEYS
+                     else redact(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, six.string_types):
+        return _SECRET_RE.sub(r'\1' + MASK, value)
+    return value
+
+
+class Redacted(object):
+
+    """Log argument masking the secrets of value when it is formatted."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return redact(str(redact(self.value)))
+
+
+class HotLog(object):
+
+    """Logger emitting at most burst records of a message per interval.
+
+    The records of a message over the burst are dropped and counted, and
+    the count is logged when the next interval starts, or by flush().
+    Records below the level of the logger are dropped before anything
+    else is done.
+    """
+
+    def __init__(self, logger, interval=60, burst=10):
+        self._logger = logger
+        self.interval = interval
+        self.burst = burst
+        # message -> [interval start, records emitted, records dropped,
+        #             level]
+        self._windows = {}
+
+    def _log_dropped(self, msg, window):
+        if window[2]:
+            self._logger.log(
+                window[3], "SeaMicro driver: %(count)d records like "
+                "%(msg)r dropped in the last %(interval)ds",
+                {'count': window[2], 'msg': msg, 'interval': self.interval})
+
+    def log(self, level, msg, *args):
+        if not self._logger.isEnabledFor(level):
+            return
+        if self.interval > 0:
+            now = time.time()
+            window = self._windows.get(msg)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None:
+                    self._log_dropped(msg, window)
+                window = self._windows[msg] = [now, 0, 0, level]
+            if window[1] >= self.burst:
+                window[2] += 1
+                return
+            window[1] += 1
+        self._logger.log(level, msg, *args)
+
+    def flush(self):
+        """Log the drop counts of the messages whose interval is over.
+
+        Without it, the count of a message is only logged when the
+        message is logged again.
+        """
+        now = time.time()
+        for msg, window in list(self._windows.items()):
+            if now - window[0] >= self.interval:
+                del self._windows[msg]
+                self._log_dropped(msg, window)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+
+def _percentile(samples, fraction):
+    return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+class Summary(object):
+
+    """Count and latency of operations, logged every interval seconds.
+
+    The latencies are percentiles of up to max_samples of them per
+    operation and chassis, sampled uniformly. The drop counts of hotlog,
+    if any, are flushed along.
+    """
+
+    def __init__(self, logger, interval=60, max_samples=1024, hotlog=None):
+        self._logger = logger
+        self._hotlog = hotlog
+        self.interval = interval
+        self._max_samples = max_samples
+        # (action, noun, switch_ip) -> [count, failed, latency samples]
+        self._events = collections.defaultdict(lambda: [0, 0, []])
+        self._started = time.time()
+        self._loop = None
+
+    def record(self, action, noun, switch_ip, latency, failed=False):
+        """Record an operation, e.g. ('created', 'ports', switch_ip)."""
+        event = self._events[(action, noun, switch_ip)]
+        event[0] += 1
+        if failed:
+            event[1] += 1
+        samples = event[2]
+        if len(samples) < self._max_samples:
+            samples.append(latency)
+        else:
+            index = random.randint(0, event[0] - 1)
+            if index < self._max_samples:
+                samples[index] = latency
+        if time.time() - self._started >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Log the operations recorded since the last flush."""
+        if self._hotlog is not None:
+            self._hotlog.flush()
+        events, self._events = (self._events,
+                                collections.defaultdict(lambda: [0, 0, []]))
+        seconds = time.time() - self._started
+        self._started = time.time()
+        for (action, noun, switch_ip), (count, failed, samples) in sorted(
+                events.items()):
+            samples.sort()
+            self._logger.info(
+                _LI("SeaMicro driver: %(action)s %(count)d %(noun)s on "
+                    "chassis %(switch_ip)s in the last %(seconds)ds, "
+                    "%(failed)d failed, p50 %(p50).2fs p99 %(p99).2fs"),
+                {'action': action, 'count': count, 'noun': noun,
+                 'switch_ip': switch_ip, 'seconds': seconds,
+                 'failed': failed, 'p50': _percentile(samples, 0.5),
+                 'p99': _percentile(samples, 0.99)})
+
+    def start(self):
+        """Flush every interval seconds, even when nothing is recorded."""
+        if self.interval > 0 and self._loop is None:
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.flush)
+            self._loop.start(self.interval, initial_delay=self.interval)
@@ -0,0 +1,196 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Count the chassis calls and SQL statements of each ML2 hook.
+
+Nothing is counted until a Recorder is started. While it runs, every call
+to a function decorated with hook() is an Invocation, which counts the
+requests sent to the chassis by method and the SQL statements executed
+on its behalf, including from the green threads it starts through
+spawn().
+"""
+
+import collections
+import functools
+
+import eventlet
+from eventlet import corolocal
+import sqlalchemy as sa
+from sqlalchemy import engine
+
+# methods of the seamicroclient managers and resources which send a
+# request to the chassis
+CHASSIS_METHODS = frozenset(['list', 'get', 'add_segment', 'remove_segment',
+                             'add_tagged_vlan', 'remove_tagged_vlan',
+                             'set_tagged_vlan', 'unset_tagged_vlan'])
+
+_local = corolocal.local()
+_recorder = None
+
+
+class Invocation(object):
+
+    """Chassis calls and SQL statements of one call of a hook."""
+
+    def __init__(self, hook):
+        self.hook = hook
+        self.chassis_calls = collections.Counter()
+        self.sql_statements = 0
+
+    @property
+    def total_chassis_calls(self):
+        return sum(self.chassis_calls.values())
+
+    def __repr__(self):
+        return '<Invocation %s: %s, %d SQL statements>' % (
+            self.hook, dict(self.chassis_calls), self.sql_statements)
+
+
+class Recorder(object):
+
+    """Collects the invocations of the hooks while it is started."""
+
+    def __init__(self):
+        self.invocations = []
+
+    def start(self):
+        global _recorder
+        _listen_sql()
+        _recorder = self
+        return self
+
+    def stop(self):
+        global _recorder
+        if _recorder is self:
+            _recorder = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def of(self, hook):
+        """Return the invocations of hook, in call order."""
+        return [call for call in self.invocations if call.hook == hook]
+
+    def clear(self):
+        del self.invocations[:]
+
+
+def current():
+    """Return the Invocation the calling green thread works for, if any."""
+    return getattr(_local, 'invocation', None)
+
+
+def _run_as(invocation, func, *args, **kwargs):
+    previous = current()
+    _local.invocation = invocation
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.invocation = previous
+
+
+def hook(func):
+    """Record the calls of an ML2 hook as Invocations."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = _recorder
+        if recorder is None:
+            return func(*args, **kwargs)
+        invocation = Invocation(func.__name__)
+        recorder.invocations.append(invocation)
+        return _run_as(invocation, func, *args, **kwargs)
+    return wrapper
+
+
+def spawn(func, *args, **kwargs):
+    """eventlet.spawn, counting the work of func for the caller's hook."""
+    invocation = current()
+    if invocation is None:
+        return eventlet.spawn(func, *args, **kwargs)
+    return eventlet.spawn(_run_as, invocation, func, *args, **kwargs)
+
+
+class ClientProxy(object):
+
+    """Proxy over a seamicroclient calling _call() for every request.
+
+    The managers of the client and the resources they return are proxied
+    too, a request is named '<manager>.<method>', e.g. servers.get or
+    interfaces.add_tagged_vlan. Subclasses override _call().
+    """
+
+    def __init__(self, target):
+        self._target = target
+        self._name = None
+        self._object_id = None
+
+    def _wrap(self, target, name, object_id=None):
+        # a proxy of the same class and settings over target
+        proxy = object.__new__(self.__class__)
+        proxy.__dict__.update(self.__dict__)
+        proxy._target = target
+        proxy._name = name
+        proxy._object_id = object_id
+        return proxy
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if self._name is None:
+            # an attribute of the client itself is a manager
+            return self._wrap(value, attr)
+        if attr not in CHASSIS_METHODS:
+            return value
+        name = self._name
+
+        def call(*args, **kwargs):
+            result = self._call('%s.%s' % (name, attr), value, args, kwargs)
+            if attr == 'list':
+                return [self._wrap(item, name, getattr(item, 'id', None))
+                        for item in result]
+            if attr == 'get':
+                return self._wrap(result, name, getattr(result, 'id', None))
+            return result
+        return call
+
+    def _call(self, method, func, args, kwargs):
+        """Send the request method by calling func(*args, **kwargs)."""
+        return func(*args, **kwargs)
+
+
+class CountingClient(ClientProxy):
+
+    """Proxy over a seamicroclient counting the chassis requests."""
+
+    def _call(self, method, func, args, kwargs):
+        invocation = current()
+        if invocation is not None:
+            invocation.chassis_calls[method] += 1
+        return func(*args, **kwargs)
+
+
+def _count_statement(*args, **kwargs):
+    invocation = current()
+    if invocation is not None:
+        invocation.sql_statements += 1
+
+
+def _listen_sql():
+    if not sa.event.contains(engine.Engine, 'before_cursor_execute',
+                             _count_statement):
+        sa.event.listen(engine.Engine, 'before_cursor_execute',
+                        _count_statement)
@@ -0,0 +1,520 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Host to SeaMicro chassis/server inventory."""
+
+import bisect
+import csv
+import json
+import os
+import re
+import threading
+
+from neutron.i18n import _LE, _LI, _LW
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import ratelimit
+
+LOG = log.getLogger(__name__)
+
+# compute[1-512], 1/[000-511]
+_RANGE_RE = re.compile(r'^([^\[\]]*)\[(\d+)-(\d+)\]([^\[\]]*)$')
+# a host name matched against range rules: prefix, number, suffix
+_HOST_RE = re.compile(r'^(.*?)(\d+)(\D*)$')
+
+
+def parse_host_value(value):
+    """Split a '<server id>[,<nic>...]' value into (server_id, nics)."""
+    info = [item.strip() for item in value.split(",")]
+    return (info[0], tuple(info[1:]))
+
+
+def _parse_range(pattern):
+    """Split 'prefix[start-end]suffix' into its parts.
+
+    :returns: (prefix, start, end, width, suffix) where width is the
+              number of digits of zero padded ranges, 0 otherwise.
+    """
+    match = _RANGE_RE.match(pattern)
+    if not match:
+        raise ValueError(_("Invalid range pattern: %s") % pattern)
+    prefix, start, end, suffix = match.groups()
+    width = len(start) if len(start) > 1 and start.startswith('0') else 0
+    if int(start) > int(end):
+        raise ValueError(_("Invalid range pattern: %s") % pattern)
+    return (prefix, int(start), int(end), width, suffix)
+
+
+def _format_number(number, width):
+    return str(number).zfill(width) if width else str(number)
+
+
+class _RangeRule(object):
+
+    """Hosts prefix[start-end]suffix mapped onto a range of servers."""
+
+    __slots__ = ('start', 'end', 'width', 'switch_ip', 'server_prefix',
+                 'server_start', 'server_width', 'server_suffix', 'nics')
+
+    def __init__(self, start, end, width, switch_ip, server_id, nics):
+        self.start = start
+        self.end = end
+        self.width = width
+        self.switch_ip = switch_ip
+        self.nics = nics
+        if '[' in server_id:
+            (self.server_prefix, self.server_start, server_end,
+             self.server_width, self.server_suffix) = _parse_range(server_id)
+            if server_end - self.server_start != end - start:
+                raise ValueError(_("Host and server ranges differ in size: "
+                                   "%s") % server_id)
+        elif start == end:
+            self.server_prefix, self.server_suffix = server_id, ''
+            self.server_start = self.server_width = None
+        else:
+            raise ValueError(_("A range of hosts needs a range of servers: "
+                               "%s") % server_id)
+
+    def match(self, digits):
+        number = int(digits)
+        if number < self.start or number > self.end:
+            return None
+        if digits != _format_number(number, self.width):
+            return None
+        return number
+
+    def server_id(self, number):
+        if self.server_start is None:
+            return self.server_prefix
+        return (self.server_prefix +
+                _format_number(self.server_start + number - self.start,
+                               self.server_width) +
+                self.server_suffix)
+
+
+class HostIndex(object):
+
+    """Host to (switch_ip, server_id, nics) index.
+
+    Hosts are either added one by one or as range rules such as
+    compute[1-512] -> 1/[0-511]. Range rules are kept compiled and looked
+    up by host prefix and suffix, they are never expanded into one entry
+    per host.
+
+    An index is filled once and then only read, a new index is built and
+    swapped in whenever the inventory changes.
+    """
+
+    def __init__(self):
+        self._hosts = {}
+        # (prefix, suffix) -> ([start, ...], [_RangeRule, ...]) by start
+        self._ranges = {}
+        self._strings = {}
+
+    def _intern(self, value):
+        return self._strings.setdefault(value, value)
+
+    def add(self, host, switch_ip, server_id, nics=()):
+        nics = self._intern(tuple(self._intern(nic) for nic in nics))
+        switch_ip = self._intern(switch_ip)
+        if '[' in host:
+            self._add_range(host, switch_ip, server_id, nics)
+            return
+        self._hosts[host] = (switch_ip, self._intern(server_id), nics)
+
+    def _add_range(self, host, switch_ip, server_id, nics):
+        prefix, start, end, width, suffix = _parse_range(host)
+        if prefix[-1:].isdigit() or any(c.isdigit() for c in suffix):
+            raise ValueError(_("The range must be the last number of the "
+                               "host name: %s") % host)
+        rule = _RangeRule(start, end, width, switch_ip, server_id, nics)
+        starts, rules = self._ranges.setdefault((prefix, suffix), ([], []))
+        i = bisect.bisect_left(starts, start)
+        if ((i > 0 and rules[i - 1].end >= start) or
+                (i < len(rules) and rules[i].start <= end)):
+            raise ValueError(_("Overlapping host range: %s") % host)
+        starts.insert(i, start)
+        rules.insert(i, rule)
+
+    def _get_range(self, host):
+        match = _HOST_RE.match(host)
+        if not match:
+            return None
+        prefix, digits, suffix = match.groups()
+        ranges = self._ranges.get((prefix, suffix))
+        if not ranges:
+            return None
+        starts, rules = ranges
+        i = bisect.bisect_right(starts, int(digits)) - 1
+        if i < 0:
+            return None
+        rule = rules[i]
+        number = rule.match(digits)
+        if number is None:
+            return None
+        return (rule.switch_ip, rule.server_id(number), rule.nics)
+
+    def get(self, host):
+        """Return (switch_ip, server_id, nics) of host or None."""
+        info = self._hosts.get(host)
+        if info is None and self._ranges:
+            info = self._get_range(host)
+        if info is None:
+            return None
+        return (info[0], info[1], list(info[2]))
+
+    def hosts(self, switch_ip=None):
+        """Iterate over the host names, range rules expand lazily."""
+        for host, info in self._hosts.items():
+            if switch_ip is None or info[0] == switch_ip:
+                yield host
+        for (prefix, suffix), (starts, rules) in self._ranges.items():
+            for rule in rules:
+                if switch_ip is not None and rule.switch_ip != switch_ip:
+                    continue
+                for number in range(rule.start, rule.end + 1):
+                    yield prefix + _format_number(number, rule.width) + suffix
+
+    def servers(self, switch_ip):
+        """Return the set of server ids of a chassis."""
+        servers = set(info[1] for info in self._hosts.values()
+                      if info[0] == switch_ip)
+        for starts, rules in self._ranges.values():
+            for rule in rules:
+                if rule.switch_ip == switch_ip:
+                    servers.update(rule.server_id(number) for number in
+                                   range(rule.start, rule.end + 1))
+        return servers
+
+    def switch_ips(self):
+        """Return the set of chassis the index refers to."""
+        switch_ips = set(info[0] for info in self._hosts.values())
+        for starts, rules in self._ranges.values():
+            switch_ips.update(rule.switch_ip for rule in rules)
+        return switch_ips
+
+    def __contains__(self, host):
+        return self.get(host) is not None
+
+    def __len__(self):
+        return len(self._hosts) + sum(
+            rule.end - rule.start + 1
+            for starts, rules in self._ranges.values() for rule in rules)
+
+
+def index_switches(switches, ignore=()):
+    """Build a HostIndex from the [ml2_mech_seamicro:<ip>] sections.
+
+    :param switches: dict of chassis ip to the dict of its section keys.
+    :param ignore: section keys which are chassis parameters, not hosts.
+    """
+    index = HostIndex()
+    for switch_ip, params in switches.items():
+        for host, value in params.items():
+            if host in ignore:
+                continue
+            server_id, nics = parse_host_value(value)
+            index.add(host, switch_ip, server_id, nics)
+    return index
+
+
+def _load_json(stream, index):
+    # {"<chassis ip>": {"<hostname>": "<server id>[,<nic>...]"}}
+    data = json.load(stream)
+    for switch_ip, hosts in data.items():
+        for host, value in hosts.items():
+            if isinstance(value, list):
+                server_id, nics = value[0], value[1:]
+            else:
+                server_id, nics = parse_host_value(value)
+            index.add(host, switch_ip, server_id, nics)
+
+
+def _load_csv(stream, index):
+    # <hostname>,<chassis ip>,<server id>[,<nic>...]
+    for row in csv.reader(stream):
+        row = [item.strip() for item in row]
+        if not row or not row[0] or row[0].startswith('#'):
+            continue
+        if len(row) < 3:
+            raise ValueError(_("Invalid inventory line: %s") % ",".join(row))
+        index.add(row[0], row[1], row[2], [nic for nic in row[3:] if nic])
+
+
+def load_inventory(path):
+    """Build a HostIndex from a JSON or CSV inventory file."""
+    index = HostIndex()
+    with open(path) as stream:
+        if path.endswith('.json'):
+            _load_json(stream, index)
+        elif path.endswith('.csv'):
+            _load_csv(stream, index)
+        else:
+            head = stream.read(1024).lstrip()
+            stream.seek(0)
+            if head.startswith('{'):
+                _load_json(stream, index)
+            else:
+                _load_csv(stream, index)
+    return index
+
+
+class HostInventory(object):
+
+    """Host inventory loaded from a file, reloaded when it changes.
+
+    Lookups always go through the current index, which is replaced as a
+    whole, so concurrent lookups see either the old or the new mapping.
+    """
+
+    def __init__(self, path, switches=None):
+        self._path = path
+        self._switches = switches
+        self._mtime = None
+        self._index = HostIndex()
+        self._lock = threading.Lock()
+        self._loop = None
+        self.reload()
+
+    def lookup(self, host):
+        return self._index.get(host)
+
+    def hosts(self, switch_ip=None):
+        return list(self._index.hosts(switch_ip))
+
+    def servers(self, switch_ip):
+        return self._index.servers(switch_ip)
+
+    def reload(self):
+        """Load the inventory file if it changed since the last load.
+
+        :returns: True if a new index was swapped in.
+        """
+        with self._lock:
+            try:
+                mtime = os.stat(self._path).st_mtime
+                if mtime == self._mtime:
+                    return False
+                index = load_inventory(self._path)
+            except Exception:
+                LOG.exception(_LE("SeaMicro driver: failed to load host "
+                                  "inventory %s, keeping the previous one"),
+                              self._path)
+                return False
+
+            if self._switches is not None:
+                for switch_ip in index.switch_ips() - set(self._switches):
+                    LOG.warning(_LW("SeaMicro driver: inventory %(path)s "
+                                    "refers to unknown chassis "
+                                    "%(switch_ip)s"),
+                                {'path': self._path, 'switch_ip': switch_ip})
+            self._index = index
+            self._mtime = mtime
+        LOG.info(_LI("SeaMicro driver: loaded %(count)d hosts from "
+                     "inventory %(path)s"),
+                 {'count': len(index), 'path': self._path})
+        return True
+
+    def start(self, interval):
+        """Check the inventory file for changes every interval seconds."""
+        if interval > 0 and self._loop is None:
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.reload)
+            self._loop.start(interval, initial_delay=interval)
+
+
+def normalize_mac(mac):
+    """Return mac as lower case colon separated octets."""
+    digits = re.sub(r'[^0-9a-f]', '', str(mac).lower())
+    return ':'.join(digits[i:i + 2] for i in range(0, len(digits), 2))
+
+
+def describe_server(server):
+    """Return the host names and the nic of each mac of a chassis server.
+
+    :returns: (names, macs) where names is a sorted tuple of lower case
+              host names and macs a dict of normalized mac to nic id.
+    """
+    names = set()
+    for attr in seamicro_client.SERVER_NAME_ATTRS:
+        name = getattr(server, attr, None)
+        if name:
+            names.add(str(name).lower())
+    macs = {}
+    nics = getattr(server, seamicro_client.SERVER_NICS_ATTR, None) or {}
+    for nic, info in nics.items():
+        mac = (info or {}).get(seamicro_client.NIC_MAC_KEY)
+        if mac:
+            macs[normalize_mac(mac)] = str(nic)
+    return (tuple(sorted(names)), macs)
+
+
+class ServerDiscovery(object):
+
+    """Host to server index discovered from the server lists of the chassis.
+
+    Every refresh lists the servers of each chassis, all chassis at once,
+    and only the servers whose names or macs changed since the previous
+    refresh are indexed again. The servers of a chassis which is not
+    ready or cannot be listed are kept as they were.
+
+    Hosts are matched by name, the full one or the part before the first
+    dot, and bare metal ports by the mac of the server nic they use.
+
+    :param clients: ChassisClients of the chassis to discover.
+    Every process discovers every chassis, whether it owns it or not, as
+    the port operations of any process look hosts up.
+
+    :param known: optional callable returning the (switch_ip, server_id,
+                  nics) a host is configured with, mappings which differ
+                  from the discovered ones are logged.
+    """
+
+    def __init__(self, clients, known=None):
+        self._clients = clients
+        self._known = known
+        # (switch_ip, server_id) -> (names, macs)
+        self._servers = {}
+        # host name -> (switch_ip, server_id)
+        self._hosts = {}
+        # mac -> (switch_ip, server_id, nic)
+        self._macs = {}
+        self._loop = None
+
+    def lookup(self, host):
+        """Return (switch_ip, server_id, nics) of host or None."""
+        if not host:
+            return None
+        host = host.lower()
+        info = self._hosts.get(host) or self._hosts.get(host.split('.')[0])
+        if info is None:
+            return None
+        return (info[0], info[1], [])
+
+    def lookup_mac(self, mac):
+        """Return (switch_ip, server_id, nics) of the nic with mac or None."""
+        if not mac:
+            return None
+        info = self._macs.get(normalize_mac(mac))
+        if info is None:
+            return None
+        return (info[0], info[1], [info[2]])
+
+    def servers(self, switch_ip):
+        return set(server_id for (ip, server_id) in self._servers
+                   if ip == switch_ip)
+
+    def __len__(self):
+        return len(self._servers)
+
+    def _unindex(self, key):
+        names, macs = self._servers.pop(key)
+        for name in names:
+            for host in set([name, name.split('.')[0]]):
+                if self._hosts.get(host) == key:
+                    del self._hosts[host]
+        for mac in macs:
+            if self._macs.get(mac, ())[:2] == key:
+                del self._macs[mac]
+
+    def _index(self, key, names, macs):
+        self._servers[key] = (names, macs)
+        for name in names:
+            for host in set([name, name.split('.')[0]]):
+                current = self._hosts.get(host)
+                if current is not None and current != key:
+                    LOG.warning(_LW("SeaMicro driver: host %(host)s is "
+                                    "server %(server)s and %(other)s"),
+                                {'host': host, 'server': '/'.join(key),
+                                 'other': '/'.join(current)})
+                self._hosts[host] = key
+            self._check_known(name, key)
+        for mac, nic in macs.items():
+            self._macs[mac] = key + (nic,)
+
+    def _check_known(self, host, key):
+        if self._known is None:
+            return
+        info = self._known(host)
+        if info is not None and tuple(info[:2]) != key:
+            LOG.warning(_LW("SeaMicro driver: host %(host)s is configured "
+                            "as server %(configured)s but runs on server "
+                            "%(discovered)s"),
+                        {'host': host, 'configured': '%s/%s' % info[:2],
+                         'discovered': '/'.join(key)})
+
+    def _apply(self, switch_ip, servers):
+        """Index the servers listed by a chassis.
+
+        :returns: the number of servers added, changed and removed.
+        """
+        seen = set()
+        changed = 0
+        for server in servers:
+            key = (switch_ip, str(server.id))
+            seen.add(key)
+            description = describe_server(server)
+            if self._servers.get(key) == description:
+                continue
+            if key in self._servers:
+                self._unindex(key)
+            self._index(key, *description)
+            changed += 1
+        for key in [key for key in self._servers
+                    if key[0] == switch_ip and key not in seen]:
+            self._unindex(key)
+            changed += 1
+        return changed
+
+    def refresh(self):
+        """List the servers of every chassis and index the changes.
+
+        :returns: the number of servers added, changed and removed.
+        """
+        futures = []
+        with ratelimit.priority(ratelimit.BACKGROUND):
+            for switch_ip in sorted(self._clients):
+                if not self._clients.is_ready(switch_ip):
+                    continue
+                futures.append((switch_ip,
+                                self._clients[switch_ip].list_servers()))
+        changed = 0
+        for switch_ip, future in futures:
+            try:
+                servers = future.wait()
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to list the "
+                                "servers of chassis %(switch_ip)s: "
+                                "%(error)s"),
+                            {'switch_ip': switch_ip, 'error': ex})
+                continue
+            changed += self._apply(switch_ip, servers)
+        if changed:
+            LOG.info(_LI("SeaMicro driver: discovered %(changed)d server "
+                         "changes, %(count)d servers known"),
+                     {'changed': changed, 'count': len(self)})
+        return changed
+
+    def run_once(self):
+        try:
+            self.refresh()
+        except Exception:
+            LOG.exception(_LE("SeaMicro driver: server discovery failed"))
+
+    def start(self, interval):
+        if interval > 0 and self._loop is None:
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.run_once)
+            self._loop.start(interval, initial_delay=interval)
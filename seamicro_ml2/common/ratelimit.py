@@ -0,0 +1,204 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per chassis request rate and concurrency limits."""
+
+import collections
+import contextlib
+import time
+
+import eventlet
+from eventlet import corolocal
+from eventlet import event
+
+# priority classes of the chassis requests, most urgent first
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+_local = corolocal.local()
+
+
+def current_priority():
+    """Return the priority class of the calling green thread."""
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(priority_class):
+    """Send the chassis requests of the block with priority_class."""
+    previous = current_priority()
+    _local.priority = priority_class
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class TokenBucket(object):
+
+    """Token bucket allowing rate requests per second, burst at once.
+
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self.waiting = 0
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        if self.rate <= 0:
+            return
+        self.waiting += 1
+        try:
+            self._refill()
+            while self._tokens < 1:
+                eventlet.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+        finally:
+            self.waiting -= 1
+
+    @property
+    def tokens(self):
+        if self.rate > 0:
+            self._refill()
+        return self._tokens
+
+
+class AdaptiveLimiter(object):
+
+    """Concurrency limit adapted with AIMD.
+
+    The limit grows by one request per limit's worth of requests which
+    completed within latency_target, and is cut by backoff on every
+    request which failed with an overload error or took longer than
+    latency_target. It always stays between minimum and maximum.
+
+    Requests waiting for a slot are served by priority class, interactive
+    ones first, except that a background request which has waited for
+    max_wait seconds goes before them so that it is never starved.
+    """
+
+    def __init__(self, minimum=1, maximum=8, initial=None,
+                 latency_target=2.0, backoff=0.5, max_wait=5.0):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(initial or self.maximum)
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.in_flight = 0
+        # priority class -> deque of (time queued, event)
+        self._waiters = dict((priority_class, collections.deque())
+                             for priority_class in PRIORITIES)
+        # priority class -> [requests, total seconds waited, longest wait]
+        self._waits = dict((priority_class, [0, 0.0, 0.0])
+                           for priority_class in PRIORITIES)
+        self._last_decrease = 0
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _granted(self, priority_class, waited):
+        waits = self._waits[priority_class]
+        waits[0] += 1
+        waits[1] += waited
+        waits[2] = max(waits[2], waited)
+
+    def acquire(self, priority_class=INTERACTIVE):
+        """Wait for a free slot under the current limit."""
+        if self.in_flight < int(self.limit) and not self.queued:
+            self.in_flight += 1
+            self._granted(priority_class, 0.0)
+            return
+        waiter = event.Event()
+        entry = (time.time(), waiter)
+        self._waiters[priority_class].append(entry)
+        try:
+            # the slot is handed over by release()
+            waiter.wait()
+        except BaseException:
+            # killed or timed out: drop the waiter, or give back the slot
+            # release() handed over to it already
+            if waiter.ready():
+                self.give_back()
+            else:
+                self._waiters[priority_class].remove(entry)
+            raise
+
+    def release(self, latency, overloaded=False):
+        """Free a slot and adapt the limit to the request outcome."""
+        self.in_flight -= 1
+        now = time.time()
+        if overloaded or latency > self.latency_target:
+            # decrease at most once per latency target so that a batch
+            # of slow requests in flight counts as one congestion signal
+            if now - self._last_decrease >= self.latency_target:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def give_back(self):
+        """Free a slot which was not used, the limit is left as it is."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _next_class(self, now):
+        background = self._waiters[BACKGROUND]
+        if background and now - background[0][0] >= self.max_wait:
+            return BACKGROUND
+        for priority_class in PRIORITIES:
+            if self._waiters[priority_class]:
+                return priority_class
+
+    def _wake(self):
+        now = time.time()
+        while self.queued and self.in_flight < int(self.limit):
+            priority_class = self._next_class(now)
+            queued_at, waiter = self._waiters[priority_class].popleft()
+            self.in_flight += 1
+            self._granted(priority_class, now - queued_at)
+            waiter.send()
+
+    def stats(self):
+        return {'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queued': self.queued}
+
+    def wait_stats(self):
+        """Return the queue depth and wait for a slot of each class."""
+        stats = {}
+        for priority_class in PRIORITIES:
+            count, total, longest = self._waits[priority_class]
+            stats[priority_class] = {
+                'queued': len(self._waiters[priority_class]),
+                'requests': count,
+                'mean_wait': total / count if count else 0.0,
+                'max_wait': longest}
+        return stats
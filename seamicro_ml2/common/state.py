@@ -0,0 +1,389 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Last known vlan state of the chassis and its on-disk snapshot."""
+
+import binascii
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from neutron.i18n import _LE, _LI, _LW
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+
+from seamicro_ml2.common import ratelimit
+from seamicro_ml2.common import vlans
+
+LOG = log.getLogger(__name__)
+
+SEGMENTS = 'segments'
+INTERFACE = 'interface'
+NIC = 'nic'
+
+SEGMENTS_KEY = (SEGMENTS,)
+
+
+def interface_key(interface_id):
+    return (INTERFACE, str(interface_id))
+
+
+def nic_key(server_id, nic):
+    return (NIC, str(server_id), str(nic))
+
+
+# snapshot file layout, all integers big endian:
+#   header: magic, format version, crc32 of the records, record count
+#   record: kind, key length, key, 512 bytes of bitmap (bit n is vlan n)
+# the key is the utf-8 encoding of the key fields separated by '\0'
+MAGIC = b'SMVS'
+VERSION = 1
+_HEADER = struct.Struct('>4sHIL')
+_RECORD = struct.Struct('>BH')
+_BITMAP_SIZE = (vlans.MAX_VLAN + 1) // 8
+_KINDS = {SEGMENTS: 1, INTERFACE: 2, NIC: 3}
+_KIND_NAMES = dict((value, name) for name, value in _KINDS.items())
+
+
+def _encode_bitmap(bitmap):
+    return binascii.unhexlify('%0*x' % (_BITMAP_SIZE * 2, bitmap.bits))
+
+
+def _decode_bitmap(data):
+    return vlans.VlanBitmap(bits=int(binascii.hexlify(data), 16))
+
+
+class _Mapped(object):
+
+    """A bitmap of a snapshot, decoded when first used."""
+
+    __slots__ = ('buf', 'offset')
+
+    def __init__(self, buf, offset):
+        self.buf = buf
+        self.offset = offset
+
+    def decode(self):
+        return _decode_bitmap(self.buf[self.offset:
+                                       self.offset + _BITMAP_SIZE])
+
+
+class ChassisState(object):
+
+    """Last known vlans of the segments, uplinks and server nics of a chassis.
+
+    Every part is a VlanBitmap stored under a key built by interface_key()
+    or nic_key(), or under SEGMENTS_KEY. A part is verified once it has
+    been read from the chassis by this process, the parts loaded from a
+    snapshot are not until then. The age of a part is the time since it
+    was read, or since its snapshot was saved.
+    """
+
+    def __init__(self):
+        self._parts = {}
+        self._verified = set()
+        # key -> time the part was read from the chassis
+        self._read_at = {}
+        self.generation = 0
+
+    def get(self, key):
+        """Return the bitmap stored under key, or None if it is unknown."""
+        part = self._parts.get(key)
+        if isinstance(part, _Mapped):
+            part = self._parts[key] = part.decode()
+        return part
+
+    def keys(self):
+        return list(self._parts)
+
+    def is_verified(self, key):
+        return key in self._verified
+
+    def unverified(self):
+        """Return the keys of the parts not read from the chassis yet."""
+        return [key for key in self._parts if key not in self._verified]
+
+    def is_fresh(self, key, max_age):
+        """Whether the part of key was read at most max_age seconds ago."""
+        read_at = self._read_at.get(key)
+        return read_at is not None and time.time() - read_at <= max_age
+
+    def fresh(self, kind, prefix=(), max_age=0):
+        """Return the parts of a kind starting with prefix, if all are fresh.
+
+        The parts are keyed by their remaining key field. None is returned
+        when there is no such part, or when one of them is older than
+        max_age seconds and has to be read from the chassis again.
+        """
+        keys = self.keys_of(kind, prefix)
+        if not keys or not all(self.is_fresh(key, max_age) for key in keys):
+            return None
+        return dict((key[len(prefix) + 1], self.get(key)) for key in keys)
+
+    def _load(self, key, mapped, saved_at):
+        self._parts[key] = mapped
+        self._read_at[key] = saved_at
+
+    def set(self, key, bitmap):
+        """Store a bitmap read from the chassis."""
+        self._parts[key] = bitmap
+        self._verified.add(key)
+        self._read_at[key] = time.time()
+        self.generation += 1
+
+    def replace(self, kind, bitmaps, prefix=()):
+        """Store all parts of a kind starting with prefix at once.
+
+        The stored parts of that kind and prefix which are not in bitmaps
+        are dropped, bitmaps is keyed by the remaining key fields.
+        """
+        for key in self.keys_of(kind, prefix):
+            del self._parts[key]
+            self._verified.discard(key)
+            self._read_at.pop(key, None)
+        for fields, bitmap in bitmaps.items():
+            if not isinstance(fields, tuple):
+                fields = (fields,)
+            self.set((kind,) + prefix + tuple(str(f) for f in fields),
+                     bitmap)
+
+    def update(self, keys, vlan, tagged):
+        """Record that vlan was tagged or untagged on the parts of keys."""
+        change = vlans.VlanBitmap([vlan])
+        for key in keys:
+            bitmap = self.get(key)
+            if bitmap is None:
+                continue
+            self._parts[key] = bitmap | change if tagged else bitmap - change
+            self.generation += 1
+
+    def invalidate(self, keys):
+        """Mark the parts of keys as to be read from the chassis again."""
+        self._verified.difference_update(keys)
+        for key in keys:
+            self._read_at.pop(key, None)
+
+    def keys_of(self, kind, prefix=()):
+        """Return the keys of the parts of a kind starting with prefix."""
+        return [key for key in self._parts
+                if key[0] == kind and key[1:len(prefix) + 1] == prefix]
+
+
+class StateCache(object):
+
+    """The ChassisState of every chassis, by chassis ip."""
+
+    def __init__(self):
+        self._chassis = {}
+
+    def __getitem__(self, switch_ip):
+        state = self._chassis.get(switch_ip)
+        if state is None:
+            state = self._chassis[switch_ip] = ChassisState()
+        return state
+
+    def __contains__(self, switch_ip):
+        return switch_ip in self._chassis
+
+    def __iter__(self):
+        return iter(self._chassis)
+
+    def generation(self):
+        return sum(state.generation for state in self._chassis.values())
+
+
+def snapshot_path(path, switch_ip):
+    """Return the path of the snapshot of a chassis."""
+    return '%s.%s' % (path, switch_ip)
+
+
+def write_snapshot(path, cache, switch_ips=None):
+    """Write the state of the chassis of cache to path atomically.
+
+    All chassis are written unless switch_ips is given.
+    """
+    records = []
+    for switch_ip in sorted(cache if switch_ips is None else switch_ips):
+        state = cache[switch_ip]
+        for key in sorted(state.keys()):
+            bitmap = state.get(key)
+            name = '\0'.join((switch_ip,) + key[1:]).encode('utf-8')
+            records.append(_RECORD.pack(_KINDS[key[0]], len(name)))
+            records.append(name)
+            records.append(_encode_bitmap(bitmap))
+    body = b''.join(records)
+    header = _HEADER.pack(MAGIC, VERSION, zlib.crc32(body) & 0xffffffff,
+                          len(records) // 3)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_snapshot(path, cache):
+    """Load the snapshot at path into cache, mapping the file in memory.
+
+    Only the keys are parsed here, each bitmap is decoded from the mapped
+    file when it is first used. Parts already known to cache are kept,
+    the age of those loaded starts when the snapshot was saved.
+
+    :returns: the number of parts loaded, 0 if there is no usable
+              snapshot.
+    """
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            saved_at = os.fstat(f.fileno()).st_mtime
+    except (IOError, OSError, ValueError):
+        # missing or empty file
+        return 0
+    if len(buf) < _HEADER.size:
+        return 0
+    magic, version, crc, count = _HEADER.unpack(buf[:_HEADER.size])
+    if magic != MAGIC or version != VERSION:
+        LOG.warning(_LW("SeaMicro driver: ignoring state snapshot %(path)s "
+                        "of unknown version %(version)s"),
+                    {'path': path, 'version': version})
+        return 0
+    if zlib.crc32(buf[_HEADER.size:]) & 0xffffffff != crc:
+        LOG.warning(_LW("SeaMicro driver: ignoring corrupted state "
+                        "snapshot %s"), path)
+        return 0
+
+    offset = _HEADER.size
+    loaded = 0
+    for i in range(count):
+        kind, length = _RECORD.unpack(buf[offset:offset + _RECORD.size])
+        offset += _RECORD.size
+        fields = buf[offset:offset + length].decode('utf-8').split('\0')
+        offset += length
+        state = cache[fields[0]]
+        key = (_KIND_NAMES[kind],) + tuple(fields[1:])
+        if state.get(key) is None:
+            state._load(key, _Mapped(buf, offset), saved_at)
+            loaded += 1
+        offset += _BITMAP_SIZE
+    return loaded
+
+
+class StateSnapshot(object):
+
+    """Keep the chassis state cache on local disk across restarts.
+
+    Each chassis has its own snapshot file, see snapshot_path(), which
+    only the process owning the chassis writes: the state other processes
+    hold of a chassis is not kept up to date by their own changes.
+
+    start() loads the last snapshots so that the state of every chassis
+    is known at once, then every interval seconds it re-reads up to
+    batch_size of the parts of each owned chassis which come from the
+    snapshot, until all of them are verified, and saves the state of the
+    owned chassis that changed.
+    """
+
+    def __init__(self, path, cache, clients, owns=None, batch_size=16):
+        self._path = path
+        self._cache = cache
+        self._clients = clients
+        self._owns = owns
+        self._batch_size = batch_size
+        # switch_ip -> generation of the state last saved
+        self._saved = {}
+        self._loop = None
+
+    def _owned(self, switch_ip):
+        return switch_ip in self._clients and (self._owns is None or
+                                               self._owns(switch_ip))
+
+    def load(self):
+        loaded = 0
+        for switch_ip in sorted(self._clients):
+            path = snapshot_path(self._path, switch_ip)
+            try:
+                loaded += read_snapshot(path, self._cache)
+            except Exception:
+                LOG.exception(_LE("SeaMicro driver: failed to load the state "
+                                  "snapshot %s"), path)
+        if loaded:
+            LOG.info(_LI("SeaMicro driver: loaded %(count)d chassis state "
+                         "entries from %(path)s.*"),
+                     {'count': loaded, 'path': self._path})
+        self._saved = dict((switch_ip, self._cache[switch_ip].generation)
+                           for switch_ip in self._cache)
+        return loaded
+
+    def start(self, interval):
+        self.load()
+        if interval > 0 and self._loop is None:
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.run_once)
+            self._loop.start(interval, initial_delay=interval)
+
+    def run_once(self):
+        for switch_ip in sorted(self._cache):
+            if not self._owned(switch_ip):
+                continue
+            try:
+                with ratelimit.priority(ratelimit.BACKGROUND):
+                    self._verify(switch_ip)
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to verify the state "
+                                "of chassis %(switch_ip)s: %(error)s"),
+                            {'switch_ip': switch_ip, 'error': ex})
+        self.save()
+
+    def save(self):
+        """Save the state of every owned chassis changed since last saved."""
+        for switch_ip in sorted(self._cache):
+            generation = self._cache[switch_ip].generation
+            if (generation == self._saved.get(switch_ip) or
+                    not self._owned(switch_ip)):
+                continue
+            path = snapshot_path(self._path, switch_ip)
+            try:
+                write_snapshot(path, self._cache, [switch_ip])
+                self._saved[switch_ip] = generation
+            except Exception:
+                LOG.exception(_LE("SeaMicro driver: failed to save the state "
+                                  "snapshot %s"), path)
+
+    def _verify(self, switch_ip):
+        if not self._clients.is_ready(switch_ip):
+            return
+        state = self._cache[switch_ip]
+        unverified = state.unverified()
+        if not unverified:
+            return
+        client = self._clients[switch_ip]
+        reads = []
+        if SEGMENTS_KEY in unverified:
+            reads.append(client.get_segments())
+        if any(key[0] == INTERFACE for key in unverified):
+            reads.append(client.get_interface_vlans())
+        servers = sorted(set(key[1] for key in unverified if key[0] == NIC))
+        reads.extend(client.get_server_vlans(server_id)
+                     for server_id in servers[:self._batch_size])
+        # the client records what it reads into the state
+        for read in reads:
+            try:
+                read.wait()
+            except Exception as ex:
+                LOG.debug("SeaMicro driver: failed to verify the state of "
+                          "chassis %(switch_ip)s: %(error)s",
+                          {'switch_ip': switch_ip, 'error': ex})
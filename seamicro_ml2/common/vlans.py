@@ -0,0 +1,151 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compact sets of vlan ids."""
+
+import six
+
+MAX_VLAN = 4095
+_ALL_BITS = (1 << (MAX_VLAN + 1)) - 1
+
+
+def _bit(vlan):
+    vlan = int(vlan)
+    if not 0 <= vlan <= MAX_VLAN:
+        raise ValueError(_("Invalid vlan: %s") % vlan)
+    return 1 << vlan
+
+
+def _range_bits(low, high):
+    low, high = int(low), int(high)
+    if not 0 <= low <= high <= MAX_VLAN:
+        raise ValueError(_("Invalid vlan range: %(low)s-%(high)s") %
+                         {'low': low, 'high': high})
+    return (1 << (high + 1)) - (1 << low)
+
+
+class VlanBitmap(object):
+
+    """Set of vlan ids kept as the bits of a 4096 bit integer.
+
+    Membership is a shift and union, intersection and difference of two
+    bitmaps are a single integer operation whatever the number of vlans,
+    so a chassis segment list, an uplink or a server nic costs at most
+    512 bytes. Iterating yields the vlan ids in ascending order.
+    """
+
+    __slots__ = ('bits',)
+
+    def __init__(self, vlans=(), bits=0):
+        for vlan in vlans:
+            bits |= _bit(vlan)
+        self.bits = bits
+
+    @classmethod
+    def from_range(cls, low, high):
+        """Bitmap of the vlans from low to high included."""
+        return cls(bits=_range_bits(low, high))
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Bitmap of a list of (low, high) vlan ranges."""
+        bits = 0
+        for low, high in ranges:
+            bits |= _range_bits(low, high)
+        return cls(bits=bits)
+
+    @classmethod
+    def parse(cls, value):
+        """Parse the vlans reported by a chassis.
+
+        Accepts None, a single vlan, a list of vlans or a string such as
+        '100,200-210'.
+        """
+        if value is None or value == '':
+            return cls()
+        if isinstance(value, VlanBitmap):
+            return cls(bits=value.bits)
+        if isinstance(value, six.string_types):
+            value = value.split(',')
+        elif not isinstance(value, (list, tuple, set, frozenset)):
+            value = [value]
+        bits = 0
+        for item in value:
+            item = str(item).strip()
+            if '-' in item:
+                bits |= _range_bits(*item.split('-', 1))
+            elif item:
+                bits |= _bit(item)
+        return cls(bits=bits)
+
+    def __contains__(self, vlan):
+        vlan = int(vlan)
+        return 0 <= vlan <= MAX_VLAN and bool(self.bits >> vlan & 1)
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __bool__(self):
+        return self.bits != 0
+
+    __nonzero__ = __bool__
+
+    def __or__(self, other):
+        return VlanBitmap(bits=self.bits | other.bits)
+
+    def __and__(self, other):
+        return VlanBitmap(bits=self.bits & other.bits)
+
+    def __sub__(self, other):
+        return VlanBitmap(bits=self.bits & ~other.bits)
+
+    def __xor__(self, other):
+        return VlanBitmap(bits=self.bits ^ other.bits)
+
+    def __invert__(self):
+        return VlanBitmap(bits=_ALL_BITS ^ self.bits)
+
+    def __eq__(self, other):
+        return isinstance(other, VlanBitmap) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def ranges(self):
+        """Yield the (low, high) runs of consecutive vlans, in order."""
+        bits = self.bits
+        while bits:
+            low = (bits & -bits).bit_length() - 1
+            run = bits >> low
+            length = ((run + 1) & ~run).bit_length() - 1
+            yield (low, low + length - 1)
+            bits &= ~_range_bits(low, low + length - 1)
+
+    def __str__(self):
+        return ','.join(str(low) if low == high else '%d-%d' % (low, high)
+                        for low, high in self.ranges())
+
+    def __repr__(self):
+        return 'VlanBitmap(%r)' % str(self)
@@ -0,0 +1,21 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Database migrations of the SeaMicro tables.
+
+The alembic_migrations package is registered as the seamicro-ml2 branch
+of neutron-db-manage, run "neutron-db-manage --subproject seamicro-ml2
+upgrade head" to bring the SeaMicro tables up to date.
+"""
@@ -0,0 +1,44 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""port placement
+
+Revision ID: 1f4d6e0c8a27
+Revises: 5e8a7c2b9f31
+Create Date: 2015-03-12 11:05:27.730412
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f4d6e0c8a27'
+down_revision = '5e8a7c2b9f31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # existing ports are left without placement, the driver falls back on
+    # the host mappings for them
+    op.add_column('ml2_seamicroports',
+                  sa.Column('switch_ip', sa.String(length=64),
+                            nullable=True))
+    op.add_column('ml2_seamicroports',
+                  sa.Column('server_id', sa.String(length=36),
+                            nullable=True))
+    op.add_column('ml2_seamicroports',
+                  sa.Column('nics', sa.String(length=255), nullable=True))
+    op.create_index('ix_ml2_seamicroports_switch_server',
+                    'ml2_seamicroports', ['switch_ip', 'server_id'])
@@ -0,0 +1,39 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""chassis cursors
+
+Revision ID: 2a6c8e0f4b17
+Revises: 3b2c1f9a4d10
+Create Date: 2015-03-02 11:05:13.270946
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a6c8e0f4b17'
+down_revision = '3b2c1f9a4d10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'ml2_seamicrocursors',
+        sa.Column('name', sa.String(length=36), nullable=False),
+        sa.Column('switch_ip', sa.String(length=64), nullable=True),
+        sa.Column('phase', sa.String(length=16), nullable=True),
+        sa.Column('position', sa.String(length=64), nullable=True),
+        sa.PrimaryKeyConstraint('name'))
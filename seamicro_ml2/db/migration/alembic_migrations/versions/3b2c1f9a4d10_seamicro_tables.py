@@ -0,0 +1,66 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""SeaMicro tables
+
+Revision ID: 3b2c1f9a4d10
+Revises: None
+Create Date: 2015-03-02 10:12:41.482163
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b2c1f9a4d10'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def _has_table(name):
+    return name in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    # the network and port tables predate this branch on most deployments
+    if not _has_table('ml2_seamicronetworks'):
+        op.create_table(
+            'ml2_seamicronetworks',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('tenant_id', sa.String(length=36), nullable=True),
+            sa.Column('vlan', sa.String(length=10), nullable=True),
+            sa.Column('segment_id', sa.String(length=36), nullable=True),
+            sa.Column('network_type', sa.String(length=10), nullable=True),
+            sa.PrimaryKeyConstraint('id'))
+    if not _has_table('ml2_seamicroports'):
+        op.create_table(
+            'ml2_seamicroports',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('tenant_id', sa.String(length=36), nullable=True),
+            sa.Column('network_id', sa.String(length=36), nullable=False),
+            sa.Column('vlan_id', sa.String(length=36), nullable=True),
+            sa.PrimaryKeyConstraint('id'))
+
+    op.create_table(
+        'ml2_seamicroservervlans',
+        sa.Column('switch_ip', sa.String(length=64), nullable=False),
+        sa.Column('server_id', sa.String(length=36), nullable=False),
+        sa.Column('nic', sa.String(length=36), nullable=False),
+        sa.Column('vlan', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('switch_ip', 'server_id', 'nic', 'vlan'))
+    op.create_index('ix_ml2_seamicro_server_vlans_switch_vlan',
+                    'ml2_seamicroservervlans', ['switch_ip', 'vlan'])
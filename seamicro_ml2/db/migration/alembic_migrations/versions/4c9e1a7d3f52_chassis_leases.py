@@ -0,0 +1,55 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""chassis leases
+
+Revision ID: 4c9e1a7d3f52
+Revises: 2a6c8e0f4b17
+Create Date: 2015-03-02 11:48:36.915307
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c9e1a7d3f52'
+down_revision = '2a6c8e0f4b17'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # a cursor per task and chassis, they only hold where a walk of a
+    # chassis stands and the walks start over
+    op.drop_table('ml2_seamicrocursors')
+    op.create_table(
+        'ml2_seamicrocursors',
+        sa.Column('name', sa.String(length=36), nullable=False),
+        sa.Column('switch_ip', sa.String(length=64), nullable=False),
+        sa.Column('phase', sa.String(length=16), nullable=True),
+        sa.Column('position', sa.String(length=64), nullable=True),
+        sa.PrimaryKeyConstraint('name', 'switch_ip'))
+
+    op.create_table(
+        'ml2_seamicroowners',
+        sa.Column('owner', sa.String(length=255), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('owner'))
+
+    op.create_table(
+        'ml2_seamicrochassisleases',
+        sa.Column('switch_ip', sa.String(length=64), nullable=False),
+        sa.Column('owner', sa.String(length=255), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('switch_ip'))
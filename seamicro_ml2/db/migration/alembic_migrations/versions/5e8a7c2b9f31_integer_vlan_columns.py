@@ -0,0 +1,68 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""integer vlan columns
+
+Revision ID: 5e8a7c2b9f31
+Revises: 4c9e1a7d3f52
+Create Date: 2015-03-09 16:40:03.118250
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e8a7c2b9f31'
+down_revision = '4c9e1a7d3f52'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _migrate_column(table_name, column_name, length):
+    """Turn a string vlan column into an indexed integer column.
+
+    The values are copied over to a new column, those which are not a
+    number become NULL.
+    """
+    new_name = column_name + '_new'
+    op.add_column(table_name, sa.Column(new_name, sa.Integer(),
+                                        nullable=True))
+
+    table = sa.sql.table(table_name,
+                         sa.sql.column('id', sa.String(length=36)),
+                         sa.sql.column(column_name, sa.String(length=length)),
+                         sa.sql.column(new_name, sa.Integer()))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select([table.c.id, table.c[column_name]]))
+    for row_id, value in rows.fetchall():
+        bind.execute(table.update().where(table.c.id == row_id).values(
+            {new_name: _to_int(value)}))
+
+    op.drop_column(table_name, column_name)
+    op.alter_column(table_name, new_name, new_column_name=column_name,
+                    existing_type=sa.Integer(), existing_nullable=True)
+    op.create_index(op.f('ix_%s_%s' % (table_name, column_name)),
+                    table_name, [column_name])
+
+
+def upgrade():
+    _migrate_column('ml2_seamicronetworks', 'vlan', 10)
+    _migrate_column('ml2_seamicroports', 'vlan_id', 36)
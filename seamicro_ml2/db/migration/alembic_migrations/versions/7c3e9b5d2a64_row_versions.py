@@ -0,0 +1,36 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""row versions
+
+Revision ID: 7c3e9b5d2a64
+Revises: 1f4d6e0c8a27
+Create Date: 2015-03-16 14:22:09.104583
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9b5d2a64'
+down_revision = '1f4d6e0c8a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    for table in ('ml2_seamicronetworks', 'ml2_seamicroports'):
+        op.add_column(table,
+                      sa.Column('version', sa.Integer(), nullable=False,
+                                server_default='0'))
@@ -0,0 +1,44 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""chassis vlans
+
+Revision ID: 9a4f2d6c1b83
+Revises: 7c3e9b5d2a64
+Create Date: 2015-03-23 09:41:27.316052
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9a4f2d6c1b83'
+down_revision = '7c3e9b5d2a64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'ml2_seamicrochassisvlans',
+        sa.Column('switch_ip', sa.String(length=64), nullable=False),
+        sa.Column('vlan', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('switch_ip', 'vlan'))
+    op.execute("INSERT INTO ml2_seamicrochassisvlans "
+               "(switch_ip, vlan, ref_count) "
+               "SELECT switch_ip, vlan, COUNT(*) "
+               "FROM ml2_seamicroservervlans WHERE ref_count > 0 "
+               "GROUP BY switch_ip, vlan")
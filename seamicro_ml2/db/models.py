@@ -15,29 +15,170 @@
 
 
 """SeaMicro specific database schema/model."""
+from oslo_db import exception as db_exc
 import sqlalchemy as sa
 
 from neutron.db import model_base
 from neutron.db import models_v2
 
+from seamicro_ml2.common import vlans
+
+# attempts of a compare-and-swap write before giving up, a write only
+# conflicts when another writer changed the same row in between
+MAX_CAS_ATTEMPTS = 10
+
 
 class ML2_SeaMicroNetwork(model_base.BASEV2, models_v2.HasId,
                           models_v2.HasTenant):
-    """Schema for SeaMicro network."""
+    """Schema for SeaMicro network.
+
+    version is matched by deletes, see _delete_row().
+    """
 
-    vlan = sa.Column(sa.String(10))
+    vlan = sa.Column(sa.Integer, index=True)
     segment_id = sa.Column(sa.String(36))
     network_type = sa.Column(sa.String(10))
     tenant_id = sa.Column(sa.String(36))
+    version = sa.Column(sa.Integer, nullable=False, default=0,
+                        server_default='0')
 
 
 class ML2_SeaMicroPort(model_base.BASEV2, models_v2.HasId,
                        models_v2.HasTenant):
-    """Schema for SeaMicro port."""
+    """Schema for SeaMicro port.
+
+    switch_ip, server_id and nics tell where the port was bound when it
+    was created, nics is a comma separated list and empty for all nics.
+    version is matched by deletes, see _delete_row().
+    """
     network_id = sa.Column(sa.String(36),
                            nullable=False)
-    vlan_id = sa.Column(sa.String(36))
+    vlan_id = sa.Column(sa.Integer, index=True)
     tenant_id = sa.Column(sa.String(36))
+    switch_ip = sa.Column(sa.String(64))
+    server_id = sa.Column(sa.String(36))
+    nics = sa.Column(sa.String(255))
+    version = sa.Column(sa.Integer, nullable=False, default=0,
+                        server_default='0')
+
+    __table_args__ = (sa.Index('ix_ml2_seamicroports_switch_server',
+                               'switch_ip', 'server_id'),)
+
+
+class ML2_SeaMicroServerVlan(model_base.BASEV2):
+    """Schema for a tagged vlan on a SeaMicro server nic.
+
+    ref_count is the number of ports currently relying on the vlan being
+    tagged on the nic. An empty nic stands for all nics of the server.
+    It is only changed by compare-and-swap, see add_server_vlan().
+    """
+    switch_ip = sa.Column(sa.String(64), primary_key=True)
+    server_id = sa.Column(sa.String(36), primary_key=True)
+    nic = sa.Column(sa.String(36), primary_key=True, default='')
+    vlan = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    ref_count = sa.Column(sa.Integer, nullable=False, default=0)
+
+    __table_args__ = (sa.Index('ix_ml2_seamicro_server_vlans_switch_vlan',
+                               'switch_ip', 'vlan'),)
+
+
+class ML2_SeaMicroChassisVlan(model_base.BASEV2):
+    """Schema for a vlan in use on a SeaMicro chassis.
+
+    ref_count is the number of server nics with the vlan tagged. It is
+    changed by compare-and-swap in the same transaction as the server
+    vlans, so that a single writer sees it leave or reach zero.
+    """
+    switch_ip = sa.Column(sa.String(64), primary_key=True)
+    vlan = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    ref_count = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class ML2_SeaMicroCursor(model_base.BASEV2):
+    """Schema for the position of a background task walking a chassis."""
+    name = sa.Column(sa.String(36), primary_key=True)
+    switch_ip = sa.Column(sa.String(64), primary_key=True)
+    phase = sa.Column(sa.String(16))
+    position = sa.Column(sa.String(64))
+
+
+class ML2_SeaMicroOwner(model_base.BASEV2):
+    """Schema for a neutron-server process which can own chassis."""
+    owner = sa.Column(sa.String(255), primary_key=True)
+    expires_at = sa.Column(sa.DateTime, nullable=False)
+
+
+class ML2_SeaMicroChassisLease(model_base.BASEV2):
+    """Schema for the ownership of a chassis, held until expires_at."""
+    switch_ip = sa.Column(sa.String(64), primary_key=True)
+    owner = sa.Column(sa.String(255), nullable=False)
+    expires_at = sa.Column(sa.DateTime, nullable=False)
+
+
+def _vlan(vlan):
+    return int(vlan) if vlan not in (None, '') else None
+
+
+def _in_range(column, low, high):
+    """Filter clauses restricting column to the vlans from low to high."""
+    clauses = [column.isnot(None)]
+    if low is not None:
+        clauses.append(column >= low)
+    if high is not None:
+        clauses.append(column <= high)
+    return clauses
+
+
+class ConcurrentUpdateError(Exception):
+    """A row kept changing under a compare-and-swap write."""
+
+
+def _with_cas_retries(session, write, *args):
+    """Run write in its own transaction until no row changes under it.
+
+    write raises ConcurrentUpdateError, or DBDuplicateEntry for a row
+    inserted by another writer, and is run again from a fresh read. Inside
+    an outer transaction it is run once and the error goes to the caller:
+    with REPEATABLE READ, a retry would read the same rows again.
+    """
+    if session.transaction is not None:
+        return write(session, *args)
+    for attempt in range(MAX_CAS_ATTEMPTS - 1):
+        try:
+            return write(session, *args)
+        except (ConcurrentUpdateError, db_exc.DBDuplicateEntry):
+            pass
+    return write(session, *args)
+
+
+def _delete_row(session, model, row_id):
+    row = session.query(model).filter_by(id=row_id).first()
+    if not row:
+        return None
+    with session.begin(subtransactions=True):
+        count = session.query(model).filter_by(
+            id=row_id, version=row.version).delete(
+                synchronize_session=False)
+        # the row is gone or stale either way
+        session.expunge(row)
+        if count == 1:
+            return row
+        if session.query(model.id).filter_by(id=row_id).first() is None:
+            # another writer deleted it first
+            return None
+        raise ConcurrentUpdateError(
+            _("%(model)s %(id)s changed while deleting it") %
+            {'model': model.__name__, 'id': row_id})
+
+
+def _cas_delete(context, model, row_id):
+    """Delete a row unless it changes between reading and deleting it.
+
+    :returns: the deleted row, or None if there was none or another writer
+              deleted it first.
+    """
+
+    return _with_cas_retries(context.session, _delete_row, model, row_id)
 
 
 def create_network(context, net_id, vlan, segment_id, network_type, tenant_id):
@@ -48,7 +189,7 @@ def create_network(context, net_id, vlan, segment_id, network_type, tenant_id):
     with session.begin(subtransactions=True):
         net = get_network(context, net_id, None)
         if not net:
-            net = ML2_SeaMicroNetwork(id=net_id, vlan=vlan,
+            net = ML2_SeaMicroNetwork(id=net_id, vlan=_vlan(vlan),
                                       segment_id=segment_id,
                                       network_type='vlan',
                                       tenant_id=tenant_id)
@@ -59,12 +200,7 @@ def create_network(context, net_id, vlan, segment_id, network_type, tenant_id):
 def delete_network(context, net_id):
     """Delete a SeaMicro specific network."""
 
-    session = context.session
-    with session.begin(subtransactions=True):
-        net = get_network(context, net_id, None)
-        if net:
-            session.delete(net)
-            return net
+    return _cas_delete(context, ML2_SeaMicroNetwork, net_id)
 
 
 def get_network(context, net_id, fields=None):
@@ -81,7 +217,26 @@ def get_networks(context, filters=None, fields=None):
     return session.query(ML2_SeaMicroNetwork).all()
 
 
-def create_port(context, port_id, network_id, vlan_id, tenant_id):
+def get_networks_in_range(context, low=None, high=None):
+    """Get the SeaMicro networks with a vlan from low to high, ordered."""
+
+    session = context.session
+    return session.query(ML2_SeaMicroNetwork).filter(
+        *_in_range(ML2_SeaMicroNetwork.vlan, low, high)).order_by(
+            ML2_SeaMicroNetwork.vlan).all()
+
+
+def get_network_vlans(context, low=None, high=None):
+    """Get the vlans of the SeaMicro networks, from low to high."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroNetwork.vlan).filter(
+        *_in_range(ML2_SeaMicroNetwork.vlan, low, high)).distinct()
+    return vlans.VlanBitmap(row.vlan for row in query)
+
+
+def create_port(context, port_id, network_id, vlan_id, tenant_id,
+                switch_ip=None, server_id=None, nics=None):
     """Create a SeaMicro specific port, has policy like vlan."""
 
     session = context.session
@@ -90,13 +245,29 @@ def create_port(context, port_id, network_id, vlan_id, tenant_id):
         if not port:
             port = ML2_SeaMicroPort(id=port_id,
                                     network_id=network_id,
-                                    vlan_id=vlan_id,
-                                    tenant_id=tenant_id)
+                                    vlan_id=_vlan(vlan_id),
+                                    tenant_id=tenant_id,
+                                    switch_ip=switch_ip,
+                                    server_id=server_id,
+                                    nics=','.join(nics or ()))
             session.add(port)
 
     return port
 
 
+def get_port_placement(port):
+    """Return where a port is bound as (switch_ip, server_id, nics).
+
+    nics is a tuple, empty for all nics. All three are None for a port
+    which is not bound to a known server.
+    """
+
+    if not port.switch_ip or not port.server_id:
+        return (None, None, None)
+    return (port.switch_ip, port.server_id,
+            tuple(nic for nic in (port.nics or '').split(',') if nic))
+
+
 def get_port(context, port_id):
     """get a SeaMicro specific port."""
 
@@ -112,12 +283,340 @@ def get_ports(context, network_id=None):
         network_id=network_id).all()
 
 
+def get_server_ports(context, switch_ip, server_id=None):
+    """Get the SeaMicro ports bound to a server, or to a chassis."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroPort).filter_by(switch_ip=switch_ip)
+    if server_id is not None:
+        query = query.filter_by(server_id=server_id)
+    return query.all()
+
+
+def get_server_port_vlans(context, switch_ip, server_id):
+    """Get the vlans of the SeaMicro ports bound to a server."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroPort.vlan_id).filter(
+        ML2_SeaMicroPort.switch_ip == switch_ip,
+        ML2_SeaMicroPort.server_id == server_id,
+        ML2_SeaMicroPort.vlan_id.isnot(None)).distinct()
+    return vlans.VlanBitmap(row.vlan_id for row in query)
+
+
+def get_port_vlans(context, low=None, high=None):
+    """Get the vlans used by at least one SeaMicro port, from low to high."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroPort.vlan_id).filter(
+        *_in_range(ML2_SeaMicroPort.vlan_id, low, high)).distinct()
+    return vlans.VlanBitmap(row.vlan_id for row in query)
+
+
 def delete_port(context, port_id):
     """delete SeaMicro specific port."""
 
+    return _cas_delete(context, ML2_SeaMicroPort, port_id)
+
+
+def _server_vlan_query(session, switch_ip, server_id, nic, vlan):
+    return session.query(ML2_SeaMicroServerVlan).filter_by(
+        switch_ip=switch_ip, server_id=server_id, nic=nic, vlan=vlan)
+
+
+def _swap_ref_count(session, entry, ref_count):
+    """Set the ref_count of a server vlan if it is still the one read.
+
+    This is a single UPDATE matching on the ref_count of entry, or a
+    DELETE when no reference is left, no row is locked beforehand.
+
+    :raises ConcurrentUpdateError: if another writer changed it.
+    """
+
+    query = _server_vlan_query(session, entry.switch_ip, entry.server_id,
+                               entry.nic, entry.vlan).filter_by(
+                                   ref_count=entry.ref_count)
+    if ref_count > 0:
+        count = query.update({'ref_count': ref_count},
+                             synchronize_session='evaluate')
+    else:
+        count = query.delete(synchronize_session='evaluate')
+    if count != 1:
+        raise ConcurrentUpdateError(
+            _("vlan %(vlan)s of server %(server_id)s nic '%(nic)s' changed "
+              "while updating it") %
+            {'vlan': entry.vlan, 'server_id': entry.server_id,
+             'nic': entry.nic})
+
+
+def _read_server_vlan(session, switch_ip, server_id, nic, vlan):
+    return _server_vlan_query(session, switch_ip, server_id, nic,
+                              vlan).populate_existing().first()
+
+
+def _read_chassis_vlan(session, switch_ip, vlan):
+    return session.query(ML2_SeaMicroChassisVlan).filter_by(
+        switch_ip=switch_ip, vlan=vlan).populate_existing().first()
+
+
+def _count_chassis_vlan(session, switch_ip, vlan, delta):
+    """Add delta to the number of server nics using vlan on a chassis.
+
+    Like _swap_ref_count(), the row is inserted, updated or deleted
+    matching on the ref_count read, no row is locked beforehand.
+
+    :returns: the new number of server nics using the vlan.
+    :raises ConcurrentUpdateError: if another writer changed it.
+    """
+
+    entry = _read_chassis_vlan(session, switch_ip, vlan)
+    if not entry:
+        if delta > 0:
+            session.add(ML2_SeaMicroChassisVlan(switch_ip=switch_ip,
+                                                vlan=vlan, ref_count=delta))
+        return max(delta, 0)
+    ref_count = max(entry.ref_count + delta, 0)
+    query = session.query(ML2_SeaMicroChassisVlan).filter_by(
+        switch_ip=switch_ip, vlan=vlan, ref_count=entry.ref_count)
+    if ref_count > 0:
+        count = query.update({'ref_count': ref_count},
+                             synchronize_session='evaluate')
+    else:
+        count = query.delete(synchronize_session='evaluate')
+    if count != 1:
+        raise ConcurrentUpdateError(
+            _("vlan %(vlan)s of chassis %(switch_ip)s changed while "
+              "updating it") % {'vlan': vlan, 'switch_ip': switch_ip})
+    return ref_count
+
+
+def _add_server_vlan(session, switch_ip, server_id, nics, vlan):
+    added = []
+    first = False
+    with session.begin(subtransactions=True):
+        for nic in nics:
+            entry = _read_server_vlan(session, switch_ip, server_id, nic,
+                                      vlan)
+            if not entry:
+                session.add(ML2_SeaMicroServerVlan(switch_ip=switch_ip,
+                                                   server_id=server_id,
+                                                   nic=nic, vlan=vlan,
+                                                   ref_count=1))
+                added.append(nic)
+                continue
+            if not entry.ref_count:
+                added.append(nic)
+            _swap_ref_count(session, entry, entry.ref_count + 1)
+        if added:
+            first = _count_chassis_vlan(session, switch_ip, vlan,
+                                        len(added)) == len(added)
+    return (added, first)
+
+
+def add_server_vlan(context, switch_ip, server_id, nics, vlan):
+    """Take a reference on vlan for the given nics of a server.
+
+    The references are counted by compare-and-swap. Two writers can both
+    find a row missing and insert it, the second insert then fails with
+    DBDuplicateEntry. The writer losing a race runs its transaction again
+    from a fresh read, see _with_cas_retries(). The server nics using the
+    vlan are counted per chassis in the same transaction, so that first
+    holds across neutron-server processes.
+
+    :returns: a tuple (nics, first) where nics is the list of nics on
+              which the vlan has to be tagged now ('' standing for all
+              nics) and first is True when no other server of the chassis
+              had the vlan yet.
+    """
+
+    return _with_cas_retries(context.session, _add_server_vlan, switch_ip,
+                             server_id, nics or [''], int(vlan))
+
+
+def _remove_server_vlan(session, switch_ip, server_id, nics, vlan):
+    removed = []
+    with session.begin(subtransactions=True):
+        for nic in nics:
+            entry = _read_server_vlan(session, switch_ip, server_id, nic,
+                                      vlan)
+            if not entry:
+                continue
+            if entry.ref_count <= 1:
+                removed.append(nic)
+            _swap_ref_count(session, entry, entry.ref_count - 1)
+        if not removed:
+            return ([], False)
+        last = _count_chassis_vlan(session, switch_ip, vlan,
+                                   -len(removed)) == 0
+    return (removed, last)
+
+
+def remove_server_vlan(context, switch_ip, server_id, nics, vlan):
+    """Drop a reference on vlan for the given nics of a server.
+
+    The references are counted by compare-and-swap, see add_server_vlan().
+
+    :returns: a tuple (nics, last) where nics is the list of nics on
+              which the vlan has to be untagged now ('' standing for all
+              nics) and last is True when no server of the chassis uses
+              the vlan any more.
+    """
+
+    return _with_cas_retries(context.session, _remove_server_vlan,
+                             switch_ip, server_id, nics or [''], int(vlan))
+
+
+def get_server_vlans(context, switch_ip, server_id=None):
+    """Get the tagged vlans of the servers of a chassis."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroServerVlan).filter(
+        ML2_SeaMicroServerVlan.switch_ip == switch_ip,
+        ML2_SeaMicroServerVlan.ref_count > 0)
+    if server_id is not None:
+        query = query.filter_by(server_id=server_id)
+    return query.all()
+
+
+def get_chassis_vlans(context, switch_ip, low=None, high=None):
+    """Get the vlans in use on a chassis, from low to high.
+
+    A vlan is in use on a chassis while it is tagged on at least one of
+    its servers.
+    """
+
+    session = context.session
+    query = session.query(ML2_SeaMicroServerVlan.vlan).filter(
+        ML2_SeaMicroServerVlan.switch_ip == switch_ip,
+        ML2_SeaMicroServerVlan.ref_count > 0,
+        *_in_range(ML2_SeaMicroServerVlan.vlan, low, high)).distinct()
+    return vlans.VlanBitmap(row.vlan for row in query)
+
+
+def get_server_vlan_bitmaps(context, switch_ip):
+    """Get the tagged vlans of the servers of a chassis as bitmaps.
+
+    :returns: a dict of VlanBitmap by (server_id, nic), nic '' standing
+              for all nics of the server.
+    """
+
+    session = context.session
+    query = session.query(ML2_SeaMicroServerVlan.server_id,
+                          ML2_SeaMicroServerVlan.nic,
+                          ML2_SeaMicroServerVlan.vlan).filter(
+        ML2_SeaMicroServerVlan.switch_ip == switch_ip,
+        ML2_SeaMicroServerVlan.ref_count > 0)
+    bits = {}
+    for row in query:
+        key = (row.server_id, row.nic)
+        bits[key] = bits.get(key, 0) | 1 << row.vlan
+    return dict((key, vlans.VlanBitmap(bits=value))
+                for key, value in bits.items())
+
+
+def get_vlan_chassis(context, vlan):
+    """Get the chassis on which at least one server has vlan tagged."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroServerVlan.switch_ip).filter(
+        ML2_SeaMicroServerVlan.vlan == int(vlan),
+        ML2_SeaMicroServerVlan.ref_count > 0).distinct()
+    return [row.switch_ip for row in query]
+
+
+def get_cursor(context, name, switch_ip):
+    """Get the position of a background task on a chassis."""
+
+    session = context.session
+    return session.query(ML2_SeaMicroCursor).filter_by(
+        name=name, switch_ip=switch_ip).first()
+
+
+def set_cursor(context, name, switch_ip, phase, position=None):
+    """Save the position of a background task on a chassis."""
+
     session = context.session
     with session.begin(subtransactions=True):
-        port = get_port(context, port_id)
-        if port:
-            session.delete(port)
-            return port
+        cursor = get_cursor(context, name, switch_ip)
+        if not cursor:
+            cursor = ML2_SeaMicroCursor(name=name, switch_ip=switch_ip)
+            session.add(cursor)
+        cursor.phase = phase
+        cursor.position = position
+    return cursor
+
+
+def renew_owner(context, owner, expires_at):
+    """Record that owner is alive until expires_at."""
+
+    session = context.session
+    with session.begin(subtransactions=True):
+        entry = session.query(ML2_SeaMicroOwner).filter_by(
+            owner=owner).first()
+        if not entry:
+            entry = ML2_SeaMicroOwner(owner=owner)
+            session.add(entry)
+        entry.expires_at = expires_at
+
+
+def get_live_owners(context, now):
+    """Get the set of owners whose liveness has not expired at now."""
+
+    session = context.session
+    query = session.query(ML2_SeaMicroOwner.owner).filter(
+        ML2_SeaMicroOwner.expires_at > now)
+    return set(row.owner for row in query)
+
+
+def delete_owners(context, expired_before):
+    """Forget the owners which have been dead since expired_before."""
+
+    session = context.session
+    with session.begin(subtransactions=True):
+        session.query(ML2_SeaMicroOwner).filter(
+            ML2_SeaMicroOwner.expires_at < expired_before).delete()
+
+
+def get_chassis_leases(context):
+    """Get the leases of all chassis."""
+
+    session = context.session
+    return session.query(ML2_SeaMicroChassisLease).all()
+
+
+def take_chassis_lease(context, switch_ip, owner, expires_at, free_before):
+    """Take or renew the lease of a chassis until expires_at.
+
+    The lease is only taken when it is held by owner already, or when it
+    expired before free_before.
+
+    :returns: True if owner holds the lease now.
+    """
+
+    session = context.session
+    try:
+        with session.begin(subtransactions=True):
+            lease = session.query(ML2_SeaMicroChassisLease).filter_by(
+                switch_ip=switch_ip).with_lockmode('update').first()
+            if not lease:
+                lease = ML2_SeaMicroChassisLease(switch_ip=switch_ip)
+                session.add(lease)
+            elif lease.owner != owner and lease.expires_at > free_before:
+                return False
+            lease.owner = owner
+            lease.expires_at = expires_at
+    except db_exc.DBDuplicateEntry:
+        # another owner created the lease concurrently
+        return False
+    return True
+
+
+def release_chassis_lease(context, switch_ip, owner, now):
+    """Give up the lease of a chassis if owner holds it."""
+
+    session = context.session
+    with session.begin(subtransactions=True):
+        lease = session.query(ML2_SeaMicroChassisLease).filter_by(
+            switch_ip=switch_ip, owner=owner).with_lockmode('update').first()
+        if lease:
+            lease.expires_at = now
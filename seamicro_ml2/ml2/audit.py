@@ -0,0 +1,257 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Rolling audit of the chassis against the SeaMicro db."""
+
+import bisect
+import collections
+
+from neutron import context as neutron_context
+from neutron.i18n import _LE, _LI, _LW
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+
+from seamicro_ml2.common import ratelimit
+from seamicro_ml2.common import vlans
+from seamicro_ml2.db import models as seamicro_db
+
+LOG = log.getLogger(__name__)
+
+CURSOR = 'audit'
+
+VLANS = 'vlans'
+SERVERS = 'servers'
+PHASES = (VLANS, SERVERS)
+
+# kinds of drift, a vlan missing from
+SEGMENT = 'segment'
+INTERFACE = 'interface'
+NIC = 'nic'
+DRIFTS = (SEGMENT, INTERFACE, NIC)
+
+
+class ChassisAuditor(object):
+
+    """Check that the chassis have every vlan the SeaMicro db expects.
+
+    Each run audits a slice of every chassis: either the next
+    vlans_per_run vlans of its segments and uplinks, or the next
+    servers_per_run of its servers. The load on a chassis stays flat, and
+    a whole chassis is covered every (4095 / vlans_per_run + servers /
+    servers_per_run) runs. The segments and uplinks are read once per
+    pass, when their first slice is audited. They are always read from
+    the chassis: the chassis state is kept fresh by the writes of this
+    process and would hide drift. Where the audit of each chassis stands
+    is kept in the db, and the next owner of the chassis goes on from
+    there. Only the chassis for which owns returns True are audited, all
+    by default.
+
+    A vlan missing from a segment, an uplink or a server nic is counted
+    as drift of the current pass, see stats(). With repair, it is also
+    queued, and up to servers_per_run of the queued vlans are tagged
+    again by the next run, if the db still expects them. Vlans the db
+    does not know of are left to the vlan garbage collector.
+    """
+
+    def __init__(self, clients, servers, vlans_per_run=256,
+                 servers_per_run=16, lazy_segments=False, repair=False,
+                 owns=None):
+        self._clients = clients
+        self._servers = servers
+        self._vlans_per_run = max(vlans_per_run, 1)
+        self._servers_per_run = max(servers_per_run, 1)
+        self._lazy_segments = lazy_segments
+        self._repair = repair
+        self._owns = owns
+        self._loop = None
+        # switch_ip -> Counter of drift kind found by the current pass, and
+        # by the last complete one
+        self._drift = collections.defaultdict(collections.Counter)
+        self._pass_drift = collections.defaultdict(collections.Counter)
+        # switch_ip -> Counter of the audited items
+        self._audited = collections.defaultdict(collections.Counter)
+        # switch_ip -> (segments, uplink vlans) read for the current pass
+        self._chassis_vlans = {}
+        # (switch_ip, kind, vlan, server_id, nic) of the vlans to repair
+        self._repairs = collections.OrderedDict()
+
+    def start(self, interval):
+        if self._loop is None:
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.run_once)
+            self._loop.start(interval, initial_delay=interval)
+
+    def run_once(self):
+        context = neutron_context.get_admin_context()
+        try:
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                self._run(context)
+        except Exception:
+            LOG.exception(_LE("SeaMicro driver: chassis audit failed"))
+
+    def stats(self, switch_ip):
+        """Return the drift found on a chassis and the audit progress.
+
+        drift is what the last complete pass found, drift_this_pass what
+        the current pass found so far.
+        """
+        return {'drift': dict((kind, self._pass_drift[switch_ip][kind])
+                              for kind in DRIFTS),
+                'drift_this_pass': dict((kind, self._drift[switch_ip][kind])
+                                        for kind in DRIFTS),
+                'vlans_audited': self._audited[switch_ip][VLANS],
+                'servers_audited': self._audited[switch_ip][SERVERS],
+                'passes': self._audited[switch_ip]['passes'],
+                'repaired': self._audited[switch_ip]['repaired'],
+                'repair_queued': sum(1 for key in self._repairs
+                                     if key[0] == switch_ip)}
+
+    def _run(self, context):
+        switch_ips = [switch_ip for switch_ip in sorted(self._clients)
+                      if self._clients.is_ready(switch_ip) and
+                      (self._owns is None or self._owns(switch_ip))]
+        if self._repairs:
+            self._repair_queued(context, set(switch_ips))
+        for switch_ip in switch_ips:
+            try:
+                self._audit(context, switch_ip)
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to audit chassis "
+                                "%(switch_ip)s: %(error)s"),
+                            {'switch_ip': switch_ip, 'error': ex})
+
+    def _audit(self, context, switch_ip):
+        phase, position = PHASES[0], None
+        cursor = seamicro_db.get_cursor(context, CURSOR, switch_ip)
+        if cursor and cursor.phase in PHASES:
+            phase, position = cursor.phase, cursor.position
+
+        audit = getattr(self, '_audit_' + phase)
+        position = audit(context, self._clients[switch_ip], switch_ip,
+                         position)
+        if position is None:
+            if phase != PHASES[-1]:
+                phase = PHASES[PHASES.index(phase) + 1]
+            else:
+                phase = PHASES[0]
+                self._audited[switch_ip]['passes'] += 1
+                drift = self._pass_drift[switch_ip] = self._drift.pop(
+                    switch_ip, collections.Counter())
+                LOG.info(_LI("SeaMicro driver: audited chassis "
+                             "%(switch_ip)s, drift %(drift)s"),
+                         {'switch_ip': switch_ip, 'drift': dict(drift)})
+        seamicro_db.set_cursor(context, CURSOR, switch_ip, phase, position)
+
+    def _found(self, switch_ip, kind, missing, what='', server_id=None,
+               nic=None):
+        if not missing:
+            return
+        self._drift[switch_ip][kind] += len(missing)
+        LOG.warning(_LW("SeaMicro driver: vlans %(vlans)s missing from "
+                        "%(kind)s %(what)s on chassis %(switch_ip)s"),
+                    {'vlans': missing, 'kind': kind, 'what': what,
+                     'switch_ip': switch_ip})
+        if self._repair:
+            for vlan in missing:
+                self._repairs[(switch_ip, kind, vlan, server_id, nic)] = None
+
+    def _audit_vlans(self, context, client, switch_ip, position):
+        low = int(position) + 1 if position else 1
+        high = min(low + self._vlans_per_run - 1, vlans.MAX_VLAN)
+        if not position or switch_ip not in self._chassis_vlans:
+            segments = client.get_segments()
+            interfaces = client.get_interface_vlans()
+            self._chassis_vlans[switch_ip] = (segments.wait(),
+                                              interfaces.wait())
+        segments, interfaces = self._chassis_vlans[switch_ip]
+
+        used = seamicro_db.get_chassis_vlans(context, switch_ip, low, high)
+        if self._lazy_segments:
+            wanted = used
+        else:
+            wanted = seamicro_db.get_network_vlans(context, low, high)
+        self._found(switch_ip, SEGMENT, wanted - segments)
+        for interface_id, tagged in sorted(interfaces.items()):
+            self._found(switch_ip, INTERFACE, used - tagged, interface_id)
+        self._audited[switch_ip][VLANS] += high - low + 1
+        if high < vlans.MAX_VLAN:
+            return str(high)
+        del self._chassis_vlans[switch_ip]
+
+    def _audit_servers(self, context, client, switch_ip, position):
+        servers = sorted(self._servers(switch_ip))
+        start = bisect.bisect_right(servers, position) if position else 0
+        batch = servers[start:start + self._servers_per_run]
+
+        wanted = seamicro_db.get_server_vlan_bitmaps(context, switch_ip)
+        none = vlans.VlanBitmap()
+        reads = [(server_id, client.get_server_vlans(server_id))
+                 for server_id in batch]
+        for server_id, read in reads:
+            try:
+                nics = read.wait()
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to get the vlans of "
+                                "server %(server_id)s on switch "
+                                "%(switch_ip)s: %(error)s"),
+                            {'server_id': server_id, 'switch_ip': switch_ip,
+                             'error': ex})
+                continue
+            all_nics = wanted.get((server_id, ''), none)
+            for nic, tagged in sorted(nics.items()):
+                expected = all_nics | wanted.get((server_id, nic), none)
+                self._found(switch_ip, NIC, expected - tagged,
+                            '%s:%s' % (server_id, nic), server_id, nic)
+            self._audited[switch_ip][SERVERS] += 1
+        if start + len(batch) < len(servers):
+            return batch[-1]
+
+    def _still_wanted(self, context, key):
+        switch_ip, kind, vlan, server_id, nic = key
+        if kind == NIC:
+            return any(row.vlan == vlan and row.nic in ('', nic)
+                       for row in seamicro_db.get_server_vlans(
+                           context, switch_ip, server_id))
+        if kind == SEGMENT and not self._lazy_segments:
+            return vlan in seamicro_db.get_network_vlans(context, vlan, vlan)
+        return vlan in seamicro_db.get_chassis_vlans(context, switch_ip,
+                                                     vlan, vlan)
+
+    def _repair_queued(self, context, switch_ips):
+        keys = [key for key in self._repairs
+                if key[0] in switch_ips][:self._servers_per_run]
+        calls = []
+        for key in keys:
+            del self._repairs[key]
+            if not self._still_wanted(context, key):
+                continue
+            switch_ip, kind, vlan, server_id, nic = key
+            client = self._clients[switch_ip]
+            if kind == SEGMENT:
+                call = client.add_segment(vlan)
+            elif kind == INTERFACE:
+                call = client.tag_interfaces(vlan)
+            else:
+                call = client.tag_server(server_id, vlan, [nic])
+            calls.append((key, call))
+        for key, call in calls:
+            try:
+                call.wait()
+                self._audited[key[0]]['repaired'] += 1
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to repair vlan "
+                                "%(vlan)s of %(kind)s on chassis "
+                                "%(switch_ip)s: %(error)s"),
+                            {'vlan': key[2], 'kind': key[1],
+                             'switch_ip': key[0], 'error': ex})
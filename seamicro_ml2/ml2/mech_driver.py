@@ -13,12 +13,32 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from neutron.i18n import _LE, _LI
+import functools
+import os
+import time
+
+import eventlet
+
+from neutron.i18n import _LE, _LI, _LW
 from neutron.openstack.common import log
 
+from seamicro_ml2.common import capture
+from seamicro_ml2.common import chassis
 from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import config  # noqa
+from seamicro_ml2.common import dispatcher
+from seamicro_ml2.common import hotlog
+from seamicro_ml2.common import instrumentation
+from seamicro_ml2.common import inventory
+from seamicro_ml2.common import state as chassis_state
 from seamicro_ml2.db import models as seamicro_db
+from seamicro_ml2.ml2 import audit
+from seamicro_ml2.ml2 import ownership
+from seamicro_ml2.ml2 import vlan_gc
 
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_utils import excutils
 from oslo_utils import importutils
 
 seamicroclient = importutils.try_import('seamicroclient')
@@ -27,6 +47,9 @@ if seamicroclient:
 
 LOG = log.getLogger(__name__)
 
+# keys of a [ml2_mech_seamicro:<ip>] section which are not host mappings
+SWITCH_PARAMS = ('username', 'password', 'api_version', 'uplinks')
+
 
 def _parse_switch_info(switch_ip, **kwargs):
     api_endpoint = 'http://' + switch_ip + '/v' + kwargs['api_version'] + '.0'
@@ -37,15 +60,66 @@ def _parse_switch_info(switch_ip, **kwargs):
     return switch_info
 
 
-def _get_switch_info(switch_info, host_id):
-    """Get the chassis IP and server ID the host_id belongs to."""
-    for switch_ip in switch_info:
-        if host_id in switch_info[switch_ip]:
-            info = switch_info[switch_ip][host_id].split(",")
-            return (switch_ip, info[0], info[1:])
+def _get_switch_info(host_index, host_id, host_inventory=None,
+                     discovery=None, mac=None):
+    """Get the chassis IP and server ID the host_id belongs to.
+
+    The discovered servers are only searched for hosts which are not
+    configured, by host name and then by the mac of a bare metal port.
+    """
+    if host_inventory is not None:
+        info = host_inventory.lookup(host_id)
+        if info is not None:
+            return info
+    info = host_index.get(host_id)
+    if info is not None:
+        return info
+    if discovery is not None:
+        info = discovery.lookup(host_id) or discovery.lookup_mac(mac)
+        if info is not None:
+            return info
     return (None, None, None)
 
 
+def build_client(switch_ip, params, state=None):
+    """Build the GreenSeaMicroClient of a chassis and resolve its uplinks.
+
+    :param params: the keys of the [ml2_mech_seamicro:<ip>] section.
+    """
+    switch_info = _parse_switch_info(switch_ip, **params)
+    c = seamicro_client.SeaMicroRestClient()
+    conf = cfg.CONF.ml2_mech_seamicro
+    rest_client = c.get_client(**switch_info)
+    if conf.capture_file:
+        rest_client = capture.CapturingClient(
+            rest_client, capture.get_capture(conf.capture_file,
+                                             conf.capture_max_bytes,
+                                             conf.capture_backup_count),
+            switch_ip)
+    client = seamicro_client.GreenSeaMicroClient(
+        instrumentation.CountingClient(rest_client),
+        max_requests=conf.chassis_max_requests,
+        min_requests=conf.chassis_min_requests,
+        rate=conf.chassis_rate_limit,
+        burst=conf.chassis_rate_burst,
+        latency_target=conf.chassis_latency_target,
+        max_wait=conf.chassis_background_max_wait,
+        state=state,
+        uplinks=seamicro_client.parse_uplinks(params.get('uplinks')),
+        server_ttl=conf.server_cache_ttl)
+    client.resolve_uplinks()
+    return client
+
+
+def _per_process(func):
+    """Start the driver in the calling process before running a hook."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        self._ensure_started()
+        return func(self, *args, **kwargs)
+    return wrapper
+
+
 class SeaMicroDriver(object):
 
     """SeaMicroPython Driver for Neutron.
@@ -56,14 +130,264 @@ class SeaMicroDriver(object):
 
     def __init__(self, **switch):
         LOG.debug("Initializing SeaMicro ML2 driver")
-        self.client = {}
         self._switch = switch
-        for switch_ip in self._switch:
-            switch_info = _parse_switch_info(switch_ip,
-                                             **self._switch[switch_ip])
-            c = seamicro_client.SeaMicroRestClient()
-            self.client[switch_ip] = c.get_client(**switch_info)
-
+        conf = cfg.CONF.ml2_mech_seamicro
+        self._log = hotlog.HotLog(LOG, conf.log_rate_limit_interval,
+                                  conf.log_rate_limit_burst)
+        self._lazy_segments = conf.lazy_segments
+        self._state_max_age = conf.state_max_age
+        self._hosts = inventory.index_switches(self._switch, SWITCH_PARAMS)
+        # neutron-server builds the driver before forking its API workers,
+        # which drop the green threads of the parent: the chassis bootstrap
+        # and the background loops are started in each process on first use.
+        self._pid = None
+        self._summary = None
+        self._state = None
+        self._clients = None
+        self._dispatcher = None
+        self._inventory = None
+        self._discovery = None
+        self._ownership = None
+        self._snapshot = None
+        self._audit = None
+        self._vlan_gc = None
+
+    @property
+    def client(self):
+        """The chassis clients of the calling process."""
+        self._ensure_started()
+        return self._clients
+
+    def _ensure_started(self):
+        """Start the bootstrap and background loops once per process."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        LOG.debug("Starting SeaMicro ML2 driver in process %s", self._pid)
+        conf = cfg.CONF.ml2_mech_seamicro
+        self._summary = None
+        if conf.log_summary_interval > 0:
+            self._summary = hotlog.Summary(LOG, conf.log_summary_interval,
+                                           hotlog=self._log)
+            self._summary.start()
+        self._state = chassis_state.StateCache()
+        self._clients = chassis.ChassisClients(
+            self._switch, self._build_client,
+            ready_timeout=conf.chassis_ready_timeout,
+            workers=conf.chassis_bootstrap_workers,
+            retry_interval=conf.chassis_bootstrap_retry_interval)
+        self._dispatcher = dispatcher.OrderedDispatcher()
+
+        self._inventory = None
+        if conf.host_inventory_file:
+            self._inventory = inventory.HostInventory(
+                conf.host_inventory_file, self._switch)
+            self._inventory.start(conf.host_inventory_reload_interval)
+        self._discovery = None
+        if conf.host_discovery_interval > 0:
+            self._discovery = inventory.ServerDiscovery(
+                self._clients, known=self._configured_host)
+        # the hosts are known by now, to warm up the server handles
+        self._clients.start()
+
+        self._ownership = None
+        if conf.chassis_lease_duration > 0:
+            self._ownership = ownership.ChassisOwnership(
+                self._switch, conf.chassis_lease_duration)
+            self._ownership.start()
+
+        self._snapshot = None
+        if conf.state_snapshot_file:
+            self._snapshot = chassis_state.StateSnapshot(
+                conf.state_snapshot_file, self._state, self._clients,
+                owns=self.owns_chassis, batch_size=conf.gc_batch_size)
+            self._snapshot.start(conf.state_snapshot_interval)
+
+        if self._discovery is not None:
+            self._discovery.start(conf.host_discovery_interval)
+
+        self._audit = None
+        if conf.audit_interval > 0:
+            self._audit = audit.ChassisAuditor(
+                self._clients, self._chassis_servers,
+                vlans_per_run=conf.audit_vlans_per_run,
+                servers_per_run=conf.audit_servers_per_run,
+                lazy_segments=self._lazy_segments,
+                repair=conf.audit_repair, owns=self.owns_chassis)
+            self._audit.start(conf.audit_interval)
+
+        self._vlan_gc = None
+        if conf.gc_interval > 0:
+            if conf.gc_vlan_ranges:
+                self._vlan_gc = vlan_gc.VlanGarbageCollector(
+                    self._clients, self._chassis_servers,
+                    vlan_gc.parse_vlan_ranges(conf.gc_vlan_ranges),
+                    batch_size=conf.gc_batch_size,
+                    lazy_segments=self._lazy_segments,
+                    owns=self.owns_chassis,
+                    grace_period=conf.gc_grace_period,
+                    max_age=conf.state_max_age)
+                self._vlan_gc.start(conf.gc_interval)
+            else:
+                LOG.warning(_LW("SeaMicro driver: gc_vlan_ranges is not set, "
+                                "the vlan garbage collector is disabled"))
+
+    def _build_client(self, switch_ip):
+        client = build_client(switch_ip, self._switch[switch_ip],
+                              state=self._state[switch_ip])
+        eventlet.spawn_n(client.warm_servers,
+                         sorted(self._chassis_servers(switch_ip)))
+        return client
+
+    def _tag_port(self, context, switch_ip, server_id, nics, vlan_id):
+        """Tag vlan_id on the nics of a server and the chassis uplinks.
+
+        The chassis is only changed where the port is the first one to need
+        the vlan.
+        """
+        tag_nics, first = seamicro_db.add_server_vlan(
+            context, switch_ip, server_id, nics, vlan_id)
+        try:
+            client = self.client[switch_ip]
+            if first and self._lazy_segments:
+                client.add_segment(vlan_id).wait()
+            calls = []
+            if first:
+                calls.append(client.tag_interfaces(vlan_id))
+            if tag_nics:
+                calls.append(client.tag_server(
+                    server_id, vlan_id, [nic for nic in tag_nics if nic]))
+            seamicro_client.wait_all(calls)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                seamicro_db.remove_server_vlan(context, switch_ip, server_id,
+                                               nics, vlan_id)
+
+    def _untag_port(self, context, switch_ip, server_id, nics, vlan_id):
+        """Untag vlan_id where the port was the last one to need it."""
+        untag_nics, last = seamicro_db.remove_server_vlan(
+            context, switch_ip, server_id, nics, vlan_id)
+        client = self.client[switch_ip]
+        calls = []
+        if last:
+            calls.append(client.untag_interfaces(vlan_id))
+        if untag_nics:
+            calls.append(client.untag_server(
+                server_id, vlan_id, [nic for nic in untag_nics if nic]))
+        seamicro_client.wait_all(calls)
+        if last and self._lazy_segments:
+            client.remove_segment(vlan_id).wait()
+
+    def _get_port_placement(self, context, port_id, network_id, host_id,
+                            mac=None):
+        """Return the switch_ip, server_id, nics and vlan of a port.
+
+        They are read from the port row. Ports created before the row kept
+        them fall back on the network row and the host mappings, or the
+        discovered server with the port mac.
+        """
+        try:
+            port = seamicro_db.get_port(context, port_id)
+            if port is not None and port.switch_ip:
+                return (seamicro_db.get_port_placement(port) +
+                        (port.vlan_id,))
+            network = seamicro_db.get_network(context, network_id)
+            vlan_id = network['vlan']
+        except Exception:
+            LOG.exception(
+                _LE("SeaMicro Mechanism: failed to get port %s from db"),
+                port_id)
+            raise Exception(
+                _("SeaMicro Mechanism: failed to get port %s from db") %
+                port_id)
+        return _get_switch_info(self._hosts, host_id, self._inventory,
+                                self._discovery, mac) + (vlan_id,)
+
+    def _configured_host(self, host_id):
+        """Return the configured (switch_ip, server_id, nics) of a host."""
+        info = _get_switch_info(self._hosts, host_id, self._inventory)
+        return info if info[0] is not None else None
+
+    def _chassis_servers(self, switch_ip):
+        """Get the ids of the known servers of a chassis."""
+        servers = self._hosts.servers(switch_ip)
+        if self._inventory is not None:
+            servers |= self._inventory.servers(switch_ip)
+        if self._discovery is not None:
+            servers |= self._discovery.servers(switch_ip)
+        return servers
+
+    def owns_chassis(self, switch_ip):
+        """Whether background work on switch_ip belongs to this process."""
+        return self._ownership is None or self._ownership.owns(switch_ip)
+
+    def chassis_stats(self):
+        """Return the readiness, limits and queue depths of each chassis."""
+        stats = self.client.stats()
+        for switch_ip in stats:
+            stats[switch_ip]['owned'] = self.owns_chassis(switch_ip)
+            if self._audit is not None:
+                stats[switch_ip]['audit'] = self._audit.stats(switch_ip)
+        return stats
+
+    def _detail(self, msg, params):
+        """Log the details of an operation, at debug level if summarized."""
+        if self._summary is None:
+            self._log.info(msg, params)
+        else:
+            self._log.debug(msg, params)
+
+    def _done(self, action, noun, switch_ip, started, failed=False,
+              msg=None, params=None):
+        """Record an operation on a chassis in the summary, if any."""
+        if self._summary is not None:
+            self._summary.record(action, noun, switch_ip,
+                                 time.time() - started, failed)
+        if msg is not None:
+            self._detail(msg, params)
+
+    def _vlan_call(self, switch_ip, method, vlan_id):
+        return getattr(self.client[switch_ip], method)(vlan_id).wait()
+
+    def _may_have_segment(self, switch_ip, vlan_id):
+        """Whether the segment of vlan_id may be on a chassis.
+
+        Only segments read from the chassis at most state_max_age seconds
+        ago can tell it is not.
+        """
+        state = self._state[switch_ip]
+        if not (self._state_max_age and state.is_fresh(
+                chassis_state.SEGMENTS_KEY, self._state_max_age)):
+            return True
+        return int(vlan_id) in state.get(chassis_state.SEGMENTS_KEY)
+
+    def _call_all_chassis(self, method, vlan_id, switch_ips=None):
+        """Run a vlan operation on every chassis concurrently.
+
+        :param switch_ips: chassis to run the operation on, all by default.
+        :returns: a list of (switch_ip, error) pairs, error is None for the
+                  chassis on which the operation succeeded.
+        """
+        if switch_ips is None:
+            switch_ips = self._switch
+
+        calls = []
+        for switch_ip in switch_ips:
+            calls.append((switch_ip, self._dispatcher.submit(
+                [dispatcher.vlan_key(switch_ip, vlan_id)],
+                self._vlan_call, switch_ip, method, vlan_id)))
+        results = []
+        for switch_ip, call in calls:
+            try:
+                call.wait()
+                results.append((switch_ip, None))
+            except (seamicro_client_exception.ClientException,
+                    chassis.ChassisNotReady) as ex:
+                results.append((switch_ip, ex))
+        return results
+
+    @instrumentation.hook
+    @_per_process
     def create_network_precommit(self, mech_context):
         """Create Network in the mechanism specific database table."""
 
@@ -95,19 +419,22 @@ class SeaMicroDriver(object):
             raise Exception(
                 _("SeaMicro Mechanism: create_network_precommit failed"))
 
-        LOG.info(_LI("create network (precommit): %(network_id)s "
-                     "of network type = %(network_type)s "
-                     "with vlan = %(vlan_id)s "
-                     "for tenant %(tenant_id)s"),
-                 {'network_id': network_id,
-                  'network_type': network_type,
-                  'vlan_id': vlan_id,
-                  'tenant_id': tenant_id})
+        self._detail(_LI("create network (precommit): %(network_id)s "
+                         "of network type = %(network_type)s "
+                         "with vlan = %(vlan_id)s "
+                         "for tenant %(tenant_id)s"),
+                     {'network_id': network_id,
+                      'network_type': network_type,
+                      'vlan_id': vlan_id,
+                      'tenant_id': tenant_id})
 
+    @instrumentation.hook
+    @_per_process
     def create_network_postcommit(self, mech_context):
         """Create Network as a segment on the switch."""
 
         LOG.debug("create_network_postcommit: called")
+        started = time.time()
         network = mech_context.current
         # use network_id to get the network attributes
         # ONLY depend on our db for getting back network attributes
@@ -132,29 +459,42 @@ class SeaMicroDriver(object):
         if not vlan_id:
             raise Exception(_("No vlan id provided"))
 
-        for switch_ip in self._switch:
-            try:
-                system = self.client[switch_ip].system.list()
-                system[0].add_segment(vlan_id)
-            except seamicro_client_exception.ClientException as ex:
-                LOG.exception(_LE("SeaMicro driver: failed in create network"
-                                  " with the following error: %(error)s"),
-                              {'error': ex.message})
-                seamicro_db.delete_network(context, network_id)
-                raise Exception(
-                    _("Seamicro Mechanism: create_network_postcommmit failed"))
-
-            LOG.info(_LI("created network (postcommit): %(network_id)s"
-                         " of network type = %(network_type)s"
-                         " with vlan = %(vlan_id)s"
-                         " for tenant %(tenant_id)s"
-                         " on switch %(switch_ip)s"),
-                     {'network_id': network_id,
-                      'network_type': network_type,
-                      'vlan_id': vlan_id,
-                      'tenant_id': tenant_id,
-                      'switch_ip': switch_ip})
+        if self._lazy_segments:
+            # the segment is added to a chassis with the first port of the
+            # network bound to one of its servers
+            return
+
+        failed = False
+        for switch_ip, ex in self._call_all_chassis('add_segment', vlan_id):
+            if ex is not None:
+                LOG.error(_LE("SeaMicro driver: failed in create network"
+                              " on switch %(switch_ip)s"
+                              " with the following error: %(error)s"),
+                          {'switch_ip': switch_ip, 'error': ex.message})
+                self._done('created', 'networks', switch_ip, started,
+                           failed=True)
+                failed = True
+                continue
+
+            self._done('created', 'networks', switch_ip, started,
+                       msg=_LI("created network (postcommit): %(network_id)s"
+                               " of network type = %(network_type)s"
+                               " with vlan = %(vlan_id)s"
+                               " for tenant %(tenant_id)s"
+                               " on switch %(switch_ip)s"),
+                       params={'network_id': network_id,
+                               'network_type': network_type,
+                               'vlan_id': vlan_id,
+                               'tenant_id': tenant_id,
+                               'switch_ip': switch_ip})
+
+        if failed:
+            seamicro_db.delete_network(context, network_id)
+            raise Exception(
+                _("Seamicro Mechanism: create_network_postcommmit failed"))
 
+    @instrumentation.hook
+    @_per_process
     def delete_network_precommit(self, mech_context):
         """Delete Network from the plugin specific database table."""
 
@@ -174,50 +514,74 @@ class SeaMicroDriver(object):
             raise Exception(
                 _("SeaMicro Mechanism: delete_network_precommit failed"))
 
-        LOG.info(_LI("delete network (precommit): %(network_id)s"
-                     " with vlan = %(vlan_id)s"
-                     " for tenant %(tenant_id)s"),
-                 {'network_id': network_id,
-                  'vlan_id': vlan_id,
-                  'tenant_id': tenant_id})
+        self._detail(_LI("delete network (precommit): %(network_id)s"
+                         " with vlan = %(vlan_id)s"
+                         " for tenant %(tenant_id)s"),
+                     {'network_id': network_id,
+                      'vlan_id': vlan_id,
+                      'tenant_id': tenant_id})
 
+    @instrumentation.hook
+    @_per_process
     def delete_network_postcommit(self, mech_context):
         """Delete network which remove segment from the switch."""
 
         LOG.debug("delete_network_postcommit: called")
+        started = time.time()
         network = mech_context.current
         network_id = network['id']
         vlan_id = network['provider:segmentation_id']
         tenant_id = network['tenant_id']
 
-        for switch_ip in self._switch:
-            try:
-                system = self.client[switch_ip].system.list()
-                system[0].remove_segment(vlan_id)
-            except seamicro_client_exception.ClientException as ex:
-                LOG.exception(_LE("SeaMicr driver: failed to delete network"
-                                  " with the following error: %(error)s"),
-                              {'error': ex.message})
-                raise Exception(
-                    _("Seamicro switch exception, delete_network_postcommit"
-                      " failed"))
-
-            LOG.info(_LI("delete network (postcommit): %(network_id)s"
-                         " with vlan = %(vlan_id)s"
-                         " for tenant %(tenant_id)s on switch %(switch_ip)s"),
-                     {'network_id': network_id,
-                      'vlan_id': vlan_id,
-                      'tenant_id': tenant_id,
-                      'switch_ip': switch_ip})
+        switch_ips = None
+        if self._lazy_segments:
+            # segments go away with the last port of the network on each
+            # chassis, but a network created before lazy_segments was set
+            # has one on every chassis
+            switch_ips = [switch_ip for switch_ip in sorted(self._switch)
+                          if self._may_have_segment(switch_ip, vlan_id)]
+
+        failed = False
+        for switch_ip, ex in self._call_all_chassis('remove_segment',
+                                                    vlan_id,
+                                                    switch_ips=switch_ips):
+            if ex is not None:
+                LOG.error(_LE("SeaMicr driver: failed to delete network"
+                              " on switch %(switch_ip)s"
+                              " with the following error: %(error)s"),
+                          {'switch_ip': switch_ip, 'error': ex.message})
+                self._done('deleted', 'networks', switch_ip, started,
+                           failed=True)
+                failed = True
+                continue
+
+            self._done('deleted', 'networks', switch_ip, started,
+                       msg=_LI("delete network (postcommit): %(network_id)s"
+                               " with vlan = %(vlan_id)s"
+                               " for tenant %(tenant_id)s"
+                               " on switch %(switch_ip)s"),
+                       params={'network_id': network_id,
+                               'vlan_id': vlan_id,
+                               'tenant_id': tenant_id,
+                               'switch_ip': switch_ip})
+
+        if failed:
+            raise Exception(
+                _("Seamicro switch exception, delete_network_postcommit"
+                  " failed"))
 
+    @instrumentation.hook
     def update_network_precommit(self, mech_context):
         """Noop now, it is left here for future."""
         pass
 
+    @instrumentation.hook
     def update_network_postcommit(self, mech_context):
         """Noop now, it is left here for future."""
         pass
 
+    @instrumentation.hook
+    @_per_process
     def create_port_precommit(self, mech_context):
         """Create logical port on the chassis (db update)."""
 
@@ -241,74 +605,79 @@ class SeaMicroDriver(object):
                 network_id)
 
         vlan_id = network['vlan']
+        switch_ip, server_id, nics = _get_switch_info(
+            self._hosts, mech_context._binding.host, self._inventory,
+            self._discovery, port.get('mac_address'))
 
         try:
             seamicro_db.create_port(context, port_id, network_id,
-                                    vlan_id, tenant_id)
+                                    vlan_id, tenant_id, switch_ip=switch_ip,
+                                    server_id=server_id, nics=nics)
         except Exception:
             LOG.exception(_LE("SeaMicro Mechanism: failed to create port"
                               " in db"))
             raise Exception(
                 _("SeaMicro Mechanism: create_port_precommit failed"))
 
+    @instrumentation.hook
+    @_per_process
     def create_port_postcommit(self, mech_context):
         """Set all Nics of Server and Interface as Tagged-vlan."""
 
         LOG.debug("create_port_postcommit: called")
+        started = time.time()
         port = mech_context.current
         port_id = port['id']
         network_id = port['network_id']
         tenant_id = port['tenant_id']
         host_id = mech_context._binding.host
         context = mech_context._plugin_context
-        try:
-            network = seamicro_db.get_network(context, network_id)
-        except Exception:
-            LOG.exception(
-                _LE("SeaMicro Mechanism: failed to get network %s from db"),
-                network_id)
-            raise Exception(
-                _("SeaMicro Mechanism: failed to get network %s from db"),
-                network_id)
-
-        vlan_id = network['vlan']
-        switch_ip, server_id, nics = _get_switch_info(self._switch, host_id)
+        switch_ip, server_id, nics, vlan_id = self._get_port_placement(
+            context, port_id, network_id, host_id, port.get('mac_address'))
         if switch_ip is not None and server_id is not None and nics is not None:
             try:
-                interfaces = self.client[switch_ip].interfaces.list()
-                for interface in interfaces:
-                    interface.add_tagged_vlan(vlan_id)
-
-                server = self.client[switch_ip].servers.get(server_id)
-                if nics:
-                    server.set_tagged_vlan(vlan_id, nics=nics)
-                else:
-                    server.set_tagged_vlan(vlan_id)
-            except seamicro_client_exception.ClientException as ex:
+                self._dispatcher.run(
+                    dispatcher.port_keys(switch_ip, server_id, vlan_id),
+                    self._tag_port, context, switch_ip, server_id, nics,
+                    vlan_id)
+            except (seamicro_client_exception.ClientException,
+                    chassis.ChassisNotReady, db_exc.DBError) as ex:
                 LOG.exception(
                     _LE("SeaMicro driver: failed to create port"
                         " with the following error: %(error)s"),
                     {'error': ex.message})
+                self._done('created', 'ports', switch_ip, started,
+                           failed=True)
                 seamicro_db.delete_port(context, port_id)
                 raise Exception(
                     _("SeaMicro Mechanism: create_port_postcommit failed"))
 
-            LOG.info(
-                _LI("created port (postcommit): port_id=%(port_id)s"
-                    " network_id=%(network_id)s tenant_id=%(tenant_id)s"
-                    " switch_ip=%(switch_ip)s server_id=%(server_id)s"),
-                {'port_id': port_id,
-                 'network_id': network_id, 'tenant_id': tenant_id,
-                 'switch_ip': switch_ip, 'server_id': server_id})
-
+            self._done(
+                'created', 'ports', switch_ip, started,
+                msg=_LI("created port (postcommit): port_id=%(port_id)s"
+                        " network_id=%(network_id)s tenant_id=%(tenant_id)s"
+                        " switch_ip=%(switch_ip)s server_id=%(server_id)s"),
+                params={'port_id': port_id,
+                        'network_id': network_id, 'tenant_id': tenant_id,
+                        'switch_ip': switch_ip, 'server_id': server_id})
+
+    @instrumentation.hook
+    @_per_process
     def delete_port_precommit(self, mech_context):
-        """Delete logical port on the switch (db update)."""
+        """Delete logical port on the switch (db update).
+
+        Where the port is bound is read from the row first, and kept on
+        mech_context for delete_port_postcommit.
+        """
 
         LOG.debug("delete_port_precommit: called")
         port = mech_context.current
         port_id = port['id']
-
+        host_id = mech_context._binding.host
         context = mech_context._plugin_context
+        mech_context._seamicro_placement = self._get_port_placement(
+            context, port_id, port['network_id'], host_id,
+            port.get('mac_address'))
 
         try:
             seamicro_db.delete_port(context, port_id)
@@ -318,85 +687,86 @@ class SeaMicroDriver(object):
             raise Exception(
                 _("SeaMicro Mechanism: delete_port_precommit failed"))
 
+    @instrumentation.hook
+    @_per_process
     def delete_port_postcommit(self, mech_context):
         """UnSet Tagged-vlan of all Nics of Server and Interface."""
 
         LOG.debug("delete_port_postcommit: called")
+        started = time.time()
         port = mech_context.current
         port_id = port['id']
         network_id = port['network_id']
         tenant_id = port['tenant_id']
-        host_id = mech_context._binding.host
         context = mech_context._plugin_context
-
-        try:
-            network = seamicro_db.get_network(context, network_id)
-        except Exception:
-            LOG.exception(
-                _LE("SeaMicro Mechanism: failed to get network %s from db"),
-                network_id)
-            raise Exception(
-                _("SeaMicro Mechanism: failed to get network %s from db"),
-                network_id)
-
-        vlan_id = network['vlan']
-
-        switch_ip, server_id, nics = _get_switch_info(self._switch, host_id)
+        placement = getattr(mech_context, '_seamicro_placement', None)
+        if placement is None:
+            placement = self._get_port_placement(
+                context, port_id, network_id, mech_context._binding.host,
+                port.get('mac_address'))
+        switch_ip, server_id, nics, vlan_id = placement
         if switch_ip is not None and server_id is not None and nics is not None:
             try:
-                interfaces = self.client[switch_ip].interfaces.list()
-                for interface in interfaces:
-                    interface.remove_tagged_vlan(vlan_id)
-
-                server = self.client[switch_ip].servers.get(server_id)
-                if nics:
-                    server.unset_tagged_vlan(vlan_id, nics=nics)
-                else:
-                    server.unset_tagged_vlan(vlan_id)
-            except seamicro_client_exception.ClientException as ex:
+                self._dispatcher.run(
+                    dispatcher.port_keys(switch_ip, server_id, vlan_id),
+                    self._untag_port, context, switch_ip, server_id, nics,
+                    vlan_id)
+            except (seamicro_client_exception.ClientException,
+                    chassis.ChassisNotReady) as ex:
                 LOG.exception(
                     _LE("SeaMicro driver: failed to delete port"
                         " with the following error: %(error)s"),
                     {'error': ex.message})
+                self._done('deleted', 'ports', switch_ip, started,
+                           failed=True)
                 raise Exception(
                     _("SeaMicro Mechanism: delete_port_postcommit failed"))
 
-            LOG.info(
-                _LI("delete port (postcommit): port_id=%(port_id)s"
-                    " network_id=%(network_id)s tenant_id=%(tenant_id)s"
-                    " switch_ip=%(switch_ip)s server_id=%(server_id)s"),
-                {'port_id': port_id,
-                 'network_id': network_id, 'tenant_id': tenant_id,
-                 'switch_ip': switch_ip, 'server_id': server_id})
+            self._done(
+                'deleted', 'ports', switch_ip, started,
+                msg=_LI("delete port (postcommit): port_id=%(port_id)s"
+                        " network_id=%(network_id)s tenant_id=%(tenant_id)s"
+                        " switch_ip=%(switch_ip)s server_id=%(server_id)s"),
+                params={'port_id': port_id,
+                        'network_id': network_id, 'tenant_id': tenant_id,
+                        'switch_ip': switch_ip, 'server_id': server_id})
 
+    @instrumentation.hook
     def update_port_precommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("update_port_precommit(self: called")
 
+    @instrumentation.hook
     def update_port_postcommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("update_port_postcommit: called")
 
+    @instrumentation.hook
     def create_subnet_precommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("create_subnetwork_precommit: called")
 
+    @instrumentation.hook
     def create_subnet_postcommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("create_subnetwork_postcommit: called")
 
+    @instrumentation.hook
     def delete_subnet_precommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("delete_subnetwork_precommit: called")
 
+    @instrumentation.hook
     def delete_subnet_postcommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("delete_subnetwork_postcommit: called")
 
+    @instrumentation.hook
     def update_subnet_precommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("update_subnet_precommit(self: called")
 
+    @instrumentation.hook
     def update_subnet_postcommit(self, mech_context):
         """Noop now, it is left here for future."""
         LOG.debug("update_subnet_postcommit: called")
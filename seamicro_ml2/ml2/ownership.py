@@ -0,0 +1,132 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Lease based ownership of the chassis by neutron-server processes."""
+
+import datetime
+import hashlib
+import os
+import socket
+
+from neutron import context as neutron_context
+from neutron.i18n import _LE, _LI
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+from oslo_utils import timeutils
+
+from seamicro_ml2.db import models as seamicro_db
+
+LOG = log.getLogger(__name__)
+
+
+def preferred_owner(switch_ip, owners):
+    """Pick the owner of a chassis among owners by rendezvous hashing."""
+    def weight(owner):
+        key = '%s/%s' % (switch_ip, owner)
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+    return max(owners, key=weight)
+
+
+class ChassisOwnership(object):
+
+    """Share the chassis out between the neutron-server processes.
+
+    Every process heartbeats every duration / 3 seconds. It then renews
+    its liveness and the leases of the chassis it owns, both valid for
+    duration seconds. Each chassis goes to one of the live processes,
+    picked by rendezvous hashing so that a process joining or leaving
+    only moves its share of the chassis. A process releases the chassis
+    that belong to another live process, and takes over the lease of a
+    chassis whose owner has not renewed it for a whole duration.
+
+    All processes must be configured with the same chassis.
+    """
+
+    def __init__(self, switch_ips, duration=30, owner=None):
+        self._switch_ips = sorted(switch_ips)
+        self._duration = datetime.timedelta(seconds=duration)
+        self._owner = owner
+        self._owned = set()
+        self._pid = None
+        self._valid_until = None
+        self._loop = None
+
+    @property
+    def owner(self):
+        # API workers are forked after the driver is loaded, each of them
+        # is an owner of its own
+        return self._owner or '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def start(self):
+        if self._loop is None:
+            interval = max(self._duration.seconds / 3.0, 1)
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.heartbeat)
+            self._loop.start(interval)
+
+    def owns(self, switch_ip):
+        """Whether this process holds the lease of switch_ip."""
+        return switch_ip in self.owned()
+
+    def owned(self):
+        """Return the chassis this process holds the lease of."""
+        if (self._pid != os.getpid() or self._valid_until is None or
+                timeutils.utcnow() >= self._valid_until):
+            return set()
+        return set(self._owned)
+
+    def heartbeat(self):
+        context = neutron_context.get_admin_context()
+        try:
+            self._heartbeat(context)
+        except Exception:
+            LOG.exception(_LE("SeaMicro driver: failed to renew the chassis "
+                              "leases"))
+
+    def _heartbeat(self, context):
+        owner = self.owner
+        now = timeutils.utcnow()
+        expires_at = now + self._duration
+        seamicro_db.renew_owner(context, owner, expires_at)
+        seamicro_db.delete_owners(context, now - 10 * self._duration)
+        owners = seamicro_db.get_live_owners(context, now) | set([owner])
+        leases = dict((lease.switch_ip, lease) for lease in
+                      seamicro_db.get_chassis_leases(context))
+
+        owned = set()
+        for switch_ip in self._switch_ips:
+            lease = leases.get(switch_ip)
+            held = (lease is not None and lease.owner == owner and
+                    lease.expires_at > now)
+            preferred = preferred_owner(switch_ip, owners) == owner
+            if held and not preferred:
+                seamicro_db.release_chassis_lease(context, switch_ip, owner,
+                                                  now)
+                continue
+            # the preferred owner takes a chassis as soon as its lease
+            # expires, any other owner once it has been expired a while
+            free_before = now if preferred else now - self._duration
+            if (held or lease is None or lease.expires_at <= free_before):
+                if seamicro_db.take_chassis_lease(context, switch_ip, owner,
+                                                  expires_at, free_before):
+                    owned.add(switch_ip)
+
+        previous = self.owned()
+        self._pid = os.getpid()
+        self._owned = owned
+        self._valid_until = expires_at
+        if owned != previous:
+            LOG.info(_LI("SeaMicro driver: %(owner)s now owns chassis "
+                         "%(owned)s"),
+                     {'owner': owner, 'owned': sorted(owned)})
@@ -0,0 +1,247 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Incremental garbage collection of vlans left over on the chassis."""
+
+import bisect
+import time
+
+from neutron import context as neutron_context
+from neutron.i18n import _LE, _LI, _LW
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+
+from seamicro_ml2.common import ratelimit
+from seamicro_ml2.common import vlans
+from seamicro_ml2.db import models as seamicro_db
+
+LOG = log.getLogger(__name__)
+
+CURSOR = 'vlan_gc'
+
+SEGMENTS = 'segments'
+INTERFACES = 'interfaces'
+SERVERS = 'servers'
+PHASES = (SEGMENTS, INTERFACES, SERVERS)
+
+
+def parse_vlan_ranges(ranges):
+    """Parse ['100:199', '300'] into [(100, 199), (300, 300)]."""
+    parsed = []
+    for item in ranges:
+        bounds = item.strip().split(':')
+        if len(bounds) > 2:
+            raise ValueError(_("Invalid vlan range: %s") % item)
+        parsed.append((int(bounds[0]), int(bounds[-1])))
+    return parsed
+
+
+class VlanGarbageCollector(object):
+
+    """Remove the vlans the SeaMicro db does not know of from the chassis.
+
+    Each run handles one slice of one chassis, either its segments, its
+    interfaces or the next batch_size of its servers, so the load it adds
+    to a chassis stays flat. Where the walk of each chassis stands is kept
+    in the db, and the next owner of the chassis goes on from there. Only
+    the chassis for which owns returns True are walked, all by default.
+
+    Only vlans within vlan_ranges are ever removed, and a vlan still used
+    by a port is never removed from interfaces or servers. The chassis is
+    read before the db, so that a vlan added in between is seen in use,
+    and a vlan is only removed once an earlier run found it orphaned too,
+    at least grace_period seconds before. The vlans of the chassis read
+    or changed by this process at most max_age seconds ago are taken from
+    the chassis state instead of being read again.
+    """
+
+    def __init__(self, clients, servers, vlan_ranges, batch_size=16,
+                 lazy_segments=False, owns=None, grace_period=60,
+                 max_age=0):
+        self._clients = clients
+        self._servers = servers
+        self._managed = vlans.VlanBitmap.from_ranges(vlan_ranges)
+        self._batch_size = batch_size
+        self._lazy_segments = lazy_segments
+        self._owns = owns
+        self._grace_period = grace_period
+        self._max_age = max_age
+        # (switch_ip, phase) -> {orphan: time it was first found}
+        self._suspects = {}
+        self._switch_ip = None
+        self._loop = None
+        self.removed = 0
+
+    def start(self, interval):
+        if self._loop is None:
+            self._loop = loopingcall.FixedIntervalLoopingCall(self.run_once)
+            self._loop.start(interval, initial_delay=interval)
+
+    def run_once(self):
+        context = neutron_context.get_admin_context()
+        try:
+            with ratelimit.priority(ratelimit.BACKGROUND):
+                self._run(context)
+        except Exception:
+            LOG.exception(_LE("SeaMicro driver: vlan garbage collection "
+                              "failed"))
+
+    def _next_chassis(self, switch_ips):
+        index = bisect.bisect_right(switch_ips, self._switch_ip or '')
+        self._switch_ip = switch_ips[index % len(switch_ips)]
+
+    def _run(self, context):
+        switch_ips = sorted(switch_ip for switch_ip in self._clients
+                            if self._owns is None or self._owns(switch_ip))
+        if not switch_ips:
+            return
+        if self._switch_ip not in switch_ips:
+            self._next_chassis(switch_ips)
+        switch_ip = self._switch_ip
+        if not self._clients.is_ready(switch_ip):
+            # skip the chassis until the next round
+            self._next_chassis(switch_ips)
+            return
+
+        phase, position = PHASES[0], None
+        cursor = seamicro_db.get_cursor(context, CURSOR, switch_ip)
+        if cursor and cursor.phase in PHASES:
+            phase, position = cursor.phase, cursor.position
+
+        collect = getattr(self, '_collect_' + phase)
+        position = collect(context, self._clients[switch_ip], switch_ip,
+                           position)
+        if position is None:
+            if phase != PHASES[-1]:
+                phase = PHASES[PHASES.index(phase) + 1]
+            else:
+                phase = PHASES[0]
+                self._next_chassis(switch_ips)
+        seamicro_db.set_cursor(context, CURSOR, switch_ip, phase, position)
+
+    def _remove(self, switch_ip, what, calls):
+        removed = 0
+        for call in calls:
+            try:
+                call.wait()
+                removed += 1
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to remove orphaned "
+                                "vlan from %(what)s on switch "
+                                "%(switch_ip)s: %(error)s"),
+                            {'what': what, 'switch_ip': switch_ip,
+                             'error': ex})
+        if removed:
+            self.removed += removed
+            LOG.info(_LI("SeaMicro driver: removed %(count)d orphaned vlans "
+                         "from %(what)s on switch %(switch_ip)s"),
+                     {'count': removed, 'what': what,
+                      'switch_ip': switch_ip})
+
+    def _confirm(self, switch_ip, phase, orphans, seen=None):
+        """Return the orphans an earlier run found grace_period ago.
+
+        The other orphans are kept for the next runs, and the suspects
+        found orphaned no more are forgotten.
+
+        :param seen: tells which suspects this run has looked at, all of
+                     the phase by default.
+        """
+        now = time.time()
+        previous = self._suspects.get((switch_ip, phase), {})
+        suspects = {}
+        if seen is not None:
+            suspects.update((orphan, found) for orphan, found in
+                            previous.items() if not seen(orphan))
+        confirmed = []
+        for orphan in orphans:
+            found = suspects[orphan] = previous.get(orphan, now)
+            if orphan in previous and now - found >= self._grace_period:
+                confirmed.append(orphan)
+        self._suspects[(switch_ip, phase)] = suspects
+        return sorted(confirmed)
+
+    def _collect_segments(self, context, client, switch_ip, position):
+        segments = client.get_segments(self._max_age).wait()
+        if self._lazy_segments:
+            wanted = seamicro_db.get_chassis_vlans(context, switch_ip)
+        else:
+            wanted = seamicro_db.get_network_vlans(context)
+        orphans = self._confirm(switch_ip, SEGMENTS,
+                                (segments & self._managed) - wanted)
+        if position:
+            orphans = [vlan for vlan in orphans if vlan > int(position)]
+        batch = orphans[:self._batch_size]
+        self._remove(switch_ip, SEGMENTS,
+                     [client.remove_segment(vlan) for vlan in batch])
+        if len(batch) < len(orphans):
+            return str(batch[-1])
+
+    def _collect_interfaces(self, context, client, switch_ip, position):
+        interfaces = client.get_interface_vlans(self._max_age).wait()
+        wanted = (seamicro_db.get_chassis_vlans(context, switch_ip) |
+                  seamicro_db.get_port_vlans(context))
+        orphans = self._confirm(
+            switch_ip, INTERFACES,
+            [(vlan, interface_id) for interface_id, tagged in
+             interfaces.items() for vlan in (tagged & self._managed) - wanted])
+        if position:
+            vlan, interface_id = position.split(' ', 1)
+            orphans = [orphan for orphan in orphans
+                       if orphan > (int(vlan), interface_id)]
+        batch = orphans[:self._batch_size]
+        self._remove(switch_ip, INTERFACES,
+                     [client.untag_interface(interface_id, vlan)
+                      for vlan, interface_id in batch])
+        if len(batch) < len(orphans):
+            return '%d %s' % batch[-1]
+
+    def _collect_servers(self, context, client, switch_ip, position):
+        servers = sorted(self._servers(switch_ip))
+        start = bisect.bisect_right(servers, position) if position else 0
+        batch = servers[start:start + self._batch_size]
+
+        reads = [(server_id,
+                  client.get_server_vlans(server_id, self._max_age))
+                 for server_id in batch]
+        read = {}
+        for server_id, future in reads:
+            try:
+                read[server_id] = future.wait()
+            except Exception as ex:
+                LOG.warning(_LW("SeaMicro driver: failed to get the vlans of "
+                                "server %(server_id)s on switch "
+                                "%(switch_ip)s: %(error)s"),
+                            {'server_id': server_id, 'switch_ip': switch_ip,
+                             'error': ex})
+
+        port_vlans = seamicro_db.get_port_vlans(context)
+        wanted = seamicro_db.get_server_vlan_bitmaps(context, switch_ip)
+        none = vlans.VlanBitmap()
+        orphans = []
+        for server_id, nics in read.items():
+            all_nics = wanted.get((server_id, ''), none) | port_vlans
+            for nic, tagged in nics.items():
+                orphans.extend(
+                    (server_id, nic, vlan) for vlan in
+                    (tagged & self._managed) - all_nics -
+                    wanted.get((server_id, nic), none))
+        orphans = self._confirm(switch_ip, SERVERS, orphans,
+                                seen=lambda orphan: orphan[0] in read)
+        self._remove(switch_ip, SERVERS,
+                     [client.untag_server(server_id, vlan, [nic])
+                      for server_id, nic, vlan in orphans])
+        if start + len(batch) < len(servers):
+            return batch[-1]
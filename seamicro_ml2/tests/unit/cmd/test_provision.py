@@ -0,0 +1,118 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import mock
+
+from neutron import context
+from neutron.tests.unit import testlib_api
+from seamicro_ml2.cmd import provision
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.db import models as seamicro_db
+
+MANIFEST = {
+    'networks': [{'id': 'net%d' % vlan, 'vlan': vlan, 'tenant_id': 't'}
+                 for vlan in (100, 101, 102)],
+    'ports': [{'id': 'port1', 'network_id': 'net100', 'host': 'compute1'},
+              {'id': 'port2', 'network_id': 'net101', 'host': 'compute1'},
+              {'id': 'port3', 'network_id': 'net101', 'switch_ip': '1.1.1.1',
+               'server_id': '1/2', 'nics': ['0']},
+              {'id': 'port4', 'network_id': 'net102', 'host': 'unknown'}],
+}
+
+
+class SeaMicroProvisionTest(testlib_api.SqlTestCase):
+
+    """Unit tests for the bulk provisioning command."""
+
+    def setUp(self):
+        super(SeaMicroProvisionTest, self).setUp()
+        self.ctx = context.get_admin_context()
+        self.chassis = mock.Mock()
+        self.system = mock.Mock(segments='100')
+        self.chassis.system.list.return_value = [self.system]
+        self.uplink = mock.Mock(id='5/0', taggedVlans='')
+        self.chassis.interfaces.list.return_value = [self.uplink]
+        self.servers = {'1/1': mock.Mock(nic={0: {'taggedVlan': '100'}}),
+                        '1/2': mock.Mock(nic={0: {}, 1: {}})}
+        self.chassis.servers.get.side_effect = self.servers.get
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'progress')
+
+    def _provisioner(self, manifest=MANIFEST):
+        clients = {'1.1.1.1': seamicro_client.GreenSeaMicroClient(
+            self.chassis)}
+
+        def locate(host):
+            if host == 'compute1':
+                return ('1.1.1.1', '1/1', [])
+            return (None, None, None)
+        return provision.Provisioner(self.ctx, clients, locate,
+                                     batch_size=2,
+                                     progress=provision.Progress(
+                                         self.path,
+                                         provision.manifest_key(manifest)))
+
+    def test_provision(self):
+        """Tests that the rows are written and only missing vlans pushed."""
+        summary = self._provisioner().run(MANIFEST)
+
+        self.assertEqual((3, 4, 1), (summary.networks, summary.ports,
+                                     summary.ports_unplaced))
+        self.assertEqual('1.1.1.1', seamicro_db.get_port(
+            self.ctx, 'port3').switch_ip)
+        self.assertEqual('100-101', str(seamicro_db.get_chassis_vlans(
+            self.ctx, '1.1.1.1')))
+        self.assertEqual([mock.call(101), mock.call(102)],
+                         sorted(self.system.add_segment.call_args_list))
+        self.assertEqual([mock.call(100), mock.call(101)],
+                         sorted(self.uplink.add_tagged_vlan.call_args_list))
+        self.servers['1/1'].set_tagged_vlan.assert_called_once_with(101)
+        self.servers['1/2'].set_tagged_vlan.assert_called_once_with(
+            101, nics=['0'])
+        self.assertEqual([], summary.failures)
+        self.assertEqual(1, summary.chassis_done)
+
+    def test_resume(self):
+        """Tests that a second run skips what the first one did."""
+        self.servers['1/2'].set_tagged_vlan.side_effect = ValueError()
+        summary = self._provisioner().run(MANIFEST)
+        self.assertEqual(1, len(summary.failures))
+        self.assertEqual(0, summary.chassis_done)
+
+        self.servers['1/2'].set_tagged_vlan.side_effect = None
+        summary = self._provisioner().run(MANIFEST)
+        self.assertEqual((0, 3, 0, 4), (summary.networks,
+                                        summary.networks_skipped,
+                                        summary.ports, summary.ports_skipped))
+        self.assertEqual(1, summary.chassis_done)
+
+        summary = self._provisioner().run(MANIFEST)
+        self.assertEqual(1, summary.chassis_skipped)
+        self.assertIn('1 already done', summary.report())
+
+    def test_changed_manifest(self):
+        """Tests that ports added to the manifest are pushed."""
+        self._provisioner().run(MANIFEST)
+        manifest = dict(MANIFEST, ports=MANIFEST['ports'] + [
+            {'id': 'port5', 'network_id': 'net102', 'switch_ip': '1.1.1.1',
+             'server_id': '1/2', 'nics': ['1']}])
+        summary = self._provisioner(manifest).run(manifest)
+        self.assertEqual((0, 1), (summary.chassis_skipped,
+                                  summary.chassis_done))
+        self.servers['1/2'].set_tagged_vlan.assert_called_with(
+            102, nics=['1'])
@@ -0,0 +1,92 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import mock
+
+from neutron.tests import base
+from seamicro_ml2.cmd import replay
+from seamicro_ml2.common import capture
+
+
+class SeaMicroCaptureTest(base.BaseTestCase):
+
+    """Unit tests for the capture and replay of chassis requests."""
+
+    def setUp(self):
+        super(SeaMicroCaptureTest, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'capture')
+        self.chassis = mock.Mock()
+        self.server = mock.Mock(id='1/1')
+        self.chassis.servers.get.return_value = self.server
+
+    def test_capture(self):
+        """Tests that requests are captured with their outcome."""
+        capture_file = capture.CaptureFile(self.path)
+        client = capture.CapturingClient(self.chassis, capture_file,
+                                         '1.1.1.1')
+        server = client.servers.get('1/1')
+        server.set_tagged_vlan(100, nics=['0'])
+        self.server.unset_tagged_vlan.side_effect = ValueError()
+        self.assertRaises(ValueError, server.unset_tagged_vlan, 100)
+        capture_file.close()
+
+        records = capture.read_capture([self.path])
+        self.assertEqual(['servers.get', 'servers.set_tagged_vlan',
+                          'servers.unset_tagged_vlan'],
+                         [record['m'] for record in records])
+        self.assertEqual({'c': '1.1.1.1', 'o': '1/1', 'a': [100],
+                          'k': {'nics': ['0']}, 'e': None},
+                         dict((key, records[1][key])
+                              for key in ('c', 'o', 'a', 'k', 'e')))
+        self.assertEqual('ValueError', records[2]['e'])
+
+    def test_rotation(self):
+        """Tests that a full capture file is rotated."""
+        capture_file = capture.CaptureFile(self.path, max_bytes=200,
+                                           backup_count=2)
+        for i in range(20):
+            capture_file.write({'t': i, 'm': 'servers.get', 'l': 0.0})
+        capture_file.close()
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        records = capture.read_capture(
+            [self.path, self.path + '.1', self.path + '.2'])
+        self.assertEqual(sorted(record['t'] for record in records),
+                         [record['t'] for record in records])
+        self.assertEqual(19, records[-1]['t'])
+
+    def test_replay(self):
+        """Tests replaying a capture, directly and through the client."""
+        records = [{'t': 1000 + i * 0.1, 'c': '1.1.1.1',
+                    'm': 'servers.set_tagged_vlan', 'l': 0.5,
+                    'e': 'ClientException' if i == 0 else None}
+                   for i in range(10)]
+        stats = replay.replay(records, speed=100, target='fake')
+        self.assertEqual((10, 1), (stats['total']['count'],
+                                   stats['total']['errors']))
+        self.assertAlmostEqual(0.5, stats['total']['p50'], delta=0.3)
+
+        self.config(chassis_max_requests=1, chassis_min_requests=1,
+                    group='ml2_mech_seamicro')
+        limited = replay.replay(records, speed=100, target='driver')
+        # one request at a time queues up behind the others
+        self.assertGreater(limited['total']['max'], 2)
+        self.assertIn('servers.set_tagged_vlan',
+                      replay.report(limited, replay.captured_stats(records),
+                                    'captured'))
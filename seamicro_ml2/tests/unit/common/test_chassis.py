@@ -0,0 +1,68 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+
+from neutron.tests import base
+from seamicro_ml2.common import chassis
+
+
+class SeaMicroChassisClientsTest(base.BaseTestCase):
+
+    """Unit tests for the background chassis bootstrap."""
+
+    def test_clients_built_concurrently(self):
+        """Tests that a slow chassis does not delay the others."""
+        def build(switch_ip):
+            if switch_ip == 'slow':
+                eventlet.sleep(0.2)
+            return 'client-%s' % switch_ip
+
+        clients = chassis.ChassisClients(['fast', 'slow'], build)
+        clients.start()
+        self.assertEqual('client-fast', clients.wait('fast', timeout=0.1))
+        self.assertFalse(clients.is_ready('slow'))
+        self.assertEqual('client-slow', clients['slow'])
+        self.assertEqual({'fast': chassis.READY, 'slow': chassis.READY},
+                         clients.status())
+        self.assertIsNotNone(clients.startup_time)
+
+    def test_not_ready_timeout(self):
+        """Tests that waiting for a chassis that is down times out."""
+        def build(switch_ip):
+            raise Exception('unreachable')
+
+        clients = chassis.ChassisClients(['down'], build, ready_timeout=0.05,
+                                         retry_interval=10)
+        clients.start()
+        self.assertRaises(chassis.ChassisNotReady, clients.__getitem__,
+                          'down')
+        self.assertEqual(chassis.FAILED, clients.status()['down'])
+
+    def test_retry_until_ready(self):
+        """Tests that a failed chassis is retried in the background."""
+        attempts = []
+
+        def build(switch_ip):
+            attempts.append(switch_ip)
+            if len(attempts) < 3:
+                raise Exception('unreachable')
+            return 'client'
+
+        clients = chassis.ChassisClients(['1.1.1.1'], build,
+                                         retry_interval=0.01)
+        clients.start()
+        self.assertEqual('client', clients.wait('1.1.1.1', timeout=1))
+        self.assertEqual(3, len(attempts))
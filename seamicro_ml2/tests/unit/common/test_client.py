@@ -0,0 +1,170 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import eventlet
+import mock
+
+from neutron.tests import base
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import vlans
+
+
+class SeaMicroGreenClientTest(base.BaseTestCase):
+
+    """Unit tests for the non-blocking SeaMicro client."""
+
+    def setUp(self):
+        super(SeaMicroGreenClientTest, self).setUp()
+        self.client = mock.Mock()
+        self.system = mock.Mock()
+        self.client.system.list.return_value = [self.system]
+        self.interfaces = [mock.Mock(), mock.Mock()]
+        self.client.interfaces.list.return_value = self.interfaces
+        self.server = mock.Mock()
+        self.client.servers.get.return_value = self.server
+        self.green = seamicro_client.GreenSeaMicroClient(self.client)
+
+    def test_segments(self):
+        """Tests adding and removing a segment."""
+        self.green.add_segment('100').wait()
+        self.system.add_segment.assert_called_once_with('100')
+        self.green.remove_segment('100').wait()
+        self.system.remove_segment.assert_called_once_with('100')
+
+    def test_tag_interfaces(self):
+        """Tests that every interface gets the tagged vlan."""
+        self.green.tag_interfaces('100').wait()
+        for interface in self.interfaces:
+            interface.add_tagged_vlan.assert_called_once_with('100')
+        self.green.untag_interfaces('100').wait()
+        for interface in self.interfaces:
+            interface.remove_tagged_vlan.assert_called_once_with('100')
+
+    def test_tag_uplinks(self):
+        """Tests that only the uplinks get the vlan, looked up once."""
+        interfaces = [mock.Mock(id=interface_id, taggedVlans='100')
+                      for interface_id in ('0/0', '5/0', '5/1', '6/2')]
+        self.client.interfaces.list.return_value = interfaces
+        green = seamicro_client.GreenSeaMicroClient(
+            self.client, uplinks=seamicro_client.parse_uplinks('0/0, 5/*'))
+        self.assertEqual(interfaces[:3], green.resolve_uplinks())
+        green.tag_interfaces('100').wait()
+        green.untag_interfaces('100').wait()
+        green.untag_interface('5/1', '200').wait()
+        for interface in interfaces[:3]:
+            interface.add_tagged_vlan.assert_called_once_with('100')
+        interfaces[2].remove_tagged_vlan.assert_called_with('200')
+        self.assertFalse(interfaces[3].add_tagged_vlan.called)
+        self.assertEqual(1, self.client.interfaces.list.call_count)
+        self.assertFalse(self.client.interfaces.get.called)
+        self.assertEqual(['0/0', '5/0', '5/1'],
+                         sorted(green.get_interface_vlans().wait()))
+        self.assertIsNone(seamicro_client.parse_uplinks(' , '))
+
+    def test_tag_server(self):
+        """Tests tagging the given nics or all nics of a server."""
+        self.green.tag_server('1/1', '100', ['0']).wait()
+        self.client.servers.get.assert_called_with('1/1')
+        self.server.set_tagged_vlan.assert_called_once_with('100',
+                                                            nics=['0'])
+        self.green.untag_server('1/1', '100').wait()
+        self.server.unset_tagged_vlan.assert_called_once_with('100')
+
+    def test_server_cache(self):
+        """Tests that server handles are reused until stale or failing."""
+        green = seamicro_client.GreenSeaMicroClient(self.client,
+                                                    server_ttl=60)
+        self.assertEqual(2, green.warm_servers(['1/1', '1/2']))
+        green.tag_server('1/1', '100').wait()
+        green.tag_server('1/1', '200').wait()
+        self.assertEqual(2, self.client.servers.get.call_count)
+
+        self.server.set_tagged_vlan.side_effect = ValueError()
+        self.assertRaises(ValueError, green.tag_server('1/1', '300').wait)
+        self.server.set_tagged_vlan.side_effect = None
+        green.tag_server('1/1', '300').wait()
+        self.assertEqual(3, self.client.servers.get.call_count)
+
+        with mock.patch('time.time', return_value=time.time() + 61):
+            green.get_server('1/2').wait()
+        self.assertEqual(4, self.client.servers.get.call_count)
+        self.assertEqual(0, self.green.warm_servers(['1/1']))
+
+    def test_error_raised_on_wait(self):
+        """Tests that a failing request raises when waited for."""
+        self.interfaces[0].add_tagged_vlan.side_effect = ValueError()
+        future = self.green.tag_interfaces('100')
+        self.assertRaises(ValueError, future.wait)
+        self.interfaces[1].add_tagged_vlan.assert_called_once_with('100')
+
+    def test_max_requests(self):
+        """Tests that requests beyond max_requests wait for a slot."""
+        green = seamicro_client.GreenSeaMicroClient(self.client,
+                                                    max_requests=2)
+        running = []
+        peak = []
+
+        def request():
+            running.append(1)
+            peak.append(len(running))
+            eventlet.sleep(0.01)
+            running.pop()
+
+        seamicro_client.wait_all([green.spawn(request) for i in range(6)])
+        self.assertEqual(2, max(peak))
+
+    def test_parse_vlans(self):
+        """Tests parsing the vlans reported by a chassis."""
+        self.assertEqual([], list(seamicro_client.parse_vlans(None)))
+        self.assertEqual([100], list(seamicro_client.parse_vlans(100)))
+        self.assertEqual([100, 200],
+                         list(seamicro_client.parse_vlans(['100', 200])))
+        self.assertEqual([1, 5, 6, 7],
+                         list(seamicro_client.parse_vlans('1,5-7')))
+
+    def test_get_server_vlans(self):
+        """Tests reading the tagged vlans of the nics of a server."""
+        self.server.nic = {0: {'taggedVlan': '100,101'}, 1: {}}
+        self.assertEqual({'0': vlans.VlanBitmap([100, 101]),
+                          '1': vlans.VlanBitmap()},
+                         self.green.get_server_vlans('1/1').wait())
+
+    def test_identical_requests_share_one_call(self):
+        """Tests that concurrent identical operations send one request."""
+        self.server.set_tagged_vlan.side_effect = (
+            lambda *args, **kwargs: eventlet.sleep(0.01))
+        futures = [self.green.tag_server('1/1', '100', ['0'])
+                   for i in range(3)]
+        futures.append(self.green.tag_server('1/1', '100', ['1']))
+        seamicro_client.wait_all(futures)
+        self.assertEqual(2, self.server.set_tagged_vlan.call_count)
+        self.assertEqual(2, self.green.dedup_hits['set_tagged_vlan'])
+        self.assertEqual(1, self.client.servers.get.call_count)
+
+        self.green.tag_server('1/1', '100', ['0']).wait()
+        self.assertEqual(3, self.server.set_tagged_vlan.call_count)
+
+    def test_only_latest_operation_is_shared(self):
+        """Tests that a tag issued after an untag is not deduplicated."""
+        self.system.add_segment.side_effect = (
+            lambda vlan_id: eventlet.sleep(0.01))
+        futures = [self.green.add_segment('100'),
+                   self.green.remove_segment('100'),
+                   self.green.add_segment('100')]
+        seamicro_client.wait_all(futures)
+        self.assertEqual(2, self.system.add_segment.call_count)
+        self.assertEqual(0, self.green.stats()['dedup_hits'])
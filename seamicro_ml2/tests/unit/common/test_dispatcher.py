@@ -0,0 +1,82 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+
+from neutron.tests import base
+from seamicro_ml2.common import dispatcher
+
+
+class SeaMicroDispatcherTest(base.BaseTestCase):
+
+    """Unit tests for the ordered per key dispatcher."""
+
+    def setUp(self):
+        super(SeaMicroDispatcherTest, self).setUp()
+        self.dispatcher = dispatcher.OrderedDispatcher()
+        self.events = []
+
+    def _op(self, name, delay=0):
+        self.events.append(('start', name))
+        eventlet.sleep(delay)
+        self.events.append(('end', name))
+        return name
+
+    def test_same_key_in_order(self):
+        """Tests that operations on one key run one after another."""
+        keys = dispatcher.port_keys('1.1.1.1', '1/1', '100')
+        first = self.dispatcher.submit(keys, self._op, 'create', 0.02)
+        second = self.dispatcher.submit(keys, self._op, 'delete')
+        self.assertEqual('delete', second.wait())
+        self.assertEqual('create', first.wait())
+        self.assertEqual([('start', 'create'), ('end', 'create'),
+                          ('start', 'delete'), ('end', 'delete')],
+                         self.events)
+        self.assertEqual(0, self.dispatcher.depth())
+
+    def test_independent_keys_concurrent(self):
+        """Tests that operations on other chassis do not wait."""
+        slow = self.dispatcher.submit(
+            [dispatcher.vlan_key('1.1.1.1', 100)], self._op, 'slow', 0.02)
+        fast = self.dispatcher.submit(
+            [dispatcher.vlan_key('2.2.2.2', 100)], self._op, 'fast')
+        fast.wait()
+        self.assertNotIn(('end', 'slow'), self.events)
+        slow.wait()
+
+    def test_shared_key_orders_multi_key_ops(self):
+        """Tests ordering through one shared key out of several."""
+        vlan = dispatcher.vlan_key('1.1.1.1', 100)
+        first = self.dispatcher.submit(
+            [dispatcher.server_key('1.1.1.1', '1/1'), vlan],
+            self._op, 'port1', 0.02)
+        self.assertEqual(1, self.dispatcher.depth(vlan))
+        self.dispatcher.run(
+            [dispatcher.server_key('1.1.1.1', '1/2'), vlan],
+            self._op, 'port2')
+        first.wait()
+        self.assertEqual([('start', 'port1'), ('end', 'port1'),
+                          ('start', 'port2'), ('end', 'port2')],
+                         self.events)
+
+    def test_error_releases_keys(self):
+        """Tests that a failed operation does not block the next ones."""
+        key = dispatcher.vlan_key('1.1.1.1', 100)
+
+        def fail():
+            raise ValueError()
+
+        self.assertRaises(ValueError, self.dispatcher.run, [key], fail)
+        self.assertEqual('next', self.dispatcher.run([key], self._op, 'next'))
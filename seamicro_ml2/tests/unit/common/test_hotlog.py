@@ -0,0 +1,102 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+
+import mock
+
+from neutron.tests import base
+from seamicro_ml2.common import hotlog
+
+
+class SeaMicroHotLogTest(base.BaseTestCase):
+
+    """Unit tests for the rate limited and summarized driver logs."""
+
+    def setUp(self):
+        super(SeaMicroHotLogTest, self).setUp()
+        self.logger = mock.Mock()
+        self.logger.isEnabledFor.return_value = True
+
+    def test_redact(self):
+        """Tests that the secrets of dicts and strings are masked."""
+        self.assertEqual({'username': 'admin', 'password': hotlog.MASK,
+                          'nested': [{'Token': hotlog.MASK}]},
+                         hotlog.redact({'username': 'admin',
+                                        'password': 'pass',
+                                        'nested': [{'Token': 'abc'}]}))
+        self.assertEqual("{'password': '***', 'user': 'admin'}",
+                         hotlog.redact("{'password': 'pass', "
+                                       "'user': 'admin'}"))
+        self.assertEqual('http://h/?token=***&a=1',
+                         hotlog.redact('http://h/?token=abc&a=1'))
+        self.assertNotIn('s3cret', str(hotlog.Redacted(
+            {'username': 'admin', 'password': 's3cret'})))
+
+    def test_rate_limit(self):
+        """Tests that a message is logged at most burst times per interval."""
+        log = hotlog.HotLog(self.logger, interval=60, burst=2)
+        with mock.patch('time.time', return_value=1000):
+            for i in range(5):
+                log.info('port %s', i)
+        self.assertEqual(2, self.logger.log.call_count)
+        with mock.patch('time.time', return_value=1060):
+            log.info('port %s', 5)
+        self.assertEqual(4, self.logger.log.call_count)
+        self.assertEqual(3, self.logger.log.call_args_list[2][0][2]['count'])
+        self.assertEqual((logging.INFO, 'port %s', 5),
+                         self.logger.log.call_args[0])
+
+    def test_disabled_level(self):
+        """Tests that records below the logger level are dropped."""
+        self.logger.isEnabledFor.return_value = False
+        log = hotlog.HotLog(self.logger)
+        log.debug('port %s', 1)
+        self.assertFalse(self.logger.log.called)
+
+    def test_summary(self):
+        """Tests that operations are summarized per chassis."""
+        summary = hotlog.Summary(self.logger, interval=60)
+        for i in range(100):
+            summary.record('created', 'ports', '1.1.1.1', i / 100.0)
+        summary.record('created', 'ports', '2.2.2.2', 1, failed=True)
+        self.assertFalse(self.logger.info.called)
+        summary.flush()
+        self.assertEqual(2, self.logger.info.call_count)
+        params = self.logger.info.call_args_list[0][0][1]
+        self.assertEqual(('1.1.1.1', 100, 0), (
+            params['switch_ip'], params['count'], params['failed']))
+        self.assertEqual(0.99, params['p99'])
+        self.assertEqual(1, self.logger.info.call_args[0][1]['failed'])
+        summary.flush()
+        self.assertEqual(2, self.logger.info.call_count)
+
+    def test_summary_flushes_drop_counts(self):
+        """Tests that drop counts are logged without a next record."""
+        log = hotlog.HotLog(self.logger, interval=60, burst=1)
+        summary = hotlog.Summary(self.logger, interval=60, hotlog=log)
+        with mock.patch('time.time', return_value=1000):
+            for i in range(3):
+                log.warning('port %s', i)
+            summary.flush()
+        self.assertEqual(1, self.logger.log.call_count)
+        with mock.patch('time.time', return_value=1060):
+            summary.flush()
+        self.assertEqual(2, self.logger.log.call_count)
+        self.assertEqual(logging.WARNING, self.logger.log.call_args[0][0])
+        self.assertEqual(2, self.logger.log.call_args[0][2]['count'])
+        with mock.patch('time.time', return_value=1120):
+            summary.flush()
+        self.assertEqual(2, self.logger.log.call_count)
@@ -0,0 +1,232 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import eventlet
+import fixtures
+import mock
+
+from neutron.tests import base
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import inventory
+
+
+class SeaMicroInventoryTest(base.BaseTestCase):
+
+    """Unit tests for the SeaMicro host inventory."""
+
+    def setUp(self):
+        super(SeaMicroInventoryTest, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+
+    def _write(self, name, content, mtime=None):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_load_json(self):
+        """Tests loading a JSON inventory."""
+        path = self._write('hosts.json',
+                           '{"1.1.1.1": {"compute1": "1/1",'
+                           ' "compute2": "1/2,0,1"}}')
+        index = inventory.load_inventory(path)
+        self.assertEqual(2, len(index))
+        self.assertEqual(('1.1.1.1', '1/1', []), index.get('compute1'))
+        self.assertEqual(('1.1.1.1', '1/2', ['0', '1']),
+                         index.get('compute2'))
+        self.assertIsNone(index.get('compute3'))
+
+    def test_load_csv(self):
+        """Tests loading a CSV inventory."""
+        path = self._write('hosts.csv',
+                           '# host,chassis,server\n'
+                           'compute1,1.1.1.1,1/1\n'
+                           '\n'
+                           'compute2, 2.2.2.2, 2/0, 0, 1\n')
+        index = inventory.load_inventory(path)
+        self.assertEqual(('1.1.1.1', '1/1', []), index.get('compute1'))
+        self.assertEqual(('2.2.2.2', '2/0', ['0', '1']),
+                         index.get('compute2'))
+        self.assertEqual(['compute2'], list(index.hosts('2.2.2.2')))
+
+    def test_load_csv_invalid_line(self):
+        """Tests that a truncated CSV line is rejected."""
+        path = self._write('hosts.csv', 'compute1,1.1.1.1\n')
+        self.assertRaises(ValueError, inventory.load_inventory, path)
+
+    def test_reload_on_mtime_change(self):
+        """Tests that a changed file is swapped in as a whole."""
+        path = self._write('hosts.csv', 'compute1,1.1.1.1,1/1\n', mtime=1)
+        inv = inventory.HostInventory(path)
+        self.assertFalse(inv.reload())
+
+        self._write('hosts.csv', 'compute2,1.1.1.1,1/2\n', mtime=2)
+        self.assertTrue(inv.reload())
+        self.assertIsNone(inv.lookup('compute1'))
+        self.assertEqual(('1.1.1.1', '1/2', []), inv.lookup('compute2'))
+
+    def test_reload_keeps_index_on_error(self):
+        """Tests that a broken file does not replace the current index."""
+        path = self._write('hosts.json', '{"1.1.1.1": {"compute1": "1/1"}}',
+                           mtime=1)
+        inv = inventory.HostInventory(path)
+        self._write('hosts.json', '{"1.1.1.1": ', mtime=2)
+        self.assertFalse(inv.reload())
+        self.assertEqual(('1.1.1.1', '1/1', []), inv.lookup('compute1'))
+
+    def test_lookup_does_not_reload(self):
+        """Tests that lookups leave the reload to the periodic check."""
+        path = self._write('hosts.csv', 'compute1,1.1.1.1,1/1\n', mtime=1)
+        inv = inventory.HostInventory(path)
+        self._write('hosts.csv', 'compute1,1.1.1.1,1/3\n', mtime=2)
+        self.assertEqual(('1.1.1.1', '1/1', []), inv.lookup('compute1'))
+        inv.start(0.01)
+        self.addCleanup(inv._loop.stop)
+        eventlet.sleep(0.05)
+        self.assertEqual(('1.1.1.1', '1/3', []), inv.lookup('compute1'))
+
+    def test_range_rule(self):
+        """Tests that range rules resolve without being expanded."""
+        index = inventory.HostIndex()
+        index.add('compute[1-512]', '1.1.1.1', '1/[0-511]', ['0', '1'])
+        index.add('compute[513-576]', '2.2.2.2', '[0-63]/0')
+        self.assertEqual(('1.1.1.1', '1/0', ['0', '1']),
+                         index.get('compute1'))
+        self.assertEqual(('1.1.1.1', '1/511', ['0', '1']),
+                         index.get('compute512'))
+        self.assertEqual(('2.2.2.2', '0/0', []), index.get('compute513'))
+        self.assertEqual(('2.2.2.2', '63/0', []), index.get('compute576'))
+        self.assertIsNone(index.get('compute0'))
+        self.assertIsNone(index.get('compute577'))
+        self.assertIsNone(index.get('compute017'))
+        self.assertIsNone(index.get('storage1'))
+        self.assertEqual(576, len(index))
+        self.assertEqual(64, len(list(index.hosts('2.2.2.2'))))
+        self.assertEqual(set('%d/0' % i for i in range(64)),
+                         index.servers('2.2.2.2'))
+
+    def test_range_rule_padded(self):
+        """Tests zero padded ranges with a suffix."""
+        index = inventory.HostIndex()
+        index.add('node[001-064].rack', '1.1.1.1', '1/[00-63]')
+        self.assertEqual(('1.1.1.1', '1/09', []), index.get('node010.rack'))
+        self.assertIsNone(index.get('node10.rack'))
+
+    def test_range_rule_exact_host_wins(self):
+        """Tests that a single host entry overrides a range rule."""
+        index = inventory.HostIndex()
+        index.add('compute[1-8]', '1.1.1.1', '1/[0-7]')
+        index.add('compute3', '1.1.1.1', '1/9', ['1'])
+        self.assertEqual(('1.1.1.1', '1/9', ['1']), index.get('compute3'))
+        self.assertEqual(('1.1.1.1', '1/3', []), index.get('compute4'))
+
+    def test_range_rule_invalid(self):
+        """Tests that invalid range rules are rejected."""
+        index = inventory.HostIndex()
+        index.add('compute[1-8]', '1.1.1.1', '1/[0-7]')
+        self.assertRaises(ValueError, index.add,
+                          'compute[8-9]', '1.1.1.1', '1/[8-9]')
+        self.assertRaises(ValueError, index.add,
+                          'compute[9-16]', '1.1.1.1', '1/[0-1]')
+        self.assertRaises(ValueError, index.add,
+                          'compute[9-16]', '1.1.1.1', '1/1')
+        self.assertRaises(ValueError, index.add,
+                          'rack[1-2]-1', '1.1.1.1', '1/[0-1]')
+
+    def test_index_switches(self):
+        """Tests building the index from the chassis sections."""
+        switches = {'1.1.1.1': {'username': 'admin',
+                                'compute1': '1/1',
+                                'compute[2-3]': '1/[2-3],0'}}
+        index = inventory.index_switches(switches, ignore=('username',))
+        self.assertEqual(3, len(index))
+        self.assertEqual(('1.1.1.1', '1/3', ['0']), index.get('compute3'))
+        self.assertIsNone(index.get('username'))
+
+
+class _Clients(dict):
+
+    def is_ready(self, switch_ip):
+        return switch_ip in self
+
+
+class _Server(object):
+
+    def __init__(self, server_id, hostname=None, macs=()):
+        self.id = server_id
+        self.hostname = hostname
+        self.nic = dict((str(i), {'macAddr': mac})
+                        for i, mac in enumerate(macs))
+
+
+class SeaMicroServerDiscoveryTest(base.BaseTestCase):
+
+    """Unit tests for the discovery of the chassis servers."""
+
+    def setUp(self):
+        super(SeaMicroServerDiscoveryTest, self).setUp()
+        self.rest = mock.Mock()
+        self.rest.servers.list.return_value = [
+            _Server('1/0', 'compute1.example.org', ['00:22:99:00:00:01']),
+            _Server('1/1', macs=['00-22-99-00-00-02'])]
+        self.discovery = inventory.ServerDiscovery(_Clients(
+            {'1.1.1.1': seamicro_client.GreenSeaMicroClient(self.rest)}))
+
+    def test_lookup(self):
+        """Tests that hosts are matched by name and ports by mac."""
+        self.assertEqual(2, self.discovery.refresh())
+        self.assertEqual(('1.1.1.1', '1/0', []),
+                         self.discovery.lookup('compute1'))
+        self.assertEqual(('1.1.1.1', '1/0', []),
+                         self.discovery.lookup('Compute1.example.org'))
+        self.assertEqual(('1.1.1.1', '1/1', ['0']),
+                         self.discovery.lookup_mac('00:22:99:00:00:02'))
+        self.assertIsNone(self.discovery.lookup('compute2'))
+        self.assertEqual(set(['1/0', '1/1']),
+                         self.discovery.servers('1.1.1.1'))
+
+    def test_incremental_refresh(self):
+        """Tests that only the servers which changed are indexed again."""
+        self.discovery.refresh()
+        self.assertEqual(0, self.discovery.refresh())
+        self.rest.servers.list.return_value = [
+            _Server('1/0', 'compute1.example.org', ['00:22:99:00:00:01']),
+            _Server('1/2', 'compute3')]
+        with mock.patch.object(self.discovery, '_index',
+                               wraps=self.discovery._index) as index:
+            self.assertEqual(2, self.discovery.refresh())
+        self.assertEqual(1, index.call_count)
+        self.assertIsNone(self.discovery.lookup_mac('00:22:99:00:00:02'))
+        self.assertEqual(('1.1.1.1', '1/2', []),
+                         self.discovery.lookup('compute3'))
+
+    def test_failed_listing_keeps_servers(self):
+        """Tests that a chassis which cannot be listed keeps its servers."""
+        self.discovery.refresh()
+        self.rest.servers.list.side_effect = Exception()
+        self.assertEqual(0, self.discovery.refresh())
+        self.assertIsNotNone(self.discovery.lookup('compute1'))
+
+    def test_configured_host_differs(self):
+        """Tests that a wrong configured mapping is logged."""
+        self.discovery._known = {
+            'compute1.example.org': ('1.1.1.1', '1/5', [])}.get
+        with mock.patch.object(inventory.LOG, 'warning') as warning:
+            self.discovery.refresh()
+        self.assertEqual(1, warning.call_count)
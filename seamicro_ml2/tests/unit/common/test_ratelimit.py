@@ -0,0 +1,198 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import eventlet
+import mock
+
+from neutron.tests import base
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import ratelimit
+
+
+class SeaMicroTokenBucketTest(base.BaseTestCase):
+
+    """Unit tests for the chassis token bucket."""
+
+    def test_burst_then_rate(self):
+        """Tests that requests beyond the burst are paced by the rate."""
+        bucket = ratelimit.TokenBucket(rate=100, burst=5)
+        start = time.time()
+        for i in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - start, 0.02)
+        for i in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_unlimited(self):
+        """Tests that a rate of 0 never waits."""
+        bucket = ratelimit.TokenBucket(rate=0)
+        with mock.patch.object(eventlet, 'sleep') as sleep:
+            for i in range(100):
+                bucket.acquire()
+        self.assertFalse(sleep.called)
+
+
+class SeaMicroAdaptiveLimiterTest(base.BaseTestCase):
+
+    """Unit tests for the chassis AIMD concurrency limit."""
+
+    def test_additive_increase(self):
+        """Tests that fast requests raise the limit up to maximum."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=4, initial=2)
+        for i in range(10):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(4, limiter.stats()['limit'])
+
+    def test_multiplicative_decrease(self):
+        """Tests that slow or overloaded requests halve the limit."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=8, latency_target=1)
+        limiter.acquire()
+        limiter.release(5)
+        self.assertEqual(4, limiter.stats()['limit'])
+        limiter._last_decrease = 0
+        limiter.acquire()
+        limiter.release(0.01, overloaded=True)
+        self.assertEqual(2, limiter.stats()['limit'])
+        limiter.acquire()
+        limiter.release(5)
+        self.assertEqual(2, limiter.stats()['limit'])
+
+    def test_minimum(self):
+        """Tests that the limit never drops below minimum."""
+        limiter = ratelimit.AdaptiveLimiter(minimum=2, maximum=8,
+                                            latency_target=0)
+        for i in range(5):
+            limiter._last_decrease = 0
+            limiter.acquire()
+            limiter.release(1)
+        self.assertEqual(2, limiter.stats()['limit'])
+
+    def test_queue(self):
+        """Tests that requests over the limit queue and are handed over."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=1)
+        limiter.acquire()
+        waiter = eventlet.spawn(limiter.acquire)
+        eventlet.sleep(0)
+        self.assertEqual({'limit': 1, 'in_flight': 1, 'queued': 1},
+                         limiter.stats())
+        limiter.release(0.01)
+        waiter.wait()
+        self.assertEqual({'limit': 1, 'in_flight': 1, 'queued': 0},
+                         limiter.stats())
+
+    def test_killed_waiter(self):
+        """Tests that a waiter killed in the queue leaves it."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=1)
+        limiter.acquire()
+        waiter = eventlet.spawn(limiter.acquire)
+        eventlet.sleep(0)
+        waiter.kill()
+        self.assertEqual(0, limiter.stats()['queued'])
+        limiter.release(0.01)
+        self.assertEqual({'limit': 1, 'in_flight': 0, 'queued': 0},
+                         limiter.stats())
+
+    def test_killed_waiter_gives_back_slot(self):
+        """Tests that a waiter killed after the handover frees its slot."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=1)
+        limiter.acquire()
+        waiter = eventlet.spawn(limiter.acquire)
+        eventlet.sleep(0)
+        limiter.release(0.01)
+        waiter.kill()
+        self.assertEqual({'limit': 1, 'in_flight': 0, 'queued': 0},
+                         limiter.stats())
+
+    def test_client_token_wait_killed(self):
+        """Tests that a request killed waiting for a token frees its slot."""
+        client = mock.Mock()
+        green = seamicro_client.GreenSeaMicroClient(client, max_requests=1,
+                                                    rate=1, burst=1)
+        green.spawn(client.system.list).wait()
+        request = green.spawn(client.system.list)
+        eventlet.sleep(0)
+        request.kill()
+        self.assertEqual(0, green.stats()['in_flight'])
+        self.assertEqual(1, client.system.list.call_count)
+
+    def test_client_overload_lowers_limit(self):
+        """Tests that server errors of a chassis lower its limit."""
+        error = Exception()
+        error.code = 503
+        client = mock.Mock()
+        client.system.list.side_effect = error
+        green = seamicro_client.GreenSeaMicroClient(client, max_requests=8)
+        self.assertRaises(Exception, green.add_segment('100').wait)
+        self.assertEqual(4, green.stats()['limit'])
+
+    def _queue(self, limiter, served, name, priority_class):
+        def acquire():
+            limiter.acquire(priority_class)
+            served.append(name)
+        waiter = eventlet.spawn(acquire)
+        eventlet.sleep(0)
+        return waiter
+
+    def test_interactive_first(self):
+        """Tests that interactive requests get a slot before background."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=1)
+        limiter.acquire()
+        served = []
+        self._queue(limiter, served, 'gc', ratelimit.BACKGROUND)
+        self._queue(limiter, served, 'port', ratelimit.INTERACTIVE)
+        for i in range(2):
+            limiter.release(0.01)
+            eventlet.sleep(0)
+        self.assertEqual(['port', 'gc'], served)
+        stats = limiter.wait_stats()
+        self.assertEqual(2, stats[ratelimit.INTERACTIVE]['requests'])
+        self.assertEqual(1, stats[ratelimit.BACKGROUND]['requests'])
+
+    def test_background_not_starved(self):
+        """Tests that a background request waits at most max_wait."""
+        limiter = ratelimit.AdaptiveLimiter(maximum=1, max_wait=0.01)
+        limiter.acquire()
+        served = []
+        self._queue(limiter, served, 'gc', ratelimit.BACKGROUND)
+        self._queue(limiter, served, 'port', ratelimit.INTERACTIVE)
+        eventlet.sleep(0.02)
+        limiter.release(0.01)
+        eventlet.sleep(0)
+        self.assertEqual(['gc'], served)
+        stats = limiter.wait_stats()[ratelimit.BACKGROUND]
+        self.assertGreaterEqual(stats['max_wait'], 0.01)
+        self.assertEqual(1, limiter.wait_stats()[
+            ratelimit.INTERACTIVE]['queued'])
+
+    def test_client_priority(self):
+        """Tests that interactive operations do not join background ones."""
+        client = mock.Mock()
+        client.system.list.return_value = [mock.Mock()]
+        green = seamicro_client.GreenSeaMicroClient(client, max_requests=1)
+        with ratelimit.priority(ratelimit.BACKGROUND):
+            background = green.add_segment('100')
+            self.assertIs(background, green.add_segment('100'))
+        interactive = green.add_segment('100')
+        self.assertIsNot(background, interactive)
+        with ratelimit.priority(ratelimit.BACKGROUND):
+            self.assertIs(interactive, green.add_segment('100'))
+        seamicro_client.wait_all([background, interactive])
+        stats = green.stats()['priorities']
+        self.assertEqual(1, stats[ratelimit.BACKGROUND]['requests'])
+        self.assertEqual(1, stats[ratelimit.INTERACTIVE]['requests'])
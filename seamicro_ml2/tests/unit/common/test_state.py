@@ -0,0 +1,181 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import time
+
+import fixtures
+import mock
+
+from neutron.tests import base
+from seamicro_ml2.common import client as seamicro_client
+from seamicro_ml2.common import state
+from seamicro_ml2.common import vlans
+
+
+class FakeClients(dict):
+
+    def is_ready(self, switch_ip):
+        return switch_ip in self
+
+
+class SeaMicroStateTest(base.BaseTestCase):
+
+    """Unit tests for the chassis state and its snapshot."""
+
+    def setUp(self):
+        super(SeaMicroStateTest, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'state.bin')
+        self.cache = state.StateCache()
+        chassis = self.cache['1.1.1.1']
+        chassis.set(state.SEGMENTS_KEY, vlans.VlanBitmap.parse('100-199'))
+        chassis.replace(state.INTERFACE, {'0/0': vlans.VlanBitmap([100])})
+        chassis.replace(state.NIC, {'0': vlans.VlanBitmap([100, 4000])},
+                        ('1/1',))
+
+    def test_snapshot_round_trip(self):
+        """Tests that a snapshot loads back unverified."""
+        state.write_snapshot(self.path, self.cache)
+        cache = state.StateCache()
+        self.assertEqual(3, state.read_snapshot(self.path, cache))
+        chassis = cache['1.1.1.1']
+        self.assertEqual(3, len(chassis.unverified()))
+        self.assertEqual('100-199', str(chassis.get(state.SEGMENTS_KEY)))
+        self.assertEqual('100,4000',
+                         str(chassis.get(state.nic_key('1/1', '0'))))
+        self.assertEqual([state.interface_key('0/0')],
+                         chassis.keys_of(state.INTERFACE))
+
+    def test_unusable_snapshot_ignored(self):
+        """Tests that missing, corrupted or foreign snapshots are ignored."""
+        self.assertEqual(0, state.read_snapshot(self.path, self.cache))
+        state.write_snapshot(self.path, self.cache)
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'\xff')
+        self.assertEqual(0, state.read_snapshot(self.path, state.StateCache()))
+        with open(self.path, 'wb') as f:
+            f.write(b'SMVS\x00\x63' + b'\x00' * 8)
+        self.assertEqual(0, state.read_snapshot(self.path, state.StateCache()))
+
+    def test_client_records_state(self):
+        """Tests that the client records what it reads and changes."""
+        client = mock.Mock()
+        client.system.list.return_value = [mock.Mock(segments='100')]
+        server = mock.Mock(nic={0: {'taggedVlan': '100'}, 1: {}})
+        client.servers.get.return_value = server
+        chassis = state.ChassisState()
+        green = seamicro_client.GreenSeaMicroClient(client, state=chassis)
+
+        green.get_segments().wait()
+        green.add_segment(200).wait()
+        self.assertTrue(chassis.is_verified(state.SEGMENTS_KEY))
+        self.assertEqual('100,200', str(chassis.get(state.SEGMENTS_KEY)))
+
+        green.get_server_vlans('1/1').wait()
+        green.tag_server('1/1', 300).wait()
+        self.assertEqual('100,300',
+                         str(chassis.get(state.nic_key('1/1', '0'))))
+        self.assertEqual('300', str(chassis.get(state.nic_key('1/1', '1'))))
+
+        server.unset_tagged_vlan.side_effect = ValueError()
+        self.assertRaises(ValueError,
+                          green.untag_server('1/1', 300, ['1']).wait)
+        self.assertEqual([state.nic_key('1/1', '1')], chassis.unverified())
+
+    def test_cached_reads(self):
+        """Tests that fresh parts of the state replace a chassis read."""
+        client = mock.Mock()
+        client.system.list.return_value = [mock.Mock(segments='100')]
+        chassis = state.ChassisState()
+        green = seamicro_client.GreenSeaMicroClient(client, state=chassis)
+
+        self.assertEqual('100', str(green.get_segments(60).wait()))
+        green.add_segment(200).wait()
+        reads = client.system.list.call_count
+        self.assertEqual('100,200', str(green.get_segments(60).wait()))
+        self.assertEqual(reads, client.system.list.call_count)
+        with mock.patch('time.time', return_value=time.time() + 61):
+            green.get_segments(60).wait()
+        self.assertEqual(reads + 1, client.system.list.call_count)
+        green.get_segments().wait()
+        self.assertEqual(reads + 2, client.system.list.call_count)
+
+        chassis.replace(state.NIC, {'0': vlans.VlanBitmap([300])}, ('1/1',))
+        self.assertEqual({'0': vlans.VlanBitmap([300])},
+                         green.get_server_vlans('1/1', 60).wait())
+        self.assertFalse(client.servers.get.called)
+        chassis.invalidate([state.nic_key('1/1', '0')])
+        client.servers.get.return_value = mock.Mock(nic={})
+        self.assertEqual({}, green.get_server_vlans('1/1', 60).wait())
+        self.assertTrue(client.servers.get.called)
+
+    def test_snapshot_age(self):
+        """Tests that the parts loaded are as old as their snapshot."""
+        state.write_snapshot(self.path, self.cache)
+        os.utime(self.path, (time.time() - 120,) * 2)
+        cache = state.StateCache()
+        state.read_snapshot(self.path, cache)
+        chassis = cache['1.1.1.1']
+        self.assertTrue(chassis.is_fresh(state.SEGMENTS_KEY, 180))
+        self.assertFalse(chassis.is_fresh(state.SEGMENTS_KEY, 60))
+        self.assertIsNone(chassis.fresh(state.INTERFACE, max_age=60))
+        self.assertEqual(['0/0'],
+                         list(chassis.fresh(state.INTERFACE, max_age=180)))
+
+    def test_snapshot_owned_chassis(self):
+        """Tests that only the state of the owned chassis is saved."""
+        self.cache['2.2.2.2'].set(state.SEGMENTS_KEY, vlans.VlanBitmap([10]))
+        clients = FakeClients({'1.1.1.1': None, '2.2.2.2': None})
+        snapshot = state.StateSnapshot(
+            self.path, self.cache, clients,
+            owns=lambda switch_ip: switch_ip == '2.2.2.2')
+        snapshot.save()
+        self.assertFalse(
+            os.path.exists(state.snapshot_path(self.path, '1.1.1.1')))
+        cache = state.StateCache()
+        self.assertEqual(1, state.read_snapshot(
+            state.snapshot_path(self.path, '2.2.2.2'), cache))
+        self.assertEqual(['2.2.2.2'], list(cache))
+
+        cache = state.StateCache()
+        self.assertEqual(1, state.StateSnapshot(self.path, cache,
+                                                clients).load())
+        self.assertEqual('10', str(cache['2.2.2.2'].get(state.SEGMENTS_KEY)))
+
+    def test_background_verification(self):
+        """Tests that the parts loaded from a snapshot are read again."""
+        path = state.snapshot_path(self.path, '1.1.1.1')
+        state.write_snapshot(path, self.cache)
+        cache = state.StateCache()
+        client = mock.Mock()
+        client.system.list.return_value = [mock.Mock(segments='100-150')]
+        client.interfaces.list.return_value = [
+            mock.Mock(id='0/0', taggedVlans='100')]
+        client.servers.get.return_value = mock.Mock(nic={})
+        green = seamicro_client.GreenSeaMicroClient(
+            client, state=cache['1.1.1.1'])
+        snapshot = state.StateSnapshot(self.path, cache,
+                                       FakeClients({'1.1.1.1': green}))
+        snapshot.load()
+        snapshot.run_once()
+
+        chassis = cache['1.1.1.1']
+        self.assertEqual([], chassis.unverified())
+        self.assertEqual('100-150', str(chassis.get(state.SEGMENTS_KEY)))
+        self.assertEqual([], chassis.keys_of(state.NIC))
+        saved = state.StateCache()
+        self.assertEqual(2, state.read_snapshot(path, saved))
@@ -0,0 +1,55 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.tests import base
+from seamicro_ml2.common import vlans
+
+
+class SeaMicroVlanBitmapTest(base.BaseTestCase):
+
+    """Unit tests for the vlan bitmaps."""
+
+    def test_membership(self):
+        """Tests adding vlans and looking them up."""
+        bitmap = vlans.VlanBitmap([1, '100', 4095])
+        self.assertIn(100, bitmap)
+        self.assertIn('4095', bitmap)
+        self.assertNotIn(2, bitmap)
+        self.assertNotIn(5000, bitmap)
+        self.assertEqual([1, 100, 4095], list(bitmap))
+        self.assertEqual(3, len(bitmap))
+        self.assertRaises(ValueError, vlans.VlanBitmap, [4096])
+
+    def test_parse_and_format(self):
+        """Tests the round trip through the chassis range format."""
+        bitmap = vlans.VlanBitmap.parse('1, 5-7,100,4000-4095')
+        self.assertEqual(101, len(bitmap))
+        self.assertEqual('1,5-7,100,4000-4095', str(bitmap))
+        self.assertEqual([(1, 1), (5, 7), (100, 100), (4000, 4095)],
+                         list(bitmap.ranges()))
+        self.assertEqual(bitmap, vlans.VlanBitmap.parse(str(bitmap)))
+        self.assertRaises(ValueError, vlans.VlanBitmap.parse, '7-5')
+
+    def test_set_operations(self):
+        """Tests diffing bitmaps with bitwise operations."""
+        actual = vlans.VlanBitmap.from_range(100, 109)
+        wanted = vlans.VlanBitmap.from_ranges([(105, 120)])
+        self.assertEqual('100-104', str(actual - wanted))
+        self.assertEqual('110-120', str(wanted - actual))
+        self.assertEqual('105-109', str(actual & wanted))
+        self.assertEqual('100-120', str(actual | wanted))
+        self.assertEqual('100-104,110-120', str(actual ^ wanted))
+        self.assertEqual('0-99,110-4095', str(~actual))
+        self.assertFalse(vlans.VlanBitmap())
@@ -14,6 +14,10 @@
 #    under the License.
 
 import collections
+import datetime
+
+import mock
+from oslo_db import exception as db_exc
 
 from neutron import context
 from neutron.tests.unit import testlib_api
@@ -43,7 +47,7 @@ class SeaMicroDbTest(testlib_api.SqlTestCase):
     def _assert_network_match(self, snw, snw_obj):
         """Asserts that a network matches a network test obj."""
         self.assertEqual(snw.id, snw_obj.net_id)
-        self.assertEqual(snw.vlan, snw_obj.vlan_id)
+        self.assertEqual(snw.vlan, int(snw_obj.vlan_id))
         self.assertEqual(snw.segment_id, snw_obj.segment_id)
         self.assertEqual(snw.network_type, snw_obj.network_type)
         self.assertEqual(snw.tenant_id, snw_obj.tenant_id)
@@ -52,7 +56,7 @@ class SeaMicroDbTest(testlib_api.SqlTestCase):
         """Asserts that a port matches a port test obj."""
         self.assertEqual(sp.id, sp_obj.port_id)
         self.assertEqual(sp.network_id, sp_obj.net_id)
-        self.assertEqual(sp.vlan_id, sp_obj.vlan_id)
+        self.assertEqual(sp.vlan_id, int(sp_obj.vlan_id))
         self.assertEqual(sp.tenant_id, sp_obj.tenant_id)
 
     def _add_network_to_db(self, snw):
@@ -146,3 +150,359 @@ class SeaMicroDbTest(testlib_api.SqlTestCase):
         self._assert_port_match(sp, sp11)
         sp = self._get_port(sp12)
         self.assertEqual(sp, None)
+
+    def test_vlan_range_queries(self):
+        """Tests the vlan range queries on networks, ports and chassis."""
+        ctx = context.get_admin_context()
+        for net_id, vlan in (('net1', '100'), ('net2', 150), ('net3', 300),
+                             ('net4', None)):
+            seamicro_db.create_network(ctx, net_id, vlan, 'seg', 'vlan',
+                                       'tenant1')
+        seamicro_db.create_port(ctx, 'port1', 'net2', 150, 'tenant1')
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 150)
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 300)
+
+        networks = seamicro_db.get_networks_in_range(ctx, 100, 199)
+        self.assertEqual(['net1', 'net2'], [net.id for net in networks])
+        self.assertEqual('100,150,300',
+                         str(seamicro_db.get_network_vlans(ctx)))
+        self.assertEqual('300',
+                         str(seamicro_db.get_network_vlans(ctx, low=200)))
+        self.assertEqual('150', str(seamicro_db.get_port_vlans(ctx)))
+        self.assertEqual('150', str(seamicro_db.get_chassis_vlans(
+            ctx, '1.1.1.1', high=200)))
+
+    def test_port_placement(self):
+        """Tests keeping where a port is bound on its row."""
+        ctx = context.get_admin_context()
+        seamicro_db.create_port(ctx, 'port1', 'net1', 100, 'tenant1',
+                                '1.1.1.1', '1/1', ('0', '1'))
+        seamicro_db.create_port(ctx, 'port2', 'net2', 200, 'tenant1',
+                                '1.1.1.1', '1/1', ())
+        seamicro_db.create_port(ctx, 'port3', 'net2', 200, 'tenant1',
+                                '1.1.1.1', '1/2', ())
+        seamicro_db.create_port(ctx, 'port4', 'net2', 200, 'tenant1')
+
+        self.assertEqual(('1.1.1.1', '1/1', ('0', '1')),
+                         seamicro_db.get_port_placement(
+                             seamicro_db.get_port(ctx, 'port1')))
+        self.assertEqual(('1.1.1.1', '1/1', ()),
+                         seamicro_db.get_port_placement(
+                             seamicro_db.get_port(ctx, 'port2')))
+        self.assertEqual((None, None, None),
+                         seamicro_db.get_port_placement(
+                             seamicro_db.get_port(ctx, 'port4')))
+        self.assertEqual(['port1', 'port2'], sorted(
+            port.id for port in seamicro_db.get_server_ports(ctx, '1.1.1.1',
+                                                             '1/1')))
+        self.assertEqual(3, len(seamicro_db.get_server_ports(ctx,
+                                                             '1.1.1.1')))
+        self.assertEqual('100,200', str(seamicro_db.get_server_port_vlans(
+            ctx, '1.1.1.1', '1/1')))
+
+    def _race_delete(self, ctx, write):
+        """Patch the first read of port1 to run write right after it."""
+        query = ctx.session.query
+
+        def racing_query(*args, **kwargs):
+            if not racing_query.raced and args == (
+                    seamicro_db.ML2_SeaMicroPort,):
+                racing_query.raced = True
+                row = query(*args, **kwargs).filter_by(id='port1').first()
+                write()
+                return mock.Mock(**{
+                    'filter_by.return_value.first.return_value': row})
+            return query(*args, **kwargs)
+        racing_query.raced = False
+        return mock.patch.object(ctx.session, 'query',
+                                 side_effect=racing_query)
+
+    def test_delete_retries_on_conflict(self):
+        """Tests that a delete reads the row again when it changed."""
+        ctx = context.get_admin_context()
+        seamicro_db.create_port(ctx, 'port1', 'net1', 100, 'tenant1')
+
+        def update():
+            # another writer updates the row right after the first read
+            with ctx.session.begin():
+                ctx.session.query(seamicro_db.ML2_SeaMicroPort).filter_by(
+                    id='port1').update({'vlan_id': 200, 'version': 1})
+
+        with self._race_delete(ctx, update):
+            port = seamicro_db.delete_port(ctx, 'port1')
+        self.assertEqual((200, 1), (port.vlan_id, port.version))
+        self.assertIsNone(seamicro_db.get_port(ctx, 'port1'))
+
+    def test_delete_already_deleted(self):
+        """Tests that a row deleted by another writer is not an error."""
+        ctx = context.get_admin_context()
+        seamicro_db.create_port(ctx, 'port1', 'net1', 100, 'tenant1')
+
+        def delete():
+            # another writer deletes the row right after the first read
+            seamicro_db.delete_port(context.get_admin_context(), 'port1')
+
+        with self._race_delete(ctx, delete):
+            ctx.session.begin()
+            try:
+                self.assertIsNone(seamicro_db.delete_port(ctx, 'port1'))
+            finally:
+                ctx.session.commit()
+        self.assertIsNone(seamicro_db.get_port(ctx, 'port1'))
+        self.assertIsNone(seamicro_db.delete_port(ctx, 'port1'))
+
+    def test_server_vlan_refcount(self):
+        """Tests that only the first and last reference change state."""
+        ctx = context.get_admin_context()
+        nics, first = seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                  ['0', '1'], '100')
+        self.assertEqual(['0', '1'], nics)
+        self.assertTrue(first)
+        nics, first = seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                  ['0', '1'], '100')
+        self.assertEqual([], nics)
+        self.assertFalse(first)
+        self.assertEqual([100],
+                         list(seamicro_db.get_chassis_vlans(ctx, '1.1.1.1')))
+
+        nics, last = seamicro_db.remove_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                    ['0', '1'], '100')
+        self.assertEqual([], nics)
+        self.assertFalse(last)
+        nics, last = seamicro_db.remove_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                    ['0', '1'], '100')
+        self.assertEqual(['0', '1'], nics)
+        self.assertTrue(last)
+        self.assertFalse(seamicro_db.get_chassis_vlans(ctx, '1.1.1.1'))
+
+    def test_server_vlan_insert_race(self):
+        """Tests that losing the insert of a server vlan takes a reference."""
+        ctx = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 100)
+        # the other writer inserted the row after it was looked up, so
+        # the first attempt inserts it too
+        reads = [None]
+        read_server_vlan = seamicro_db._read_server_vlan
+        flush = ctx.session.flush
+        failures = [db_exc.DBDuplicateEntry()]
+
+        def lookup(*args):
+            return reads.pop() if reads else read_server_vlan(*args)
+
+        def insert(*args, **kwargs):
+            if failures and ctx.session.new:
+                raise failures.pop()
+            return flush(*args, **kwargs)
+
+        with mock.patch.object(seamicro_db, '_read_server_vlan',
+                               side_effect=lookup), \
+                mock.patch.object(ctx.session, 'flush', side_effect=insert):
+            nics, first = seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                      [], 100)
+        self.assertEqual([], failures)
+        self.assertEqual([], nics)
+        self.assertFalse(first)
+        self.assertEqual(
+            [2], [row.ref_count for row in
+                  seamicro_db.get_server_vlans(ctx, '1.1.1.1', '1/1')])
+
+    def _stale_read(self, ref_count):
+        """Patch the first read of a server vlan to return ref_count."""
+        stale = [seamicro_db.ML2_SeaMicroServerVlan(
+            switch_ip='1.1.1.1', server_id='1/1', nic='', vlan=100,
+            ref_count=ref_count)]
+        read_server_vlan = seamicro_db._read_server_vlan
+        return mock.patch.object(
+            seamicro_db, '_read_server_vlan',
+            side_effect=lambda *args: (stale.pop() if stale
+                                       else read_server_vlan(*args)))
+
+    def test_server_vlan_refcount_conflict(self):
+        """Tests that a reference count changed under a write is re-read."""
+        ctx = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 100)
+        with self._stale_read(5):
+            nics, first = seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                      [], 100)
+        self.assertEqual(([], False), (nics, first))
+        self.assertEqual(
+            [2], [row.ref_count for row in
+                  seamicro_db.get_server_vlans(ctx, '1.1.1.1', '1/1')])
+        with self._stale_read(5):
+            nics, last = seamicro_db.remove_server_vlan(ctx, '1.1.1.1',
+                                                        '1/1', [], 100)
+        self.assertEqual(([], False), (nics, last))
+        self.assertEqual(
+            [1], [row.ref_count for row in
+                  seamicro_db.get_server_vlans(ctx, '1.1.1.1', '1/1')])
+
+    def test_server_vlan_conflict_in_transaction(self):
+        """Tests that a conflict inside an outer transaction is raised."""
+        ctx = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 100)
+        with self._stale_read(5):
+            ctx.session.begin()
+            try:
+                self.assertRaises(seamicro_db.ConcurrentUpdateError,
+                                  seamicro_db.add_server_vlan, ctx,
+                                  '1.1.1.1', '1/1', [], 100)
+            finally:
+                ctx.session.rollback()
+        self.assertEqual(
+            [1], [row.ref_count for row in
+                  seamicro_db.get_server_vlans(ctx, '1.1.1.1', '1/1')])
+
+    def _interleave(self, ctx, write):
+        """Run write in ctx as the next server vlan transaction starts.
+
+        The transaction reads the chassis vlan as it was before write
+        committed, like one running concurrently in another process.
+        """
+        read_server_vlan = seamicro_db._read_server_vlan
+        read_chassis_vlan = seamicro_db._read_chassis_vlan
+        writes = [write]
+        stale = []
+
+        def read_server(session, switch_ip, server_id, nic, vlan):
+            if writes:
+                entry = read_chassis_vlan(ctx.session, switch_ip, vlan)
+                if entry is not None:
+                    ctx.session.expunge(entry)
+                writes.pop()()
+                stale.append(entry)
+            return read_server_vlan(session, switch_ip, server_id, nic,
+                                    vlan)
+
+        def read_chassis(*args):
+            return stale.pop() if stale else read_chassis_vlan(*args)
+
+        for name, side_effect in (('_read_server_vlan', read_server),
+                                  ('_read_chassis_vlan', read_chassis)):
+            mock.patch.object(seamicro_db, name,
+                              side_effect=side_effect).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_chassis_vlan_add_races_remove(self):
+        """Tests that an add racing the last remove is the first again."""
+        ctx_a = context.get_admin_context()
+        ctx_b = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx_b, '1.1.1.1', '1/2', [], 100)
+        results = []
+        self._interleave(ctx_b, lambda: results.append(
+            seamicro_db.remove_server_vlan(ctx_b, '1.1.1.1', '1/2', [], 100)))
+        results.append(seamicro_db.add_server_vlan(ctx_a, '1.1.1.1', '1/1',
+                                                   [], 100))
+        self.assertEqual([([''], True), ([''], True)], results)
+        self.assertEqual([100],
+                         list(seamicro_db.get_chassis_vlans(ctx_a,
+                                                            '1.1.1.1')))
+
+    def test_chassis_vlan_remove_races_add(self):
+        """Tests that a remove racing an add is not the last one."""
+        ctx_a = context.get_admin_context()
+        ctx_b = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx_a, '1.1.1.1', '1/1', [], 100)
+        results = []
+        self._interleave(ctx_b, lambda: results.append(
+            seamicro_db.add_server_vlan(ctx_b, '1.1.1.1', '1/2', [], 100)))
+        results.append(seamicro_db.remove_server_vlan(ctx_a, '1.1.1.1',
+                                                      '1/1', [], 100))
+        self.assertEqual([([''], False), ([''], False)], results)
+        self.assertEqual(['1/2'],
+                         [row.server_id for row in
+                          seamicro_db.get_server_vlans(ctx_a, '1.1.1.1')])
+
+    def test_server_vlan_shared_by_servers(self):
+        """Tests that the chassis vlan stays until its last server goes."""
+        ctx = context.get_admin_context()
+        nics, first = seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                  [], 100)
+        self.assertEqual([''], nics)
+        self.assertTrue(first)
+        nics, first = seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/2',
+                                                  [], 100)
+        self.assertEqual([''], nics)
+        self.assertFalse(first)
+        self.assertEqual(1, len(seamicro_db.get_server_vlans(ctx, '1.1.1.1',
+                                                             '1/2')))
+
+        nics, last = seamicro_db.remove_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                    [], 100)
+        self.assertEqual([''], nics)
+        self.assertFalse(last)
+        nics, last = seamicro_db.remove_server_vlan(ctx, '1.1.1.1', '1/2',
+                                                    [], 100)
+        self.assertEqual([''], nics)
+        self.assertTrue(last)
+
+    def test_server_vlan_remove_unknown(self):
+        """Tests removal of a vlan that was never tagged."""
+        ctx = context.get_admin_context()
+        nics, last = seamicro_db.remove_server_vlan(ctx, '1.1.1.1', '1/1',
+                                                    [], 100)
+        self.assertEqual([], nics)
+        self.assertFalse(last)
+
+    def test_vlan_chassis(self):
+        """Tests listing the chassis a vlan is tagged on."""
+        ctx = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 100)
+        seamicro_db.add_server_vlan(ctx, '2.2.2.2', '1/1', ['0'], 100)
+        seamicro_db.add_server_vlan(ctx, '2.2.2.2', '1/1', ['0'], 200)
+        self.assertEqual(['1.1.1.1', '2.2.2.2'],
+                         sorted(seamicro_db.get_vlan_chassis(ctx, '100')))
+        seamicro_db.remove_server_vlan(ctx, '1.1.1.1', '1/1', [], 100)
+        self.assertEqual(['2.2.2.2'], seamicro_db.get_vlan_chassis(ctx, 100))
+
+    def test_server_vlan_bitmaps(self):
+        """Tests loading the vlans of the server nics as bitmaps."""
+        ctx = context.get_admin_context()
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', [], 100)
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', ['0'], 200)
+        seamicro_db.add_server_vlan(ctx, '1.1.1.1', '1/1', ['0'], 201)
+        seamicro_db.add_server_vlan(ctx, '2.2.2.2', '1/1', ['0'], 300)
+        bitmaps = seamicro_db.get_server_vlan_bitmaps(ctx, '1.1.1.1')
+        self.assertEqual({('1/1', ''): '100', ('1/1', '0'): '200-201'},
+                         dict((key, str(value))
+                              for key, value in bitmaps.items()))
+
+    def test_cursor(self):
+        """Tests saving and moving the cursor of a background task."""
+        ctx = context.get_admin_context()
+        self.assertIsNone(seamicro_db.get_cursor(ctx, 'gc', '1.1.1.1'))
+        seamicro_db.set_cursor(ctx, 'gc', '1.1.1.1', 'servers', '1/1')
+        seamicro_db.set_cursor(ctx, 'gc', '1.1.1.1', 'servers', '1/5')
+        seamicro_db.set_cursor(ctx, 'gc', '2.2.2.2', 'segments')
+        cursor = seamicro_db.get_cursor(ctx, 'gc', '1.1.1.1')
+        self.assertEqual(('1.1.1.1', 'servers', '1/5'),
+                         (cursor.switch_ip, cursor.phase, cursor.position))
+
+    def test_chassis_lease(self):
+        """Tests taking, renewing, taking over and releasing a lease."""
+        ctx = context.get_admin_context()
+        now = datetime.datetime(2015, 1, 1)
+        later = now + datetime.timedelta(seconds=30)
+        self.assertTrue(seamicro_db.take_chassis_lease(
+            ctx, '1.1.1.1', 'a', later, now))
+        self.assertFalse(seamicro_db.take_chassis_lease(
+            ctx, '1.1.1.1', 'b', later, now))
+        self.assertTrue(seamicro_db.take_chassis_lease(
+            ctx, '1.1.1.1', 'a', later, now))
+        self.assertTrue(seamicro_db.take_chassis_lease(
+            ctx, '1.1.1.1', 'b', later, later))
+        seamicro_db.release_chassis_lease(ctx, '1.1.1.1', 'a', now)
+        seamicro_db.release_chassis_lease(ctx, '1.1.1.1', 'b', now)
+        lease = seamicro_db.get_chassis_leases(ctx)[0]
+        self.assertEqual(('b', now), (lease.owner, lease.expires_at))
+
+    def test_live_owners(self):
+        """Tests listing and forgetting the owners by liveness."""
+        ctx = context.get_admin_context()
+        now = datetime.datetime(2015, 1, 1)
+        minute = datetime.timedelta(seconds=60)
+        seamicro_db.renew_owner(ctx, 'a', now - minute)
+        seamicro_db.renew_owner(ctx, 'b', now + minute)
+        self.assertEqual(set(['b']), seamicro_db.get_live_owners(ctx, now))
+        seamicro_db.delete_owners(ctx, now)
+        self.assertEqual(['b'], [entry.owner for entry in ctx.session.query(
+            seamicro_db.ML2_SeaMicroOwner)])
@@ -0,0 +1,95 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Fake chassis and ML2 contexts for the tests of the driver hooks."""
+
+import eventlet
+import mock
+
+from neutron import context
+from neutron.tests.unit import testlib_api
+from seamicro_ml2.ml2 import mech_driver
+
+SWITCH_IP = '1.1.1.1'
+
+# one chassis with two uplinks out of three interfaces, four hosts
+SWITCH = {SWITCH_IP: {'username': 'admin', 'password': 'secret',
+                      'api_version': '2', 'uplinks': '5/*',
+                      'compute[1-4]': '1/[1-4]'}}
+
+
+class FakeChassis(object):
+
+    def __init__(self):
+        self.system = mock.Mock()
+        self.system.list.return_value = [mock.Mock(segments='')]
+        self.interfaces = mock.Mock()
+        self.interfaces.list.return_value = [
+            mock.Mock(id=interface_id, taggedVlans='')
+            for interface_id in ('0/0', '5/0', '5/1')]
+        self.servers = mock.Mock()
+        self.servers.get.side_effect = lambda server_id: mock.Mock(nic={})
+
+
+class SeaMicroDriverTestCase(testlib_api.SqlTestCase):
+
+    """Base of the tests running the ML2 hooks against a fake chassis."""
+
+    def setUp(self):
+        super(SeaMicroDriverTestCase, self).setUp()
+        self.config(chassis_lease_duration=0, group='ml2_mech_seamicro')
+        self.chassis = FakeChassis()
+        self.get_client = mock.patch(
+            'seamicro_ml2.common.client.SeaMicroRestClient.get_client',
+            side_effect=lambda **kwargs: self.chassis).start()
+        self.addCleanup(mock.patch.stopall)
+        self.ctx = context.get_admin_context()
+
+    def _driver(self):
+        driver = mech_driver.SeaMicroDriver(**SWITCH)
+        driver.client.wait(SWITCH_IP)
+        # let the server handles warm up
+        eventlet.sleep(0.01)
+        return driver
+
+    def _network(self, driver, network_id, vlan):
+        mech_context = mock.Mock(
+            current={'id': network_id, 'tenant_id': 't',
+                     'provider:segmentation_id': vlan},
+            _plugin_context=self.ctx,
+            network_segments=[{'network_type': 'vlan', 'id': 's',
+                               'segmentation_id': vlan}])
+        driver.create_network_precommit(mech_context)
+        driver.create_network_postcommit(mech_context)
+        return mech_context
+
+    def _port_context(self, port_id, network_id, host, mac=None):
+        mech_context = mock.Mock(
+            current={'id': port_id, 'network_id': network_id,
+                     'tenant_id': 't', 'mac_address': mac},
+            _plugin_context=self.ctx)
+        mech_context._binding.host = host
+        return mech_context
+
+    def _create_port(self, driver, port_id, network_id, host, mac=None):
+        mech_context = self._port_context(port_id, network_id, host, mac)
+        driver.create_port_precommit(mech_context)
+        driver.create_port_postcommit(mech_context)
+        return mech_context
+
+    def _delete_port(self, driver, port_id, network_id, host):
+        mech_context = self._port_context(port_id, network_id, host)
+        driver.delete_port_precommit(mech_context)
+        driver.delete_port_postcommit(mech_context)
@@ -0,0 +1,135 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron import context
+from neutron.tests.unit import testlib_api
+from seamicro_ml2.common import vlans
+from seamicro_ml2.db import models as seamicro_db
+from seamicro_ml2.ml2 import audit
+from seamicro_ml2.tests.unit.ml2 import test_vlan_gc
+
+
+class SeaMicroAuditTest(testlib_api.SqlTestCase):
+
+    """Unit tests for the rolling chassis audit."""
+
+    def setUp(self):
+        super(SeaMicroAuditTest, self).setUp()
+        self.ctx = context.get_admin_context()
+        self.client = mock.Mock()
+        self.client.get_segments.side_effect = (
+            lambda: test_vlan_gc._future(vlans.VlanBitmap([100])))
+        self.client.get_interface_vlans.side_effect = (
+            lambda: test_vlan_gc._future(
+                {'0/0': vlans.VlanBitmap([100]), '0/1': vlans.VlanBitmap()}))
+        server_vlans = {'1/1': {'0': vlans.VlanBitmap([100])},
+                        '1/2': {'0': vlans.VlanBitmap(),
+                                '1': vlans.VlanBitmap([102])}}
+        self.client.get_server_vlans.side_effect = (
+            lambda server_id: test_vlan_gc._future(
+                server_vlans[server_id]))
+        for method in ('add_segment', 'tag_interfaces', 'tag_server'):
+            getattr(self.client, method).side_effect = (
+                lambda *args, **kwargs: test_vlan_gc._future())
+        self.clients = test_vlan_gc.FakeClients({'1.1.1.1': self.client})
+        for net_id, vlan in (('net1', '100'), ('net2', '102')):
+            seamicro_db.create_network(self.ctx, net_id, vlan, 'seg1',
+                                       'vlan', 'tenant1')
+        seamicro_db.add_server_vlan(self.ctx, '1.1.1.1', '1/1', ['0'], 100)
+        seamicro_db.add_server_vlan(self.ctx, '1.1.1.1', '1/2', [], 102)
+
+    def _auditor(self, **kwargs):
+        return audit.ChassisAuditor(
+            self.clients, lambda switch_ip: set(['1/1', '1/2']),
+            vlans_per_run=4095, **kwargs)
+
+    def _cursor(self):
+        cursor = seamicro_db.get_cursor(self.ctx, audit.CURSOR, '1.1.1.1')
+        return (cursor.phase, cursor.position)
+
+    def test_rolling_audit(self):
+        """Tests one full audit of a chassis, slice by slice."""
+        auditor = self._auditor(servers_per_run=1)
+        auditor.run_once()
+        self.assertEqual((audit.SERVERS, None), self._cursor())
+        self.assertEqual({audit.SEGMENT: 1, audit.INTERFACE: 3,
+                          audit.NIC: 0},
+                         auditor.stats('1.1.1.1')['drift_this_pass'])
+        # never from the chassis state, which hides drift
+        self.client.get_segments.assert_called_once_with()
+        auditor.run_once()
+        self.assertEqual((audit.SERVERS, '1/1'), self._cursor())
+        auditor.run_once()
+        self.assertEqual((audit.VLANS, None), self._cursor())
+        stats = auditor.stats('1.1.1.1')
+        self.assertEqual({audit.SEGMENT: 1, audit.INTERFACE: 3,
+                          audit.NIC: 1}, stats['drift'])
+        self.assertEqual({audit.SEGMENT: 0, audit.INTERFACE: 0,
+                          audit.NIC: 0}, stats['drift_this_pass'])
+        self.assertEqual(1, stats['passes'])
+        self.assertEqual(2, stats['servers_audited'])
+        self.assertEqual(0, stats['repair_queued'])
+        self.assertFalse(self.client.add_segment.called)
+
+    def test_vlans_per_run(self):
+        """Tests that the vlans are audited a window at a time."""
+        auditor = audit.ChassisAuditor(
+            self.clients, lambda switch_ip: set(), vlans_per_run=101)
+        auditor.run_once()
+        self.assertEqual((audit.VLANS, '101'), self._cursor())
+        self.assertEqual(0, auditor.stats('1.1.1.1')['drift_this_pass'][
+            audit.SEGMENT])
+        self.assertEqual(1, auditor.stats('1.1.1.1')['drift_this_pass'][
+            audit.INTERFACE])
+        auditor.run_once()
+        self.assertEqual((audit.VLANS, '202'), self._cursor())
+        self.assertEqual(1, auditor.stats('1.1.1.1')['drift_this_pass'][
+            audit.SEGMENT])
+        # the segments and uplinks are read once per pass
+        self.assertEqual(1, self.client.get_segments.call_count)
+        self.assertEqual(1, self.client.get_interface_vlans.call_count)
+
+    def test_drift_per_pass(self):
+        """Tests that each pass reports the drift it found."""
+        auditor = self._auditor(servers_per_run=2)
+        auditor.run_once()
+        auditor.run_once()
+        self.assertEqual(5, sum(auditor.stats('1.1.1.1')['drift'].values()))
+        self.client.get_interface_vlans.side_effect = (
+            lambda: test_vlan_gc._future(
+                {'0/0': vlans.VlanBitmap([100, 102])}))
+        auditor.run_once()
+        auditor.run_once()
+        stats = auditor.stats('1.1.1.1')
+        self.assertEqual({audit.SEGMENT: 1, audit.INTERFACE: 0,
+                          audit.NIC: 1}, stats['drift'])
+        self.assertEqual(2, stats['passes'])
+        self.assertEqual(2, self.client.get_segments.call_count)
+
+    def test_repair(self):
+        """Tests that the missing vlans still expected are tagged again."""
+        auditor = self._auditor(repair=True)
+        auditor.run_once()
+        self.assertEqual(3, auditor.stats('1.1.1.1')['repair_queued'])
+        seamicro_db.delete_network(self.ctx, 'net2')
+        auditor.run_once()
+        self.assertFalse(self.client.add_segment.called)
+        self.assertEqual([mock.call(100), mock.call(102)],
+                         sorted(self.client.tag_interfaces.call_args_list))
+        auditor.run_once()
+        self.client.tag_server.assert_called_once_with('1/2', 102, ['0'])
+        self.assertEqual(3, auditor.stats('1.1.1.1')['repaired'])
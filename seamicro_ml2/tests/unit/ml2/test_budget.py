@@ -0,0 +1,76 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Budgets of chassis calls and SQL statements of the ML2 hooks.
+
+A hook going over its budget is sending more requests to the chassis, or
+running more queries, than it did when the budget was set. Lower the
+budget when a change saves calls, raise it only knowingly.
+"""
+
+from seamicro_ml2.common import instrumentation
+from seamicro_ml2.tests.unit.ml2 import base
+
+
+class SeaMicroHookBudgetTest(base.SeaMicroDriverTestCase):
+
+    """Budget tests of the chassis calls and SQL statements per hook."""
+
+    def setUp(self):
+        super(SeaMicroHookBudgetTest, self).setUp()
+        self.driver = self._driver()
+        self.recorder = instrumentation.Recorder().start()
+        self.addCleanup(self.recorder.stop)
+
+    def assertBudget(self, hook, chassis_calls, sql_statements, index=-1):
+        invocation = self.recorder.of(hook)[index]
+        self.assertLessEqual(invocation.total_chassis_calls, chassis_calls,
+                             invocation)
+        self.assertLessEqual(invocation.sql_statements, sql_statements,
+                             invocation)
+
+    def test_network_budget(self):
+        """Tests the budget of creating a network."""
+        self._network(self.driver, 'net1', 100)
+        self.assertBudget('create_network_precommit', 0, 2)
+        self.assertBudget('create_network_postcommit', 2, 1)
+        self.assertEqual({'system.list': 1, 'system.add_segment': 1},
+                         self.recorder.of('create_network_postcommit')[0]
+                         .chassis_calls)
+
+    def test_port_budget(self):
+        """Tests the budget of the first and next ports of a vlan."""
+        self._network(self.driver, 'net1', 100)
+        self._create_port(self.driver, 'port1', 'net1', 'compute1')
+        # both uplinks and the server, whose handle is cached
+        self.assertBudget('create_port_precommit', 0, 3)
+        # the chassis vlan count is read and inserted with the server vlan
+        self.assertBudget('create_port_postcommit', 3, 5)
+        self._create_port(self.driver, 'port2', 'net1', 'compute1')
+        # the vlan is on the server and the uplinks already
+        self.assertBudget('create_port_postcommit', 0, 4)
+        self._create_port(self.driver, 'port3', 'net1', 'compute2')
+        self.assertBudget('create_port_postcommit', 1, 5)
+
+    def test_delete_port_budget(self):
+        """Tests the budget of deleting the ports of a vlan."""
+        self._network(self.driver, 'net1', 100)
+        self._create_port(self.driver, 'port1', 'net1', 'compute1')
+        self._create_port(self.driver, 'port2', 'net1', 'compute1')
+        self._delete_port(self.driver, 'port2', 'net1', 'compute1')
+        self.assertBudget('delete_port_precommit', 0, 3)
+        self.assertBudget('delete_port_postcommit', 0, 2)
+        self._delete_port(self.driver, 'port1', 'net1', 'compute1')
+        self.assertBudget('delete_port_postcommit', 3, 4)
@@ -0,0 +1,167 @@
+# Copyright (c) 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+from oslo_db import exception as db_exc
+
+from seamicro_ml2.common import chassis
+from seamicro_ml2.db import models as seamicro_db
+from seamicro_ml2.ml2 import mech_driver
+from seamicro_ml2.tests.unit.ml2 import base
+
+SWITCH_IP = base.SWITCH_IP
+
+
+class SeaMicroDiscoveryDriverTest(base.SeaMicroDriverTestCase):
+
+    """Tests of the hooks with discovered hosts."""
+
+    def setUp(self):
+        super(SeaMicroDiscoveryDriverTest, self).setUp()
+        self.config(host_discovery_interval=60, group='ml2_mech_seamicro')
+        self.chassis.servers.list.return_value = [
+            mock.Mock(id='2/0', hostname='baremetal1', nic={})]
+
+    def test_discovered_host_on_other_owner(self):
+        """Tests that a process tags hosts of chassis it does not own."""
+        driver = self._driver()
+        driver._ownership = mock.Mock(owns=lambda switch_ip: False)
+        driver._discovery.refresh()
+        self.assertIn('2/0', driver._chassis_servers(SWITCH_IP))
+        self._network(driver, 'net1', 100)
+        self._create_port(driver, 'port1', 'net1', 'baremetal1')
+        port = seamicro_db.get_port(self.ctx, 'port1')
+        self.assertEqual((SWITCH_IP, '2/0'), (port.switch_ip,
+                                              port.server_id))
+        self.chassis.servers.get.assert_any_call('2/0')
+
+
+    def test_delete_port_by_mac_without_placement(self):
+        """Tests that a port found by mac is untagged without a placement."""
+        self.chassis.servers.list.return_value = [
+            mock.Mock(id='2/1', hostname=None,
+                      nic={'0': {'macAddr': '00-22-99-00-00-02'}})]
+        driver = self._driver()
+        driver._discovery.refresh()
+        self._network(driver, 'net1', 100)
+        self._create_port(driver, 'port1', 'net1', 'node1',
+                          '00:22:99:00:00:02')
+        driver.delete_port_precommit(
+            self._port_context('port1', 'net1', 'node1', '00:22:99:00:00:02'))
+        mech_context = self._port_context('port1', 'net1', 'node1',
+                                          '00:22:99:00:00:02')
+        del mech_context._seamicro_placement
+        with mock.patch.object(driver, '_untag_port') as untag_port:
+            driver.delete_port_postcommit(mech_context)
+        untag_port.assert_called_once_with(self.ctx, SWITCH_IP, '2/1', ['0'],
+                                           100)
+
+
+class SeaMicroProcessDriverTest(base.SeaMicroDriverTestCase):
+
+    """Tests of the per-process start of the driver."""
+
+    def test_start_on_first_use(self):
+        """Tests that building the driver connects to no chassis."""
+        driver = mech_driver.SeaMicroDriver(**base.SWITCH)
+        eventlet.sleep(0.01)
+        self.assertFalse(self.get_client.called)
+        self._network(driver, 'net1', 100)
+        self.assertEqual(1, self.get_client.call_count)
+
+    def test_restart_in_forked_process(self):
+        """Tests that a forked worker bootstraps its own chassis clients."""
+        driver = self._driver()
+        clients = driver.client
+        self.assertEqual(1, self.get_client.call_count)
+        with mock.patch('os.getpid', return_value=-1):
+            self._network(driver, 'net1', 100)
+            self.assertIsNot(clients, driver.client)
+            self.assertTrue(driver.client.is_ready(SWITCH_IP))
+        self.assertEqual(2, self.get_client.call_count)
+
+
+class SeaMicroPortDriverTest(base.SeaMicroDriverTestCase):
+
+    """Tests of the port hooks."""
+
+    def test_create_port_db_error(self):
+        """Tests that a db error in postcommit drops the port row."""
+        driver = self._driver()
+        self._network(driver, 'net1', 100)
+        with mock.patch.object(seamicro_db, 'add_server_vlan',
+                               side_effect=db_exc.DBDuplicateEntry()):
+            self.assertRaises(Exception, self._create_port, driver,
+                              'port1', 'net1', 'compute1')
+        self.assertIsNone(seamicro_db.get_port(self.ctx, 'port1'))
+
+    def test_delete_port_postcommit_failure(self):
+        """Tests that a port row is gone even if the untagging fails."""
+        driver = self._driver()
+        self._network(driver, 'net1', 100)
+        self._create_port(driver, 'port1', 'net1', 'compute1')
+        with mock.patch.object(driver, '_untag_port',
+                               side_effect=chassis.ChassisNotReady(SWITCH_IP)):
+            self.assertRaises(Exception, self._delete_port, driver,
+                              'port1', 'net1', 'compute1')
+        self.assertIsNone(seamicro_db.get_port(self.ctx, 'port1'))
+
+
+class SeaMicroLazySegmentsDriverTest(base.SeaMicroDriverTestCase):
+
+    """Tests of the hooks with lazy_segments."""
+
+    def setUp(self):
+        super(SeaMicroLazySegmentsDriverTest, self).setUp()
+        self.config(lazy_segments=True, group='ml2_mech_seamicro')
+        self.system = self.chassis.system.list.return_value[0]
+
+    def _delete_network(self, driver, mech_context):
+        driver.delete_network_precommit(mech_context)
+        driver.delete_network_postcommit(mech_context)
+
+    def test_segment_follows_ports(self):
+        """Tests that the segment comes with the first port of a chassis."""
+        driver = self._driver()
+        driver.client[SWITCH_IP].get_segments().wait()
+        network = self._network(driver, 'net1', 100)
+        self.assertFalse(self.system.add_segment.called)
+        self._create_port(driver, 'port1', 'net1', 'compute1')
+        self._create_port(driver, 'port2', 'net1', 'compute2')
+        self.system.add_segment.assert_called_once_with(100)
+        self._delete_port(driver, 'port1', 'net1', 'compute1')
+        self.assertFalse(self.system.remove_segment.called)
+        self._delete_port(driver, 'port2', 'net1', 'compute2')
+        self.system.remove_segment.assert_called_once_with(100)
+
+        # the segments read are kept up to date by the port hooks
+        self._delete_network(driver, network)
+        self.system.remove_segment.assert_called_once_with(100)
+
+    def test_existing_network_segment_removed(self):
+        """Tests that a segment added before lazy_segments is removed."""
+        driver = self._driver()
+        network = self._network(driver, 'net1', 100)
+        self._delete_network(driver, network)
+        self.system.remove_segment.assert_called_once_with(100)
+
+    def test_segment_known_absent(self):
+        """Tests that a chassis read without the segment is left alone."""
+        driver = self._driver()
+        network = self._network(driver, 'net1', 100)
+        driver.client[SWITCH_IP].get_segments().wait()
+        self._delete_network(driver, network)
+        self.assertFalse(self.system.remove_segment.called)
@@ -0,0 +1,71 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_utils import timeutils
+
+from neutron.tests.unit import testlib_api
+from seamicro_ml2.ml2 import ownership
+
+SWITCH_IPS = ['10.0.0.%d' % i for i in range(1, 9)]
+
+
+class SeaMicroChassisOwnershipTest(testlib_api.SqlTestCase):
+
+    """Unit tests for the lease based chassis ownership."""
+
+    def setUp(self):
+        super(SeaMicroChassisOwnershipTest, self).setUp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.a = ownership.ChassisOwnership(SWITCH_IPS, 30, owner='a')
+        self.b = ownership.ChassisOwnership(SWITCH_IPS, 30, owner='b')
+
+    def _expected(self, owner, owners):
+        return set(switch_ip for switch_ip in SWITCH_IPS
+                   if ownership.preferred_owner(switch_ip, owners) == owner)
+
+    def test_single_owner(self):
+        """Tests that a single process owns every chassis."""
+        self.assertFalse(self.a.owns(SWITCH_IPS[0]))
+        self.a.heartbeat()
+        self.assertEqual(set(SWITCH_IPS), self.a.owned())
+
+    def test_sharding(self):
+        """Tests that the chassis are shared out with no overlap."""
+        self.a.heartbeat()
+        self.b.heartbeat()
+        self.a.heartbeat()
+        timeutils.advance_time_seconds(10)
+        self.b.heartbeat()
+        self.assertEqual(self._expected('a', ['a', 'b']), self.a.owned())
+        self.assertEqual(self._expected('b', ['a', 'b']), self.b.owned())
+        self.assertEqual(set(SWITCH_IPS), self.a.owned() | self.b.owned())
+
+    def test_takeover(self):
+        """Tests that the chassis of a dead process are taken over."""
+        self.a.heartbeat()
+        self.b.heartbeat()
+        self.a.heartbeat()
+        self.b.heartbeat()
+        timeutils.advance_time_seconds(31)
+        self.assertEqual(set(), self.a.owned())
+        self.b.heartbeat()
+        self.assertEqual(set(SWITCH_IPS), self.b.owned())
+
+    def test_expired_lease_not_owned(self):
+        """Tests that leases which were not renewed are given up."""
+        self.a.heartbeat()
+        timeutils.advance_time_seconds(30)
+        self.assertFalse(self.a.owns(SWITCH_IPS[0]))
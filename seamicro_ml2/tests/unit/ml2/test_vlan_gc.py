@@ -0,0 +1,178 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+
+from neutron import context
+from neutron.tests.unit import testlib_api
+from seamicro_ml2.common import vlans
+from seamicro_ml2.db import models as seamicro_db
+from seamicro_ml2.ml2 import vlan_gc
+
+
+class FakeClients(dict):
+
+    def is_ready(self, switch_ip):
+        return switch_ip in self
+
+
+def _future(result=None):
+    return eventlet.spawn(lambda: result)
+
+
+class SeaMicroVlanGcTest(testlib_api.SqlTestCase):
+
+    """Unit tests for the orphaned vlan garbage collector."""
+
+    def setUp(self):
+        super(SeaMicroVlanGcTest, self).setUp()
+        self.ctx = context.get_admin_context()
+        self.client = mock.Mock()
+        self.client.get_segments.return_value = _future(
+            vlans.VlanBitmap([5, 100, 101]))
+        self.client.get_interface_vlans.return_value = _future(
+            {'0/0': vlans.VlanBitmap([100, 101]),
+             '0/1': vlans.VlanBitmap([101])})
+        server_vlans = {'1/1': {'0': vlans.VlanBitmap([100, 101]),
+                                '1': vlans.VlanBitmap()},
+                        '1/2': {'0': vlans.VlanBitmap([101])},
+                        '1/3': {'0': vlans.VlanBitmap([101])}}
+        self.client.get_server_vlans.side_effect = (
+            lambda server_id, max_age=0: _future(server_vlans[server_id]))
+        for method in ('remove_segment', 'untag_interface', 'untag_server'):
+            getattr(self.client, method).side_effect = (
+                lambda *args, **kwargs: _future())
+        self.clients = FakeClients({'1.1.1.1': self.client})
+        self.gc = vlan_gc.VlanGarbageCollector(
+            self.clients, lambda switch_ip: set(['1/1', '1/2', '1/3']),
+            vlan_gc.parse_vlan_ranges(['100:199']), batch_size=2,
+            grace_period=0)
+        seamicro_db.create_network(self.ctx, 'net1', '100', 'seg1', 'vlan',
+                                   'tenant1')
+        seamicro_db.add_server_vlan(self.ctx, '1.1.1.1', '1/1', ['0'], 100)
+
+    def _cursor(self):
+        cursor = seamicro_db.get_cursor(self.ctx, vlan_gc.CURSOR, '1.1.1.1')
+        return (cursor.switch_ip, cursor.phase, cursor.position)
+
+    def test_parse_vlan_ranges(self):
+        """Tests parsing the managed vlan ranges."""
+        self.assertEqual([(100, 199), (300, 300)],
+                         vlan_gc.parse_vlan_ranges(['100:199', ' 300']))
+        self.assertRaises(ValueError, vlan_gc.parse_vlan_ranges, ['1:2:3'])
+
+    def _first_walk(self):
+        # finds the orphans without removing them
+        for i in range(4):
+            self.gc.run_once()
+        self.assertEqual(0, self.gc.removed)
+        self.assertEqual(('1.1.1.1', vlan_gc.SEGMENTS, None), self._cursor())
+
+    def test_walk(self):
+        """Tests one full walk of a chassis, slice by slice."""
+        self._first_walk()
+        self.gc.run_once()
+        self.client.remove_segment.assert_called_once_with(101)
+        self.assertEqual(('1.1.1.1', vlan_gc.INTERFACES, None),
+                         self._cursor())
+
+        self.gc.run_once()
+        self.assertEqual([mock.call('0/0', 101), mock.call('0/1', 101)],
+                         self.client.untag_interface.call_args_list)
+        self.assertEqual(('1.1.1.1', vlan_gc.SERVERS, None), self._cursor())
+
+        self.gc.run_once()
+        self.assertEqual([mock.call('1/1', 101, ['0']),
+                          mock.call('1/2', 101, ['0'])],
+                         self.client.untag_server.call_args_list)
+        self.assertEqual(('1.1.1.1', vlan_gc.SERVERS, '1/2'), self._cursor())
+
+        self.gc.run_once()
+        self.assertEqual(mock.call('1/3', 101, ['0']),
+                         self.client.untag_server.call_args)
+        self.assertEqual(('1.1.1.1', vlan_gc.SEGMENTS, None), self._cursor())
+        self.assertEqual(6, self.gc.removed)
+
+    def test_port_vlans_kept(self):
+        """Tests that vlans of existing ports are never untagged."""
+        seamicro_db.create_port(self.ctx, 'port1', 'net2', '101', 'tenant1')
+        for i in range(4):
+            self.gc.run_once()
+        self.assertFalse(self.client.untag_interface.called)
+        self.assertFalse(self.client.untag_server.called)
+
+    def test_chassis_not_ready_skipped(self):
+        """Tests that a chassis which is not ready is skipped."""
+        self.clients.is_ready = lambda switch_ip: False
+        self.gc.run_once()
+        self.assertFalse(self.client.get_segments.called)
+        self.assertIsNone(seamicro_db.get_cursor(self.ctx, vlan_gc.CURSOR,
+                                                 '1.1.1.1'))
+
+    def test_chassis_of_other_owner_skipped(self):
+        """Tests that only the chassis owned by the process are walked."""
+        other = mock.Mock()
+        self.clients['2.2.2.2'] = other
+        gc = vlan_gc.VlanGarbageCollector(
+            self.clients, lambda switch_ip: set(['1/1', '1/2', '1/3']),
+            vlan_gc.parse_vlan_ranges(['100:199']), batch_size=2,
+            owns=lambda switch_ip: switch_ip == '1.1.1.1')
+        for i in range(4):
+            gc.run_once()
+        self.assertFalse(other.get_segments.called)
+        self.assertEqual(('1.1.1.1', vlan_gc.SEGMENTS, None), self._cursor())
+
+    def test_grace_period(self):
+        """Tests that an orphan is only removed after the grace period."""
+        self.gc._grace_period = 60
+        with mock.patch('time.time', return_value=1000):
+            self._first_walk()
+        with mock.patch('time.time', return_value=1059):
+            self._first_walk()
+        with mock.patch('time.time', return_value=1060):
+            self.gc.run_once()
+        self.client.remove_segment.assert_called_once_with(101)
+
+    def test_chassis_read_before_db(self):
+        """Tests that a vlan added while the chassis is read is kept."""
+        self._first_walk()
+
+        def add_network():
+            seamicro_db.create_network(self.ctx, 'net2', '101', 'seg2',
+                                       'vlan', 'tenant1')
+            return _future(vlans.VlanBitmap([5, 100, 101]))
+        self.client.get_segments.side_effect = add_network
+        self.client.get_segments.return_value = None
+        self.gc.run_once()
+        self.assertFalse(self.client.remove_segment.called)
+
+    def test_resume_after_failed_batch(self):
+        """Tests that a failing batch does not pin the cursor."""
+        self.client.get_segments.return_value = _future(
+            vlans.VlanBitmap([5, 100, 101, 102, 103]))
+        self.client.remove_segment.side_effect = (
+            lambda *args, **kwargs: eventlet.spawn(self.fail_call))
+        self._first_walk()
+        self.gc.run_once()
+        self.assertEqual(('1.1.1.1', vlan_gc.SEGMENTS, '102'),
+                         self._cursor())
+        self.gc.run_once()
+        self.assertEqual(mock.call(103), self.client.remove_segment.call_args)
+        self.assertEqual(('1.1.1.1', vlan_gc.INTERFACES, None),
+                         self._cursor())
+
+    def fail_call(self):
+        raise Exception('chassis error')
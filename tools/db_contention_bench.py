@@ -0,0 +1,178 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the SeaMicro server vlan references under contention.
+
+Many writer threads take and drop references on the vlan of a small set of
+servers, as creating and deleting ports does, either with the
+compare-and-swap add_server_vlan() and remove_server_vlan() of
+seamicro_ml2.db.models ('cas') or by locking the row first ('lock'). The
+throughput, conflicts (writes giving up after MAX_CAS_ATTEMPTS) and
+deadlock retries of each mode are printed. Point --url at the database the
+neutron-server processes use, e.g. a MySQL Galera cluster, the table is
+created if missing and the benchmark rows are removed at the end.
+
+    python tools/db_contention_bench.py --url mysql://user:pw@host/neutron \\
+        --writers 64 --ops 200 --rows 16
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from oslo_db import exception as db_exc
+from oslo_db.sqlalchemy import session as db_session
+
+from seamicro_ml2.db import models as seamicro_db
+
+PREFIX = 'bench-'
+SWITCH_IP = 'bench'
+VLAN = 100
+
+
+class Context(object):
+
+    def __init__(self, session):
+        self.session = session
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = 0
+        self.conflicts = 0
+        self.deadlocks = 0
+        self.errors = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+
+def _server_id(row):
+    return '%s%d' % (PREFIX, row)
+
+
+def cas_write(context, server_id, stats):
+    """Take or drop a reference on a server vlan without locking."""
+    if random.random() < 0.5:
+        seamicro_db.add_server_vlan(context, SWITCH_IP, server_id, [], VLAN)
+    else:
+        seamicro_db.remove_server_vlan(context, SWITCH_IP, server_id, [],
+                                       VLAN)
+
+
+def lock_write(context, server_id, stats):
+    """Take or drop a reference on a server vlan under a row lock."""
+    session = context.session
+    add = random.random() < 0.5
+    with session.begin():
+        entry = session.query(seamicro_db.ML2_SeaMicroServerVlan).filter_by(
+            switch_ip=SWITCH_IP, server_id=server_id, nic='',
+            vlan=VLAN).with_lockmode('update').first()
+        if entry is None:
+            if add:
+                session.add(seamicro_db.ML2_SeaMicroServerVlan(
+                    switch_ip=SWITCH_IP, server_id=server_id, nic='',
+                    vlan=VLAN, ref_count=1))
+            return
+        entry.ref_count += 1 if add else -1
+        if entry.ref_count <= 0:
+            session.delete(entry)
+
+
+def writer(facade, write, rows, ops, stats):
+    context = Context(facade.get_session())
+    for i in range(ops):
+        server_id = _server_id(random.randrange(rows))
+        while True:
+            try:
+                write(context, server_id, stats)
+                break
+            except db_exc.DBDeadlock:
+                stats.add(deadlocks=1)
+            except (seamicro_db.ConcurrentUpdateError,
+                    db_exc.DBDuplicateEntry):
+                # gave up, or another writer inserted the row first
+                stats.add(conflicts=1)
+                break
+            except Exception:
+                stats.add(errors=1)
+                break
+            finally:
+                context.session.expunge_all()
+        stats.add(ops=1)
+
+
+def reset(facade, rows):
+    context = Context(facade.get_session())
+    session = context.session
+    with session.begin():
+        session.query(seamicro_db.ML2_SeaMicroServerVlan).filter_by(
+            switch_ip=SWITCH_IP).delete(synchronize_session=False)
+    for row in range(rows):
+        seamicro_db.add_server_vlan(context, SWITCH_IP, _server_id(row), [],
+                                    VLAN)
+
+
+def run(facade, mode, args):
+    reset(facade, args.rows)
+    stats = Stats()
+    write = cas_write if mode == 'cas' else lock_write
+    threads = [threading.Thread(target=writer,
+                                args=(facade, write, args.rows, args.ops,
+                                      stats))
+               for i in range(args.writers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    print('%-5s %8d ops %8.1f ops/s %9d conflicts %9d deadlocks '
+          '%6d errors' % (mode, stats.ops, stats.ops / elapsed,
+                          stats.conflicts, stats.deadlocks, stats.errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='sqlite:////tmp/seamicro_bench.db',
+                        help='database to run against')
+    parser.add_argument('--writers', type=int, default=32,
+                        help='number of concurrent writers')
+    parser.add_argument('--ops', type=int, default=100,
+                        help='writes done by each writer')
+    parser.add_argument('--rows', type=int, default=8,
+                        help='number of servers written to')
+    parser.add_argument('--mode', choices=('cas', 'lock', 'both'),
+                        default='both')
+    args = parser.parse_args()
+
+    facade = db_session.EngineFacade(args.url, autocommit=True)
+    engine = facade.get_engine()
+    seamicro_db.ML2_SeaMicroServerVlan.__table__.create(engine,
+                                                        checkfirst=True)
+    modes = ('lock', 'cas') if args.mode == 'both' else (args.mode,)
+    try:
+        for mode in modes:
+            run(facade, mode, args)
+    finally:
+        reset(facade, 0)
+
+
+if __name__ == '__main__':
+    main()